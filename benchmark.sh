@@ -2,7 +2,8 @@
 # Author: Marios Yiannakou
 #
 # Runs all benchmarks in the `implementations` and `markdown-parser` directories sequentially,
-# and creates a report inside `benchmarks`.
+# and creates a report inside `benchmarks`. Every run is also recorded, with its samples, in the
+# SQLite database `benchmarks/benchmarks.sqlite`, to compare results across benchmarks.
 #
 # Usage:
 # - Navigate to the repositorys root directory.
@@ -109,6 +110,7 @@ CURRENT_DIR=$(pwd)
 PROGRAMS_DIR="${CURRENT_DIR}/implementations"
 BENCHMARKS_DIR="${CURRENT_DIR}/benchmarks"
 BENCHMARKS_FILE="${BENCHMARKS_DIR}/$(date +%F_%H%M)"
+BENCHMARKS_DATABASE="${BENCHMARKS_DIR}/benchmarks.sqlite"
 MARKDOWN_DIR="${CURRENT_DIR}/markdown-parser"
 
 DEPENDENCIES_DIR="${CURRENT_DIR}/dependencies"
@@ -122,6 +124,7 @@ INTERVAL=1
 # Create the benchmarks directory if it doesn't exist
 if ! test -d $BENCHMARKS_DIR; then
     mkdir $BENCHMARKS_DIR
+fi
 
 # Capture any CL flags provided
 BENCHMARK=1
@@ -141,6 +144,11 @@ while test $# -gt 0; do
         shift
         DISPLAY=1
         ;;
+    --database)
+        shift
+        BENCHMARKS_DATABASE=$1
+        shift
+        ;;
     -h|--help)
         echo "The Computer Language Benchmarks Game"
         echo "Author: Marios Yiannakou"
@@ -149,10 +157,11 @@ while test $# -gt 0; do
         echo "written in the implementations directory. The script compiles and runs"
         echo "all language implementations of one algorithm, before moving to the next."
         echo ""
-        echo "Usage: ./benchmarks.sh [--csv] [-d|--display-report] [-h|--help] [-n|--name <file_name>] [-r 100|--runs 100] [-t|--test] [-v|--verbose] [--test-and-benchmark]"
+        echo "Usage: ./benchmarks.sh [--csv] [--database <file>] [-d|--display-report] [-h|--help] [-n|--name <file_name>] [-r 100|--runs 100] [-t|--test] [-v|--verbose] [--test-and-benchmark]"
         echo ""
         echo "Options:"
         echo "--csv                 save the benchmark results as a CSV file"
+        echo "--database            the SQLite database to record every run in. Defaults to benchmarks/benchmarks.sqlite"
         echo "-d, --display-report  display the benchmark report after completion"
         echo "-h, --help            show this help message and exit"
         echo "-n, --name            change the name of the output file. Defaults to the current datetime"
@@ -281,49 +290,22 @@ function time_taken() {
     OG_IFS=$IFS
     IFS=$'\n'
 
-    TEMP_FILE="tmp_bench"
-    TEMP_TIME_FILE="tmp_time"
-
-    # Get the command output and cut the top line (header line)
-    { python $SYRUPY -S -C --no-raw-process-log $@ 2> $TEMP_TIME_FILE; } | sed 1d > $TEMP_FILE
-
-    LAST_LINE=$(tail $TEMP_FILE -n 1)
-    ELAPSED_TIME_HOURS=$(grep "Total run time" $TEMP_TIME_FILE | awk '{print $5}')
-    ELAPSED_TIME_MINUTES=$(grep "Total run time" $TEMP_TIME_FILE | awk '{print $7}')
-    ELAPSED_TIME_SECONDS=$(grep "Total run time" $TEMP_TIME_FILE | awk '{print $9}')
-    elapsed_time=$(bc <<< "$ELAPSED_TIME_HOURS * 3600 + $ELAPSED_TIME_MINUTES * 60 + $ELAPSED_TIME_SECONDS")
-    # Offset 'Total run time' with the 'real' time the program run for
-    # This is to get rough estimate at a higher accuracy, rather than the run time at second accuracy
-    estimate_time=$(echo $LAST_LINE | awk '{print $4}')
-    readarray -d ":" -t ESTIMATE_TIME_ARR <<< $estimate_time
-    estimate_time=$((10#${ESTIMATE_TIME_ARR[0]} * 60 + 10#${ESTIMATE_TIME_ARR[1]}))
-    elapsed_time=$(bc <<< "$elapsed_time - ($(float_to_int $elapsed_time) - $estimate_time)")
-
-    local_average_cpu=$(float_to_int $(echo $LAST_LINE | awk '{print $5}'))
-    local_average_rss=$(echo $LAST_LINE | awk '{print $7}')
-    local_average_vms=$(echo $LAST_LINE | awk '{print $8}')
-
-    # Cut the last line from the file as it is only used for the total elapsed time
-    # of the process under investigation.
-    # Accumulate the sum of all readings for each measurement
-    for line in $(cat $TEMP_FILE | sed \$d); do
-        CURRENT_CPU=$(float_to_int $(echo $line | awk '{print $5}'))
-        local_average_cpu=$(($local_average_cpu + $CURRENT_CPU))
-
-        CURRENT_RSS=$(echo $line | awk '{print $7}')
-        local_average_rss=$(($local_average_rss + $CURRENT_RSS))
-
-        CURRENT_VMS=$(echo $line | awk '{print $8}')
-        local_average_vms=$(($local_average_vms + $CURRENT_VMS))
-    done
-
-    # Calculate the average of each measurement
-    NUM_OF_LINES=$(wc -l $TEMP_FILE | awk '{print $1}')
-    if [ $NUM_OF_LINES -gt 2 ]; then
-        local_average_cpu=$(($local_average_cpu / $NUM_OF_LINES))
-        local_average_rss=$(($local_average_rss / $NUM_OF_LINES))
-        local_average_vms=$(($local_average_vms / $NUM_OF_LINES))
-    fi
+    # Profile the command and keep the summary record, which syrupy writes last,
+    # after the output of the command. The run is also recorded in the database,
+    # labelled with the name of the report.
+    SUMMARY=$(python $SYRUPY -S -C -a -T -f jsonl --no-raw-process-log \
+        --sqlite "$BENCHMARKS_DATABASE" --label "$(basename $BENCHMARKS_FILE)" \
+        --language "$language" --algorithm "$algorithm" $@ 2> /dev/null | tail -n 1)
+
+    # The exact elapsed time, and the mean CPU usage, RSS and VMS of all the samples
+    # rounded to integers.
+    IFS=" " read elapsed_time local_average_cpu local_average_rss local_average_vms <<< $(
+        python -c '
+import json, sys
+summary = json.loads(sys.argv[1])
+means = [round(summary[field]["mean"] or 0) for field in ("cpu", "rss", "vsz")]
+print("%.9f" % summary["elapsed"], *means)' "$SUMMARY"
+    )
 
     # Safeguard against fractions rounded to 0.
     if [ $local_average_cpu -le 1 ]; then
@@ -357,10 +339,7 @@ function time_taken() {
     vms_score=$(((6000 / $local_average_vms) * 10))
 
     # Cleanup
-    # - Delete temporary file(s)
     # - Reset the IFS
-    rm $TEMP_FILE
-    rm $TEMP_TIME_FILE
     IFS=$OG_IFS
 
     echo "$elapsed_time $local_average_cpu $local_average_rss $local_average_vms $(($time_score + $cpu_score + $rss_score + $vms_score))"
@@ -585,38 +564,48 @@ function bench_markdowns() {
                 echo "($language) has no compilation steps. Did you forget to update the benchmark script?"
                 ;;
         esac
+        # Parsing an empty file measures the startup cost of the parser (e.g. starting the
+        # interpreter and importing modules) on its own, next to the cost of a full parse.
+        STARTUP_COMMAND="${COMMAND% --demo} /dev/null"
         if [ $BENCHMARK -eq 1 ]; then
-            reset_globals
-            for count in $(eval echo {1..$RUNS}); do
-                echo -ne "[${language}/markdown-parser-$(seq -f "%0${#RUNS}g" $count $count)]\t...\r"
-                # https://stackoverflow.com/questions/23564995/how-to-modify-a-global-variable-within-a-function-in-bash
-                readarray -d " " -t TIME_FNC <<< $(time_taken ${COMMAND})
-                update_globals ${TIME_FNC[@]}
-                if [ $VERBOSE -eq 1 ]; then
+            for algorithm in markdown-parser markdown-parser-startup; do
+                if [ $algorithm == "markdown-parser-startup" ]; then
+                    RUN_COMMAND=$STARTUP_COMMAND
+                else
+                    RUN_COMMAND=$COMMAND
+                fi
+                reset_globals
+                for count in $(eval echo {1..$RUNS}); do
+                    echo -ne "[${language}/${algorithm}-$(seq -f "%0${#RUNS}g" $count $count)]\t...\r"
+                    # https://stackoverflow.com/questions/23564995/how-to-modify-a-global-variable-within-a-function-in-bash
+                    readarray -d " " -t TIME_FNC <<< $(time_taken ${RUN_COMMAND})
+                    update_globals ${TIME_FNC[@]}
+                    if [ $VERBOSE -eq 1 ]; then
+                        if [ $CSV -eq 1 ]; then
+                            echo -e "${language},${algorithm},$(seq -f "%0${#RUNS}g" $count $count),${total_time},${global_average_cpu},${global_average_rss},${global_average_vms},$score" >> $BENCHMARKS_FILE
+                        else
+                            echo -e "${language}|${algorithm}|$(seq -f "%0${#RUNS}g" $count $count)|${total_time}|${global_average_cpu}|${global_average_rss}|${global_average_vms}|$score" >> $BENCHMARKS_FILE
+                        fi
+                        reset_globals
+                    fi
+                done
+
+                echo -e "[${language}/${algorithm}-$(seq -f "%0${#RUNS}g" ${RUNS} ${RUNS})]\t...${total_time}s"
+                if [ $VERBOSE -eq 0 ]; then
+                    global_average_cpu=$(($global_average_cpu / $RUNS))
+                    global_average_rss=$(($global_average_rss / $RUNS))
+                    global_average_vms=$(($global_average_vms / $RUNS))
+                    score=$(($score / $RUNS))
                     if [ $CSV -eq 1 ]; then
-                        echo -e "${language},markdown-parser,$(seq -f "%0${#RUNS}g" $count $count),${total_time},${global_average_cpu},${global_average_rss},${global_average_vms},$score" >> $BENCHMARKS_FILE
+                        echo -e "${language},${algorithm},${RUNS},${total_time},${global_average_cpu},${global_average_rss},${global_average_vms},$score" >> $BENCHMARKS_FILE
                     else
-                        echo -e "${language}|markdown-parser|$(seq -f "%0${#RUNS}g" $count $count)|${total_time}|${global_average_cpu}|${global_average_rss}|${global_average_vms}|$score" >> $BENCHMARKS_FILE
+                        echo -e "${language}|${algorithm}|${RUNS}|${total_time}|${global_average_cpu}|${global_average_rss}|${global_average_vms}|$score" >> $BENCHMARKS_FILE
                     fi
-                    reset_globals
                 fi
+                total_time=0
+                # File created from the markdown parser.
+                rm "parsed.html"
             done
-
-            echo -e "[${language}/markdown-parser-$(seq -f "%0${#RUNS}g" ${RUNS} ${RUNS})]\t...${total_time}s"
-            if [ $VERBOSE -eq 0 ]; then
-                global_average_cpu=$(($global_average_cpu / $RUNS))
-                global_average_rss=$(($global_average_rss / $RUNS))
-                global_average_vms=$(($global_average_vms / $RUNS))
-                score=$(($score / $RUNS))
-                if [ $CSV -eq 1 ]; then
-                    echo -e "${language},markdown-parser,${RUNS},${total_time},${global_average_cpu},${global_average_rss},${global_average_vms},$score" >> $BENCHMARKS_FILE
-                else
-                    echo -e "${language}|markdown-parser|${RUNS}|${total_time}|${global_average_cpu}|${global_average_rss}|${global_average_vms}|$score" >> $BENCHMARKS_FILE
-                fi
-            fi
-            total_time=0
-            # File created from the markdown parser.
-            rm "parsed.html"
         fi
         cd .. || exit 3
         sleep $INTERVAL
@@ -24,14 +24,23 @@
 Profile the memory and CPU usage of a command.
 """
 
+import asyncio
 import datetime
+import heapq
+import itertools
+import json
 import locale
 import os
+import platform
 import re
+import resource
+import select
+import sqlite3
 import subprocess
 import sys
 import textwrap
 import time
+from array import array
 from optparse import OptionGroup, OptionParser
 
 ON_POSIX = "posix" in sys.builtin_module_names
@@ -109,10 +118,175 @@ PS_FIELD_HELP = [
         """
 	 Running process path and command line arguments.""",
     ],
+    [
+        "THREADS",
+        """
+    The number of threads of the process (with --extended).""",
+    ],
+    [
+        "MINFLT/s",
+        """
+    Minor page faults per second since the previous sample: pages
+    mapped without reading from disk (with --extended).""",
+    ],
+    [
+        "MAJFLT/s",
+        """
+    Major page faults per second since the previous sample: pages read
+    from disk (with --extended).""",
+    ],
+    [
+        "VCSW/s",
+        """
+    Voluntary context switches per second since the previous sample,
+    e.g. waiting for I/O (with --extended).""",
+    ],
+    [
+        "NVCSW/s",
+        """
+    Involuntary context switches per second since the previous sample,
+    i.e. preempted by the scheduler (with --extended).""",
+    ],
+    [
+        "READ/s",
+        """
+    Bytes read per second since the previous sample, including from the
+    page cache, pipes and terminals (with --extended).""",
+    ],
+    [
+        "WRITE/s",
+        """
+    Bytes written per second since the previous sample (with
+    --extended).""",
+    ],
+    [
+        "SYSCR/s",
+        """
+    Read system calls per second since the previous sample (with
+    --extended).""",
+    ],
+    [
+        "SYSCW/s",
+        """
+    Write system calls per second since the previous sample (with
+    --extended).""",
+    ],
 ]
 
 POLL_INTERVAL = 0.5
 
+# Adaptive sampling starts polling every MIN_POLL_INTERVAL seconds and multiplies
+# the interval by POLL_BACKOFF after every sample, up to the polling interval, so
+# that short processes get many samples and long processes are not oversampled.
+MIN_POLL_INTERVAL = 0.0001
+POLL_BACKOFF = 2.0
+
+# Sampling backends: "proc" reads /proc/<pid> directly, "ps" calls ps, and "auto"
+# uses /proc when it is available for the process being sampled.
+BACKENDS = ["auto", "proc", "ps"]
+PROC_DIR = "/proc"
+PROC_FILES = ["stat", "statm", "status", "cmdline"]
+PROC_READ_SIZE = 65536
+
+# Fields the top memory processes can be ranked by, and how often all the
+# processes on the host are scanned for them through /proc, in polling
+# intervals.
+TOP_RANKS = ["vsz", "rss"]
+TOP_SCAN_INTERVALS = 5
+
+# Counters sampled with --extended, from /proc/<pid>/stat, status and io, each
+# with the column header of its rate per second since the previous sample.
+EXTENDED_COUNTERS = [
+    ("minflt", "MINFLT/s"),
+    ("majflt", "MAJFLT/s"),
+    ("vcsw", "VCSW/s"),
+    ("nvcsw", "NVCSW/s"),
+    ("rchar", "READ/s"),
+    ("wchar", "WRITE/s"),
+    ("syscr", "SYSCR/s"),
+    ("syscw", "SYSCW/s"),
+]
+STATUS_COUNTERS = {
+    "voluntary_ctxt_switches:": "vcsw",
+    "nonvoluntary_ctxt_switches:": "nvcsw",
+}
+IO_COUNTERS = ["rchar", "wchar", "syscr", "syscw"]
+
+# "text" writes aligned columns, and "jsonl" writes a JSON object per sample
+# followed by a summary record.
+OUTPUT_FORMATS = ["text", "jsonl"]
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+# The bounded history of --history keeps every sample of the last HISTORY_DETAIL
+# seconds, up to HISTORY_CAPACITY of them, and downsamples older samples into
+# buckets of each (resolution in seconds, number of buckets) tier in turn: an
+# hour of 1 second buckets, then a week of 1 minute buckets.
+HISTORY_DETAIL = 60
+HISTORY_CAPACITY = 4096
+HISTORY_TIERS = [(1, 3600), (60, 10080)]
+HISTORY_METRICS = ["cpu", "mem", "rss", "vsz"]
+
+# The database of --sqlite. Samples are inserted in transactions of
+# SQLITE_BATCH_SIZE rows, and writers wait up to SQLITE_TIMEOUT seconds for each
+# other. Runs are indexed by language, algorithm and start time.
+SQLITE_BATCH_SIZE = 500
+SQLITE_TIMEOUT = 30.0
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    label TEXT,
+    language TEXT,
+    algorithm TEXT,
+    command TEXT NOT NULL,
+    elapsed REAL,
+    exit_code INTEGER,
+    max_rss INTEGER,
+    user_time REAL,
+    system_time REAL,
+    voluntary_switches INTEGER,
+    involuntary_switches INTEGER,
+    minor_faults INTEGER,
+    major_faults INTEGER,
+    observer_cpu_time REAL,
+    observer_overhead REAL
+);
+CREATE TABLE IF NOT EXISTS environment (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    datetime TEXT NOT NULL,
+    elapsed REAL,
+    pid INTEGER,
+    cpu REAL,
+    mem REAL,
+    rss INTEGER,
+    vsz INTEGER,
+    threads INTEGER
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    metric TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL,
+    min REAL,
+    max REAL,
+    p50 REAL,
+    p95 REAL,
+    p99 REAL,
+    PRIMARY KEY (run_id, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_by_language ON runs (language, algorithm, started_at);
+CREATE INDEX IF NOT EXISTS runs_by_algorithm ON runs (algorithm, started_at);
+CREATE INDEX IF NOT EXISTS runs_by_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS samples_by_run ON samples (run_id, elapsed);
+"""
+
 
 def column_help(keyword_width=10, total_width=70):
     help = []
@@ -213,6 +387,548 @@ def poll_process(
     return records
 
 
+class ProcSampler(object):
+    """
+    Samples a single process by reading its files in /proc directly, instead of
+    calling ps and searching every process on the host. The files are opened once
+    and re-read from the start with `os.pread` for every sample, which costs a few
+    system calls instead of a process spawn. Produces the same fields as
+    `poll_process`, and if `extended` is True, the thread count and the
+    `EXTENDED_COUNTERS` with their rates, read from /proc/<pid>/io as well.
+    The io file is only readable for processes of the same user, so its
+    counters are left out for other processes.
+    """
+
+    def __init__(self, pid, command_pattern=None, extended=False):
+        self.pid = int(pid)
+        self.command_pattern = command_pattern
+        self.extended = extended
+        self.previous = (0.0, {})
+        self.fds = {}
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE") // 1024
+        self.mem_total = None
+        try:
+            for name in PROC_FILES:
+                self.fds[name] = os.open(
+                    os.path.join(PROC_DIR, str(self.pid), name), os.O_RDONLY
+                )
+            if extended:
+                try:
+                    self.fds["io"] = os.open(
+                        os.path.join(PROC_DIR, str(self.pid), "io"), os.O_RDONLY
+                    )
+                except PermissionError:
+                    pass
+            with open(os.path.join(PROC_DIR, "meminfo")) as meminfo:
+                for line in meminfo:
+                    if line.startswith("MemTotal:"):
+                        self.mem_total = int(line.split()[1])
+                        break
+        except OSError:
+            self.close()
+            raise
+
+    def read(self, name):
+        return os.pread(self.fds[name], PROC_READ_SIZE, 0).decode(ENCODING, "replace")
+
+    def poll(self, raw_ps_log=None, debug_level=0):
+        """
+        Returns a list with the record of the process, or an empty list if it
+        has exited, is a zombie or does not match the command pattern.
+        """
+        if not self.fds:
+            return []
+        try:
+            stat = self.read("stat")
+            statm = self.read("statm")
+            status = self.read("status")
+            cmdline = self.read("cmdline")
+            io = self.read("io") if "io" in self.fds else ""
+        except OSError:
+            # ESRCH once the process has been reaped.
+            self.close()
+            return []
+        poll_time = datetime.datetime.now()
+        uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+
+        if debug_level >= 9:
+            sys.stderr.write(stat + statm)
+        if raw_ps_log is not None:
+            raw_ps_log.write(stat.rstrip("\n") + " " + statm)
+
+        # The command name is in parentheses and may contain spaces, so the other
+        # fields are counted from the last closing parenthesis.
+        comm_end = stat.rfind(")")
+        comm = stat[stat.find("(") + 1 : comm_end]
+        fields = stat[comm_end + 2 :].split()
+        if fields[0] == "Z":
+            return []
+        # Arguments are separated by null bytes, and ps shows control characters
+        # such as new lines in arguments as spaces.
+        command = re.sub("[\x00-\x1f]", " ", cmdline).strip() or "[%s]" % comm
+        if self.command_pattern is not None and not re.search(
+            self.command_pattern, command
+        ):
+            return []
+
+        # Fields 14, 15 and 22 of stat, counted from the state at field 3.
+        cpu_time = float(int(fields[11]) + int(fields[12])) / self.clock_ticks
+        elapsed = max(uptime - float(fields[19]) / self.clock_ticks, 0)
+        size, resident = [int(v) for v in statm.split()[:2]]
+        rss = resident * self.page_size
+
+        pinfo = {
+            "pid": str(self.pid),
+            "ppid": fields[1],
+            "etime": format_etime(elapsed),
+            "%cpu": "%.1f" % (100 * cpu_time / elapsed if elapsed else 0),
+            "%mem": "%.1f" % (100.0 * rss / self.mem_total if self.mem_total else 0),
+            "rss": str(rss),
+            "vsz": str(size * self.page_size),
+            "command": command,
+            "elapsed": elapsed,
+        }
+        for line in status.splitlines():
+            if line.startswith("VmHWM:"):
+                pinfo["hwm"] = line.split()[1]
+            elif line.startswith("Threads:"):
+                pinfo["threads"] = line.split()[1]
+        if self.extended:
+            # Fields 10 and 12 of stat.
+            counters = {"minflt": int(fields[7]), "majflt": int(fields[9])}
+            for line in status.splitlines():
+                name = line.split(":", 1)[0] + ":"
+                if name in STATUS_COUNTERS:
+                    counters[STATUS_COUNTERS[name]] = int(line.split()[1])
+            for line in io.splitlines():
+                name, _, value = line.partition(":")
+                if name in IO_COUNTERS:
+                    counters[name] = int(value)
+            # Rates since the previous sample, or since the process started.
+            previous_elapsed, previous = self.previous
+            interval = elapsed - previous_elapsed
+            for name, value in counters.items():
+                pinfo[name] = str(value)
+                delta = value - previous.get(name, 0)
+                pinfo[name + "_rate"] = "%.0f" % (delta / interval if interval else 0)
+            self.previous = (elapsed, counters)
+        pinfo["poll_datetime"] = poll_time.isoformat(" ")
+        pinfo["poll_date"] = poll_time.strftime("%Y-%m-%d")
+        pinfo["poll_time"] = poll_time.strftime("%H:%M:%S")
+        if debug_level >= 4:
+            sys.stderr.write(str(pinfo) + "\n")
+        return [pinfo]
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
+def format_etime(seconds):
+    """
+    Formats elapsed seconds like the `etime` field of ps: [[DD-]hh:]mm:ss.
+    """
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    mins, secs = divmod(seconds, 60)
+    if days:
+        return "%d-%02d:%02d:%02d" % (days, hours, mins, secs)
+    elif hours:
+        return "%02d:%02d:%02d" % (hours, mins, secs)
+    return "%02d:%02d" % (mins, secs)
+
+
+class ProcTreeSampler(object):
+    """
+    Samples a process and all of its descendants through /proc, and reports
+    them as a single record aggregated by `aggregate_tree`. Descendants are
+    discovered again on every sample, so processes started or finished during
+    the run are included while they are alive.
+    """
+
+    def __init__(self, pid, command_pattern=None, extended=False):
+        self.root = ProcSampler(pid, command_pattern, extended)
+        self.pid = self.root.pid
+        self.extended = extended
+        self.samplers = {}
+
+    def poll(self, raw_ps_log=None, debug_level=0):
+        records = self.root.poll(raw_ps_log=raw_ps_log, debug_level=debug_level)
+        if not records:
+            self.close()
+            return []
+        descendants = find_descendants(self.pid)
+        for pid in list(self.samplers):
+            if pid not in descendants:
+                self.samplers.pop(pid).close()
+        for pid in descendants:
+            if pid not in self.samplers:
+                try:
+                    self.samplers[pid] = ProcSampler(pid, extended=self.extended)
+                except OSError:
+                    # The process finished before it could be opened.
+                    continue
+            records.extend(
+                self.samplers[pid].poll(raw_ps_log=raw_ps_log, debug_level=debug_level)
+            )
+        return aggregate_tree(records, self.pid)
+
+    def close(self):
+        self.root.close()
+        for sampler in self.samplers.values():
+            sampler.close()
+        self.samplers = {}
+
+
+class ProcTopSampler(object):
+    """
+    Samples the `count` processes on the host with the largest VSZ or RSS, as
+    given by `rank`, through /proc instead of listing every process with ps
+    and sorting them all. At most every `scan_interval` seconds, only the
+    statm file of every process is read, and the largest processes are picked
+    from them with a heap. Only those processes are sampled in full, each with
+    a `ProcSampler` whose files stay open between samples, so samples taken
+    between two scans cost the same however many processes the host runs.
+    A scan is also made after one of the processes exits.
+    """
+
+    def __init__(
+        self,
+        count,
+        rank="vsz",
+        extended=False,
+        scan_interval=TOP_SCAN_INTERVALS * POLL_INTERVAL,
+    ):
+        if rank not in TOP_RANKS:
+            raise ValueError("Unknown rank '%s'" % rank)
+        self.count = count
+        self.column = TOP_RANKS.index(rank)
+        self.extended = extended
+        self.scan_interval = scan_interval
+        self.last_scan = None
+        self.samplers = {}
+
+    def scan(self):
+        """
+        Returns the PIDs of the `count` largest processes, other than syrupy.
+        """
+        sizes = {}
+        own_pid = os.getpid()
+        for entry in os.scandir(PROC_DIR):
+            if not entry.name.isdigit() or int(entry.name) == own_pid:
+                continue
+            try:
+                fd = os.open(os.path.join(entry.path, "statm"), os.O_RDONLY)
+                try:
+                    statm = os.read(fd, PROC_READ_SIZE)
+                finally:
+                    os.close(fd)
+                sizes[int(entry.name)] = int(statm.split()[self.column])
+            except (OSError, IndexError, ValueError):
+                # The process exited during the scan.
+                continue
+        return heapq.nlargest(self.count, sizes, key=sizes.get)
+
+    def poll(self, raw_ps_log=None, debug_level=0):
+        now = time.monotonic()
+        if self.last_scan is None or now - self.last_scan >= self.scan_interval:
+            self.last_scan = now
+            top = self.scan()
+            for pid in list(self.samplers):
+                if pid not in top:
+                    self.samplers.pop(pid).close()
+            for pid in top:
+                if pid not in self.samplers:
+                    try:
+                        self.samplers[pid] = ProcSampler(pid, extended=self.extended)
+                    except OSError:
+                        continue
+        records = []
+        for pid in list(self.samplers):
+            found = self.samplers[pid].poll(
+                raw_ps_log=raw_ps_log, debug_level=debug_level
+            )
+            if not found:
+                self.samplers.pop(pid).close()
+                self.last_scan = None
+            records.extend(found)
+        return records
+
+    def close(self):
+        for sampler in self.samplers.values():
+            sampler.close()
+        self.samplers = {}
+
+
+def find_descendants(pid):
+    """
+    Returns the PIDs of all the descendants of process `pid`, read from the
+    /proc/<pid>/task/<tid>/children files, or from the parent PID of every
+    process in /proc if the kernel does not provide them.
+    """
+    pid = int(pid)
+    if not os.path.exists(
+        os.path.join(PROC_DIR, str(pid), "task", str(pid), "children")
+    ):
+        parents = {}
+        for entry in os.listdir(PROC_DIR):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(os.path.join(PROC_DIR, entry, "stat")) as stat:
+                    ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            parents.setdefault(ppid, []).append(int(entry))
+        descendants = []
+        pending = [pid]
+        while pending:
+            children = parents.get(pending.pop(), [])
+            descendants.extend(children)
+            pending.extend(children)
+        return descendants
+
+    descendants = []
+    pending = [pid]
+    while pending:
+        parent = pending.pop()
+        task_dir = os.path.join(PROC_DIR, str(parent), "task")
+        try:
+            tasks = os.listdir(task_dir)
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(os.path.join(task_dir, task, "children")) as children:
+                    found = [int(child) for child in children.read().split()]
+            except OSError:
+                continue
+            descendants.extend(found)
+            pending.extend(found)
+    return descendants
+
+
+def aggregate_tree(records, pid):
+    """
+    Finds process `pid` and its descendants among `records`, as returned by
+    `poll_process` or `ProcSampler.poll`, and returns a list with a single
+    record for the whole tree, or an empty list if `pid` is not among them.
+    The RSS, VSZ, CPU and MEM of the tree are the sums of those of its
+    processes; the other fields are those of `pid`. The records of the
+    descendants are kept in the "children" field, and the number of
+    processes in the "processes" field.
+    """
+    pid = str(pid)
+    by_parent = {}
+    root = None
+    for record in records:
+        if record["pid"] == pid:
+            root = record
+        else:
+            by_parent.setdefault(record["ppid"], []).append(record)
+    if root is None:
+        return []
+
+    children = []
+    pending = [pid]
+    while pending:
+        found = by_parent.get(pending.pop(), [])
+        children.extend(found)
+        pending.extend(record["pid"] for record in found)
+
+    tree = dict(root)
+    tree["rss"] = str(sum(int(record["rss"]) for record in [root] + children))
+    tree["vsz"] = str(sum(int(record["vsz"]) for record in [root] + children))
+    for field in ("%cpu", "%mem"):
+        tree[field] = "%.1f" % sum(float(record[field]) for record in [root] + children)
+    for field, _ in EXTENDED_COUNTERS:
+        for name in (field, field + "_rate"):
+            if name in root:
+                tree[name] = str(
+                    sum(int(record.get(name, 0)) for record in [root] + children)
+                )
+    if "threads" in root:
+        tree["threads"] = str(
+            sum(int(record.get("threads", 0)) for record in [root] + children)
+        )
+    tree["processes"] = len(children) + 1
+    tree["children"] = children
+    return [tree]
+
+
+class MissingFields(dict):
+    """
+    A record that formats fields it does not have, such as the extended
+    fields of a ps record, as "-".
+    """
+
+    def __missing__(self, key):
+        return "-"
+
+
+def open_sampler(
+    pid,
+    command_pattern=None,
+    has_ssh=False,
+    backend="auto",
+    tree=False,
+    extended=False,
+    top_mem=None,
+    top_rank="vsz",
+    top_scan_interval=TOP_SCAN_INTERVALS * POLL_INTERVAL,
+):
+    """
+    Returns a `ProcSampler` for process `pid`, or a `ProcTreeSampler` if `tree`
+    is True, or a `ProcTopSampler` of the `top_mem` largest processes if no
+    PID or command pattern is given, or None if the ps backend should be used
+    instead: when only a command pattern is given, the process is polled over
+    SSH, or /proc is not available (e.g. not on Linux) and `backend` is
+    "auto". `extended` is passed to the sampler.
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend '%s'" % backend)
+    if (
+        backend == "ps"
+        or has_ssh
+        or (pid is None and (top_mem is None or command_pattern is not None))
+    ):
+        if backend == "proc":
+            raise ValueError("The proc backend needs a local PID or memory top")
+        return None
+    try:
+        if pid is None:
+            return ProcTopSampler(top_mem, top_rank, extended, top_scan_interval)
+        if tree:
+            return ProcTreeSampler(pid, command_pattern, extended)
+        return ProcSampler(pid, command_pattern, extended)
+    except (OSError, AttributeError, ValueError):
+        # AttributeError and ValueError: no CLOCK_BOOTTIME or sysconf names.
+        if backend == "proc":
+            raise
+        return None
+
+
+class ExitWatcher(object):
+    """
+    Waits for a local process to exit through a pidfd registered with epoll,
+    so that the sampling loop notices the exit as soon as it happens instead
+    of after sleeping for the rest of the polling interval.
+    """
+
+    def __init__(self, pid):
+        self.pidfd = os.pidfd_open(int(pid))
+        try:
+            self.epoll = select.epoll()
+            self.epoll.register(self.pidfd, select.EPOLLIN)
+        except OSError:
+            os.close(self.pidfd)
+            raise
+
+    def wait(self, timeout):
+        """
+        Waits up to `timeout` seconds, and returns True if the process has
+        exited.
+        """
+        return bool(self.epoll.poll(timeout))
+
+    def close(self):
+        self.epoll.close()
+        os.close(self.pidfd)
+
+
+class ObserverStats(object):
+    """
+    Measures what sampling costs syrupy itself, so that the overhead of the
+    observer on the measured program is known: the CPU time and latency of
+    every sample, including any ps process it runs, and the CPU time of
+    syrupy over the whole run, from `resource.getrusage`.
+    """
+
+    def __init__(self):
+        self.start_wall = time.perf_counter_ns()
+        self.start_cpu = self.cpu_time(resource.RUSAGE_SELF)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.sample_cpu_sum = 0.0
+        self.children_cpu_sum = 0.0
+        self.latency = None
+        self.sample_cpu = None
+
+    @staticmethod
+    def cpu_time(who):
+        usage = resource.getrusage(who)
+        return usage.ru_utime + usage.ru_stime
+
+    def begin(self):
+        self.sample_start = (
+            time.perf_counter_ns(),
+            self.cpu_time(resource.RUSAGE_SELF),
+            self.cpu_time(resource.RUSAGE_CHILDREN),
+        )
+
+    def end(self):
+        """
+        Ends the measurement of a sample started by `begin`, setting its
+        `latency` and `sample_cpu` in seconds.
+        """
+        wall, own, children = self.sample_start
+        children = self.cpu_time(resource.RUSAGE_CHILDREN) - children
+        self.latency = (time.perf_counter_ns() - wall) / 1e9
+        self.sample_cpu = self.cpu_time(resource.RUSAGE_SELF) - own + children
+        self.count += 1
+        self.latency_sum += self.latency
+        if self.latency_min is None or self.latency < self.latency_min:
+            self.latency_min = self.latency
+        if self.latency_max is None or self.latency > self.latency_max:
+            self.latency_max = self.latency
+        self.sample_cpu_sum += self.sample_cpu
+        self.children_cpu_sum += children
+
+    def summary(self):
+        """
+        Returns the number of samples, the CPU time of syrupy and its ps
+        processes over the run in seconds, the wall time of the run, the
+        `overhead` of that CPU time as a percentage of the wall time, the CPU
+        time spent taking samples, and the mean, minimum and maximum latency
+        of a sample in seconds.
+        """
+        wall_time = (time.perf_counter_ns() - self.start_wall) / 1e9
+        cpu_time = (
+            self.cpu_time(resource.RUSAGE_SELF) - self.start_cpu + self.children_cpu_sum
+        )
+        return {
+            "samples": self.count,
+            "cpu_time": cpu_time,
+            "wall_time": wall_time,
+            "overhead": 100 * cpu_time / wall_time if wall_time else None,
+            "sampling_cpu_time": self.sample_cpu_sum,
+            "latency": {
+                "mean": self.latency_sum / self.count if self.count else None,
+                "min": self.latency_min,
+                "max": self.latency_max,
+            },
+        }
+
+
+def open_exit_watcher(pid, has_ssh=False):
+    """
+    Returns an `ExitWatcher` for process `pid`, or None if the process is not
+    local, or pidfds or epoll are not available (Linux before 5.3 or other
+    systems), in which case the sampling loop sleeps instead.
+    """
+    if pid is None or has_ssh:
+        return None
+    try:
+        return ExitWatcher(pid)
+    except (OSError, AttributeError):
+        return None
+
+
 def profile_process(
     pid=None,
     command_pattern=None,
@@ -231,6 +947,20 @@ def profile_process(
     headers=True,
     flush_output=False,
     debug_level=0,
+    backend="auto",
+    min_poll_interval=None,
+    poll_backoff=POLL_BACKOFF,
+    tree=False,
+    show_children=False,
+    output_format="text",
+    write_summary=True,
+    sample_func=None,
+    history=None,
+    extended=False,
+    observer_cpus=None,
+    top_rank="vsz",
+    top_scan_interval=None,
+    database=None,
 ):
     """
     Will poll process with PID `pid` or with COMMAND matching
@@ -241,11 +971,40 @@ def profile_process(
     True, otherwise will continue until time given by `quit_at_time` if
     `quit_at_time` is not None. If `quit_at_time` is None and the PID
     does not exist and if `quit_if_none` is False, then will poll
-    continuously until interupted by user.
+    continuously until interupted by user. A single local PID is sampled
+    through /proc unless `backend` is "ps", as are the `top_mem` processes
+    with the largest `top_rank` (VSZ or RSS) if no PID or command pattern is
+    given, with a scan of all the processes every `top_scan_interval`
+    seconds, or every `TOP_SCAN_INTERVALS` polling intervals if it is None;
+    anything else is sampled with ps.
+    If `min_poll_interval` is given, the first samples are taken every
+    `min_poll_interval` seconds, and the interval is multiplied by
+    `poll_backoff` after each sample until it reaches `poll_interval`.
+    A local process is waited for through a pidfd, so its exit ends the wait
+    between samples immediately. If `tree` is True, process `pid` is sampled
+    together with all of its descendants as one aggregated row, followed by a
+    row for each descendant if `show_children` is True.
+
+    If `output_format` is "jsonl", every sample is written as a JSON object,
+    followed by the summary record of `summary_record` if `write_summary` is
+    True. The summary is returned in either format. If `sample_func` is not
+    None, it is called with the `sample_record` of every sample. If `history`
+    is a `SampleHistory`, samples are added to it instead of being kept in
+    full, and the summary is taken from it. If `extended` is True, the thread
+    count and the rates of `EXTENDED_COUNTERS` are sampled as well, which is
+    only possible through /proc. If `database` is a `SampleDatabase`, samples
+    are also added to its current run.
+
+    The cost of sampling is measured by `ObserverStats`, and is added to the
+    summary as "observer", and to JSON samples as "observer_latency" and
+    "observer_cpu". If `observer_cpus` is given, syrupy pins itself to those
+    CPUs with `os.sched_setaffinity` before sampling.
     """
 
     if pid is None and command_pattern is None and top_mem is None:
         raise Exception("Must provide PID, command pattern or memory top")
+    if tree and pid is None:
+        raise Exception("Must provide PID to sample a process tree")
 
     if align:
         ncolw = 5
@@ -280,6 +1039,12 @@ def profile_process(
         "%%(command)%ss" % right_align,
     ]
 
+    if extended:
+        # Before CMD, which contains spaces.
+        result_fields[-1:-1] = ["%%(threads)%ss" % right_align] + [
+            "%%(%s_rate)%ss" % (name, right_align) for name, _ in EXTENDED_COUNTERS
+        ]
+
     if debug_level >= 1:
         result_fields.insert(0, "%%(ppid)%ss" % right_align)
 
@@ -298,42 +1063,120 @@ def profile_process(
         "CMD".rjust(mcolw),
     ]
 
+    if extended:
+        col_headers[-1:-1] = ["THREADS".rjust(mcolw)] + [
+            header.rjust(mcolw) for _, header in EXTENDED_COUNTERS
+        ]
+
     if debug_level >= 1:
         col_headers.insert(0, "PPID".rjust(mcolw))
 
     if show_command:
         col_headers.append("COMMAND")
 
-    if headers:
+    if headers and output_format == "text":
         if syrupy_output is not None:
             syrupy_output.write(output_separator.join(col_headers) + "\n")
             if flush_output:
                 syrupy_output.flush()
 
+    if observer_cpus:
+        os.sched_setaffinity(0, observer_cpus)
+    observer = ObserverStats()
+    if database is not None:
+        database.observer = observer
+    if top_scan_interval is None:
+        top_scan_interval = TOP_SCAN_INTERVALS * poll_interval
+    sampler = open_sampler(
+        pid,
+        command_pattern,
+        has_ssh,
+        backend,
+        tree,
+        extended,
+        top_mem,
+        top_rank,
+        top_scan_interval,
+    )
+    exit_watcher = open_exit_watcher(pid, has_ssh)
+    if debug_level >= 1:
+        sys.stderr.write(
+            "SYRUPY: sampling with %s\n" % ("ps" if sampler is None else PROC_DIR)
+        )
+
+    if min_poll_interval is None:
+        interval = poll_interval
+    else:
+        interval = min(min_poll_interval, poll_interval)
+    # Samples are scheduled on monotonic deadlines, so the time spent sampling
+    # does not make the schedule drift.
+    deadline = time.monotonic_ns()
+    series = {"time": [], "cpu": [], "rss": [], "vsz": []}
+    elapsed = None
+
     quit = False
     while not quit:
-        pinfoset = poll_process(
-            pid=pid,
-            command_pattern=command_pattern,
-            ssh_id=ssh_id,
-            has_ssh=has_ssh,
-            raw_ps_log=raw_ps_log,
-            debug_level=debug_level,
-        )
+        observer.begin()
+        poll_time = time.monotonic()
+        if sampler is not None:
+            pinfoset = sampler.poll(raw_ps_log=raw_ps_log, debug_level=debug_level)
+        elif tree:
+            pinfoset = aggregate_tree(
+                poll_process(
+                    ssh_id=ssh_id,
+                    has_ssh=has_ssh,
+                    raw_ps_log=raw_ps_log,
+                    debug_level=debug_level,
+                ),
+                pid,
+            )
+        else:
+            pinfoset = poll_process(
+                pid=pid,
+                command_pattern=command_pattern,
+                ssh_id=ssh_id,
+                has_ssh=has_ssh,
+                raw_ps_log=raw_ps_log,
+                debug_level=debug_level,
+            )
 
         if top_mem is not None:
-            pinfoset = sorted(pinfoset, key=lambda v: int(v["vsz"]), reverse=True)[
-                :top_mem
-            ]
+            pinfoset = heapq.nlargest(top_mem, pinfoset, key=lambda v: int(v[top_rank]))
+        observer.end()
 
         if debug_level > 4:
             sys.stderr.write(str(pinfoset) + "\n")
         if raw_ps_log is not None and flush_output:
             raw_ps_log.flush()
         for pinfo in pinfoset:
-            result = output_separator.join(result_fields) % pinfo
+            record = sample_record(pinfo)
+            if database is not None:
+                database.add(record)
+            if history is not None:
+                history.add(record)
+            else:
+                series["time"].append(poll_time)
+                series["cpu"].append(record["cpu"])
+                series["rss"].append(record["rss"])
+                series["vsz"].append(record["vsz"])
+            elapsed = record["elapsed"]
+            if sample_func is not None:
+                sample_func(record)
+            if output_format == "jsonl":
+                record["observer_latency"] = observer.latency
+                record["observer_cpu"] = observer.sample_cpu
+                rows = [json.dumps(record)]
+            else:
+                rows = [pinfo]
+                if show_children:
+                    rows.extend(pinfo.get("children", []))
+                rows = [
+                    output_separator.join(result_fields) % MissingFields(row)
+                    for row in rows
+                ]
             if syrupy_output is not None:
-                syrupy_output.write(result + "\n")
+                for row in rows:
+                    syrupy_output.write(row + "\n")
                 if flush_output:
                     syrupy_output.flush()
         if quit_poll_func is not None and quit_poll_func():
@@ -341,7 +1184,541 @@ def profile_process(
         elif len(pinfoset) == 0 and quit_if_none:
             quit = True
         else:
-            time.sleep(poll_interval)
+            deadline += int(interval * 1e9)
+            now = time.monotonic_ns()
+            if deadline > now:
+                if exit_watcher is None:
+                    time.sleep((deadline - now) / 1e9)
+                elif exit_watcher.wait((deadline - now) / 1e9):
+                    # The process has exited: reap it straight away, so that
+                    # the end of the run is timed when it happened, or take
+                    # one more sample to find that it is gone. The pidfd stays
+                    # readable, so it is closed to sleep between the samples
+                    # of a process that is still listed, like a zombie.
+                    if quit_poll_func is not None and quit_poll_func():
+                        quit = True
+                    exit_watcher.close()
+                    exit_watcher = None
+                    deadline = time.monotonic_ns()
+            else:
+                # Sampling took longer than the interval, so skip the missed
+                # samples instead of taking them all at once.
+                deadline = now
+            interval = min(interval * poll_backoff, poll_interval)
+    end_time = time.monotonic()
+    if sampler is not None:
+        sampler.close()
+    if exit_watcher is not None:
+        exit_watcher.close()
+
+    if history is not None:
+        summary = history.summary(elapsed)
+    else:
+        summary = summary_record(
+            series, elapsed, weights=sample_weights(series["time"], end_time)
+        )
+    summary["observer"] = observer.summary()
+    if output_format == "jsonl" and write_summary and syrupy_output is not None:
+        syrupy_output.write(json.dumps(summary) + "\n")
+        if flush_output:
+            syrupy_output.flush()
+    return summary
+
+
+def parse_etime(etime):
+    """
+    Converts the [[DD-]hh:]mm:ss `etime` field of ps to seconds.
+    """
+    days, _, clock = etime.strip().rpartition("-")
+    seconds = 0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds + int(days or 0) * 86400
+
+
+def sample_record(pinfo):
+    """
+    Converts a record of `poll_process` or `ProcSampler.poll` to a dictionary
+    of numbers for JSON output: "elapsed" in seconds, "cpu" and "mem" in
+    percent, "rss" and "vsz" in kiloBytes, and the thread count and extended
+    counters with their "_rate" per second when they were sampled. The records of descendants in
+    a process tree are converted as well.
+    """
+    record = {
+        "type": "sample",
+        "pid": int(pinfo["pid"]),
+        "ppid": int(pinfo["ppid"]),
+        "datetime": pinfo["poll_datetime"],
+        "elapsed": pinfo.get("elapsed", None),
+        "cpu": float(pinfo["%cpu"]),
+        "mem": float(pinfo["%mem"]),
+        "rss": int(pinfo["rss"]),
+        "vsz": int(pinfo["vsz"]),
+        "command": pinfo["command"],
+    }
+    if record["elapsed"] is None:
+        record["elapsed"] = parse_etime(pinfo["etime"])
+    if "threads" in pinfo:
+        record["threads"] = int(pinfo["threads"])
+    for name, _ in EXTENDED_COUNTERS:
+        if name in pinfo:
+            record[name] = int(pinfo[name])
+            record[name + "_rate"] = float(pinfo[name + "_rate"])
+    if "children" in pinfo:
+        record["processes"] = pinfo["processes"]
+        record["children"] = [sample_record(child) for child in pinfo["children"]]
+    return record
+
+
+def sample_weights(times, end=None):
+    """
+    Returns the weight of each sample taken at `times`, in seconds and in
+    order: the time until the next later sample, or until `end` for the last
+    ones. Samples taken at the same time, like the processes of one poll, have
+    the same weight, and the last ones have none if `end` is None.
+    """
+    weights = [0.0] * len(times)
+    following = end
+    i = len(times)
+    while i > 0:
+        t = times[i - 1]
+        j = i - 1
+        while j > 0 and times[j - 1] == t:
+            j -= 1
+        if following is not None:
+            weights[j:i] = [max(following - t, 0.0)] * (i - j)
+        following = t
+        i = j
+    return weights
+
+
+def summarize(values, weights=None):
+    """
+    Returns the mean, minimum, maximum and `SUMMARY_PERCENTILES` (nearest
+    rank) of `values`, which are all None if there are no values. With the
+    `weights` of `sample_weights`, the mean and percentiles are weighted by
+    time, so that adaptive sampling, which takes many samples at the start of
+    a run, does not skew them towards the start.
+    """
+    if weights is None or not sum(weights):
+        weights = [1] * len(values)
+    pairs = sorted(zip(values, weights))
+    summary = {"mean": None, "min": None, "max": None}
+    summary.update(("p%d" % p, None) for p in SUMMARY_PERCENTILES)
+    if not pairs:
+        return summary
+    total = float(sum(weights))
+    summary["mean"] = sum(value * weight for value, weight in pairs) / total
+    summary["min"] = pairs[0][0]
+    summary["max"] = pairs[-1][0]
+    for p in SUMMARY_PERCENTILES:
+        rank = p * total / 100
+        cumulative = 0
+        for value, weight in pairs:
+            cumulative += weight
+            if cumulative >= rank:
+                break
+        summary["p%d" % p] = value
+    return summary
+
+
+def summary_record(series, elapsed=None, usage=None, weights=None):
+    """
+    Returns the summary record of a run: the number of samples, the summary
+    statistics of the CPU, RSS and VSZ `series`, weighted by the `weights` of
+    `sample_weights` if given, the elapsed time in seconds, and the exact
+    resource usage of a command as returned by `command_usage`.
+    """
+    return {
+        "type": "summary",
+        "count": len(series["cpu"]),
+        "cpu": summarize(series["cpu"], weights),
+        "rss": summarize(series["rss"], weights),
+        "vsz": summarize(series["vsz"], weights),
+        "elapsed": elapsed,
+        "usage": usage,
+    }
+
+
+class BucketRing(object):
+    """
+    A fixed number of buckets, each holding the count, minimum, maximum and
+    sum of every metric in `HISTORY_METRICS` over `resolution` seconds, in
+    `array` columns used as a ring. A resolution of 0 keeps every sample in
+    its own bucket.
+    """
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.start = array("d", [0.0]) * capacity
+        self.count = array("q", [0]) * capacity
+        self.mins = dict((m, array("d", [0.0]) * capacity) for m in HISTORY_METRICS)
+        self.maxs = dict((m, array("d", [0.0]) * capacity) for m in HISTORY_METRICS)
+        self.sums = dict((m, array("d", [0.0]) * capacity) for m in HISTORY_METRICS)
+        self.head = 0
+        self.size = 0
+
+    def bucket_start(self, t):
+        if not self.resolution:
+            return t
+        return t - t % self.resolution
+
+    def is_full(self, t):
+        """
+        Returns True if adding a sample at time `t` needs a free bucket.
+        """
+        if self.size < self.capacity:
+            return False
+        last = (self.head + self.size - 1) % self.capacity
+        return not self.resolution or self.start[last] != self.bucket_start(t)
+
+    def add(self, t, count, mins, maxs, sums):
+        """
+        Adds `count` samples at time `t` with the given minimum, maximum and
+        sum of each metric, merging them into the newest bucket if `t` falls
+        into it. The ring must not be full.
+        """
+        start = self.bucket_start(t)
+        last = (self.head + self.size - 1) % self.capacity
+        if self.size and self.resolution and self.start[last] == start:
+            index = last
+            for m in HISTORY_METRICS:
+                self.mins[m][index] = min(self.mins[m][index], mins[m])
+                self.maxs[m][index] = max(self.maxs[m][index], maxs[m])
+                self.sums[m][index] += sums[m]
+            self.count[index] += count
+            return
+        index = (self.head + self.size) % self.capacity
+        self.size += 1
+        self.start[index] = start
+        self.count[index] = count
+        for m in HISTORY_METRICS:
+            self.mins[m][index] = mins[m]
+            self.maxs[m][index] = maxs[m]
+            self.sums[m][index] = sums[m]
+
+    def oldest(self):
+        return self.start[self.head]
+
+    def pop(self):
+        """
+        Removes the oldest bucket and returns it as the arguments of `add`.
+        """
+        index = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.size -= 1
+        return (
+            self.start[index],
+            self.count[index],
+            dict((m, self.mins[m][index]) for m in HISTORY_METRICS),
+            dict((m, self.maxs[m][index]) for m in HISTORY_METRICS),
+            dict((m, self.sums[m][index]) for m in HISTORY_METRICS),
+        )
+
+    def buckets(self):
+        """
+        Yields the buckets from the oldest, as the arguments of `add`.
+        """
+        for offset in range(self.size):
+            index = (self.head + offset) % self.capacity
+            yield (
+                self.start[index],
+                self.count[index],
+                dict((m, self.mins[m][index]) for m in HISTORY_METRICS),
+                dict((m, self.maxs[m][index]) for m in HISTORY_METRICS),
+                dict((m, self.sums[m][index]) for m in HISTORY_METRICS),
+            )
+
+
+class SampleHistory(object):
+    """
+    A history of samples in a fixed amount of memory, however long syrupy
+    runs. Recent samples are kept as they are, and older ones are downsampled
+    into the minimum, maximum and average of coarser and coarser buckets, as
+    set by `HISTORY_DETAIL`, `HISTORY_CAPACITY` and `HISTORY_TIERS`. Buckets
+    that fall out of the coarsest tier are dropped, but still count towards
+    the mean, minimum and maximum of the summary.
+    """
+
+    def __init__(
+        self, detail=HISTORY_DETAIL, capacity=HISTORY_CAPACITY, tiers=HISTORY_TIERS
+    ):
+        self.detail = detail
+        self.tiers = [BucketRing(0, capacity)]
+        self.tiers.extend(BucketRing(resolution, size) for resolution, size in tiers)
+        self.count = 0
+        self.mins = dict((m, None) for m in HISTORY_METRICS)
+        self.maxs = dict((m, None) for m in HISTORY_METRICS)
+        self.sums = dict((m, 0.0) for m in HISTORY_METRICS)
+
+    def add(self, record, t=None):
+        """
+        Adds a record of `sample_record`, taken at Unix time `t` (defaults to
+        now).
+        """
+        if t is None:
+            t = time.time()
+        values = dict((m, float(record[m])) for m in HISTORY_METRICS)
+        self.count += 1
+        for m in HISTORY_METRICS:
+            if self.mins[m] is None or values[m] < self.mins[m]:
+                self.mins[m] = values[m]
+            if self.maxs[m] is None or values[m] > self.maxs[m]:
+                self.maxs[m] = values[m]
+            self.sums[m] += values[m]
+        self.push(0, t, 1, values, values, values)
+        raw = self.tiers[0]
+        while raw.size and raw.oldest() < t - self.detail:
+            self.push(1, *raw.pop())
+
+    def push(self, level, t, count, mins, maxs, sums):
+        if level == len(self.tiers):
+            return
+        tier = self.tiers[level]
+        if tier.is_full(t):
+            self.push(level + 1, *tier.pop())
+        tier.add(t, count, mins, maxs, sums)
+
+    def export(self):
+        """
+        Returns a record for every sample and bucket in the history, from the
+        oldest, with its Unix `time`, `resolution` in seconds (0 for a single
+        sample), `count` of samples, and the min, max and avg of each metric.
+        """
+        records = []
+        for tier in reversed(self.tiers):
+            for start, count, mins, maxs, sums in tier.buckets():
+                record = {
+                    "type": "history",
+                    "time": start,
+                    "resolution": tier.resolution,
+                    "count": count,
+                }
+                for m in HISTORY_METRICS:
+                    record[m] = {
+                        "min": mins[m],
+                        "max": maxs[m],
+                        "avg": sums[m] / count,
+                    }
+                records.append(record)
+        return records
+
+    def summary(self, elapsed=None, usage=None):
+        """
+        Returns a summary record like `summary_record`. The count, mean,
+        minimum and maximum cover every sample; the percentiles are estimated
+        from the samples and the bucket averages still in the history.
+        """
+        summary = {"type": "summary", "count": self.count}
+        for m in ("cpu", "rss", "vsz"):
+            weighted = sorted(
+                (sums[m] / count, count)
+                for tier in self.tiers
+                for _, count, _, _, sums in tier.buckets()
+            )
+            stats = summarize([])
+            if self.count:
+                stats["mean"] = self.sums[m] / self.count
+                stats["min"] = self.mins[m]
+                stats["max"] = self.maxs[m]
+            total = sum(count for _, count in weighted)
+            for p in SUMMARY_PERCENTILES:
+                rank = max(-(-p * total // 100), 1)
+                for value, count in weighted:
+                    rank -= count
+                    if rank <= 0:
+                        stats["p%d" % p] = value
+                        break
+            summary[m] = stats
+        summary["elapsed"] = elapsed
+        summary["usage"] = usage
+        return summary
+
+
+class SampleDatabase(object):
+    """
+    Records runs in the SQLite database at `path`, created with `SQLITE_SCHEMA`
+    if needed, so that runs can be compared over months with single queries
+    instead of parsing their logs again:
+
+        runs         one row per run: its label, language and algorithm, the
+                     command, when it started and finished, and the exact
+                     resource usage of a command as returned by `command_usage`
+        environment  name and value pairs describing the host of each run
+        samples      every sample of each run
+        aggregates   the summary statistics of `summarize` of the CPU, MEM,
+                     RSS and VSZ of each run, weighted by time
+
+    The database is in WAL mode, so that it can be queried while runs are
+    recorded, and samples are inserted in transactions of `batch_size` rows.
+    """
+
+    def __init__(self, path, batch_size=SQLITE_BATCH_SIZE):
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, this only syncs at checkpoints, and a power loss can
+        # lose the last transactions but cannot corrupt the database.
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.batch_size = batch_size
+        self.pending = []
+        self.run_id = None
+        # The `ObserverStats` of the run, set by `profile_process`.
+        self.observer = None
+
+    def start_run(
+        self, command, label=None, language=None, algorithm=None, environment=None
+    ):
+        """
+        Adds a run of `command`, described by the `environment` dictionary, to
+        which the following samples belong, and returns its ID.
+        """
+        with self.connection:
+            self.run_id = self.connection.execute(
+                "INSERT INTO runs (started_at, label, language, algorithm, command) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    datetime.datetime.now().isoformat(" "),
+                    label,
+                    language,
+                    algorithm,
+                    command,
+                ),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO environment VALUES (?, ?, ?)",
+                [
+                    (self.run_id, name, str(value))
+                    for name, value in sorted((environment or {}).items())
+                ],
+            )
+        return self.run_id
+
+    def add(self, record):
+        """
+        Adds a record of `sample_record` to the run.
+        """
+        self.pending.append(
+            (
+                self.run_id,
+                record["datetime"],
+                record["elapsed"],
+                record["pid"],
+                record["cpu"],
+                record["mem"],
+                record["rss"],
+                record["vsz"],
+                record.get("threads"),
+            )
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending
+            )
+        self.pending = []
+
+    def finish(self, usage=None):
+        """
+        Writes the remaining samples and the aggregates of the run, and ends it
+        with the exact resource `usage` of a command, if given, and the overhead
+        of the observer.
+        """
+        self.flush()
+        # Each sample is weighted by the time until the next sample of its
+        # process, as in the summary of `profile_process`.
+        end = datetime.datetime.now()
+        rows = self.connection.execute(
+            "SELECT pid, datetime, cpu, mem, rss, vsz FROM samples WHERE run_id = ? "
+            "ORDER BY pid, datetime",
+            (self.run_id,),
+        ).fetchall()
+        weights = []
+        for _, samples in itertools.groupby(rows, key=lambda row: row[0]):
+            times = [
+                (datetime.datetime.fromisoformat(row[1]) - end).total_seconds()
+                for row in samples
+            ]
+            weights.extend(sample_weights(times, 0.0))
+        aggregates = []
+        for column, metric in enumerate(("cpu", "mem", "rss", "vsz"), 2):
+            stats = summarize([row[column] for row in rows], weights)
+            aggregates.append(
+                (self.run_id, metric, len(rows))
+                + tuple(stats[name] for name in ("mean", "min", "max"))
+                + tuple(stats["p%d" % p] for p in SUMMARY_PERCENTILES)
+            )
+        usage = usage or {}
+        observer = usage.get("observer")
+        if observer is None:
+            observer = self.observer.summary() if self.observer is not None else {}
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", aggregates
+            )
+            self.connection.execute(
+                "UPDATE runs SET finished_at = ?, elapsed = ?, exit_code = ?, "
+                "max_rss = ?, user_time = ?, system_time = ?, "
+                "voluntary_switches = ?, involuntary_switches = ?, "
+                "minor_faults = ?, major_faults = ?, observer_cpu_time = ?, "
+                "observer_overhead = ? WHERE id = ?",
+                (datetime.datetime.now().isoformat(" "),)
+                + tuple(
+                    usage.get(name)
+                    for name in (
+                        "elapsed",
+                        "exit_code",
+                        "max_rss",
+                        "user_time",
+                        "system_time",
+                        "voluntary_switches",
+                        "involuntary_switches",
+                        "minor_faults",
+                        "major_faults",
+                    )
+                )
+                + (observer.get("cpu_time"), observer.get("overhead"), self.run_id),
+            )
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def host_environment():
+    """
+    Returns a dictionary describing the host: its name, operating system,
+    kernel release, architecture, CPU model, number of CPUs, total memory in
+    kiloBytes and Python version.
+    """
+    environment = {
+        "hostname": platform.node(),
+        "system": platform.system(),
+        "release": platform.release(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+    try:
+        with open(os.path.join(PROC_DIR, "cpuinfo")) as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    environment["cpu"] = line.split(":", 1)[1].strip()
+                    break
+        with open(os.path.join(PROC_DIR, "meminfo")) as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    environment["memory"] = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    return environment
 
 
 def communicate(p, commands=None):
@@ -368,28 +1745,74 @@ def profile_command(
     headers=True,
     flush_output=False,
     debug_level=0,
+    backend="auto",
+    min_poll_interval=None,
+    poll_backoff=POLL_BACKOFF,
+    tree=False,
+    show_children=False,
+    output_format="text",
+    sample_func=None,
+    history=None,
+    extended=False,
+    observer_cpus=None,
+    database=None,
 ):
     """
     Executes command `command`, redirecting its output stream to `command_stdout`
     and error stream to `command_stderr`. Polls the resulting process every
     `poll_interval` seconds, and writes the memory/cpu usage information to
-    `syrupy_output`.
+    `syrupy_output`. See `profile_process` for adaptive sampling, process
+    trees and JSON Lines output, where the summary record also holds the
+    exact elapsed time and resource usage of the command.
+
+    Returns the start and end time of the command, and its exact resource
+    usage as reported by the kernel when it is reaped with `os.wait4`, which
+    `command_usage` describes. Unlike the samples, this includes a peak
+    resident set size that may have been reached between two samples. The
+    usage also holds the "observer" overhead of `ObserverStats`.
+
+    If `observer_cpus` is given, syrupy runs on those CPUs and the command on
+    all the others, so that sampling does not compete with the command.
     """
     try:
+        preexec_fn = None
+        if observer_cpus:
+            command_cpus = os.sched_getaffinity(0) - set(observer_cpus)
+            if not command_cpus:
+                raise ValueError("No CPUs are left for the command")
+
+            def preexec_fn():
+                os.sched_setaffinity(0, command_cpus)
+
         start_time = datetime.datetime.now()
+        start_counter = time.perf_counter_ns()
         proc = subprocess.Popen(
             command,
             shell=False,
             stdout=command_stdout,
             stderr=command_stderr,
             env=os.environ,
+            preexec_fn=preexec_fn,
         )
-        profile_process(
+        reaped = {}
+
+        def reap(options=os.WNOHANG):
+            # Reaping with wait4 instead of proc.poll also returns the resource
+            # usage of the command.
+            pid, status, rusage = os.wait4(proc.pid, options)
+            if pid == 0:
+                return False
+            reaped["end"] = time.perf_counter_ns()
+            reaped["rusage"] = rusage
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return True
+
+        summary = profile_process(
             pid=proc.pid,
             syrupy_output=syrupy_output,
             raw_ps_log=raw_ps_log,
             poll_interval=poll_interval,
-            quit_poll_func=proc.poll,
+            quit_poll_func=reap,
             quit_if_none=True,
             quit_at_time=None,
             show_command=show_command,
@@ -398,15 +1821,345 @@ def profile_command(
             headers=headers,
             flush_output=flush_output,
             debug_level=debug_level,
+            backend=backend,
+            min_poll_interval=min_poll_interval,
+            poll_backoff=poll_backoff,
+            tree=tree,
+            show_children=show_children,
+            output_format=output_format,
+            write_summary=False,
+            sample_func=sample_func,
+            history=history,
+            extended=extended,
+            observer_cpus=observer_cpus,
+            database=database,
         )
-        end_time = datetime.datetime.now()
-        return start_time, end_time
+        if not reaped:
+            reap(0)
+        elapsed = reaped["end"] - start_counter
+        end_time = start_time + datetime.timedelta(microseconds=elapsed // 1000)
+        usage = command_usage(elapsed, reaped["rusage"], proc.returncode)
+        usage["observer"] = summary["observer"]
+        if output_format == "jsonl" and syrupy_output is not None:
+            summary["elapsed"] = usage["elapsed"]
+            summary["usage"] = usage
+            syrupy_output.write(json.dumps(summary) + "\n")
+            if flush_output:
+                syrupy_output.flush()
+        return start_time, end_time, usage
     except Exception as e:
         sys.stderr.write("Failed to execute command: %s\n" % command)
         raise e
         sys.exit(1)
 
 
+def command_usage(elapsed_ns, rusage, exit_code):
+    """
+    Returns the exact resource usage of a finished command: its elapsed time in
+    seconds, `max_rss` (peak resident set size in kiloBytes on Linux), user and
+    system CPU time in seconds, voluntary and involuntary context switches,
+    minor and major page faults, and its exit code.
+    """
+    return {
+        "elapsed": elapsed_ns / 1e9,
+        "max_rss": rusage.ru_maxrss,
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "voluntary_switches": rusage.ru_nvcsw,
+        "involuntary_switches": rusage.ru_nivcsw,
+        "minor_faults": rusage.ru_minflt,
+        "major_faults": rusage.ru_majflt,
+        "exit_code": exit_code,
+    }
+
+
+class ProfileResult(object):
+    """
+    The samples and summary of a command profiled by `Profiler`. Each series
+    is an `array` with one item per sample: `times` holds the elapsed time of
+    the process in seconds, `cpu` and `mem` percentages, and `rss` and `vsz`
+    kiloBytes. `usage` is the exact resource usage of the command as returned
+    by `command_usage`, and `summary` the record of `summary_record`.
+    """
+
+    __slots__ = (
+        "command",
+        "start_time",
+        "end_time",
+        "times",
+        "cpu",
+        "mem",
+        "rss",
+        "vsz",
+        "usage",
+        "summary",
+    )
+
+    def __init__(self, command):
+        self.command = command
+        self.start_time = None
+        self.end_time = None
+        self.times = array("d")
+        self.cpu = array("d")
+        self.mem = array("d")
+        self.rss = array("q")
+        self.vsz = array("q")
+        self.usage = None
+        self.summary = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return "<ProfileResult %r: %d samples, %s seconds>" % (
+            self.command,
+            len(self),
+            self.usage["elapsed"] if self.usage else None,
+        )
+
+    def append(self, record):
+        """
+        Adds a record of `sample_record` to the series.
+        """
+        self.times.append(record["elapsed"])
+        self.cpu.append(record["cpu"])
+        self.mem.append(record["mem"])
+        self.rss.append(record["rss"])
+        self.vsz.append(record["vsz"])
+
+    def summarize(self, elapsed=None):
+        """
+        Sets and returns the summary of the series, weighted by time, with the
+        elapsed time of the command, or `elapsed` if given.
+        """
+        if elapsed is None and self.usage is not None:
+            elapsed = self.usage["elapsed"]
+        self.summary = summary_record(
+            {"cpu": self.cpu, "rss": self.rss, "vsz": self.vsz},
+            elapsed,
+            self.usage,
+            sample_weights(self.times, elapsed),
+        )
+        if self.usage is not None and "observer" in self.usage:
+            self.summary["observer"] = self.usage["observer"]
+        return self.summary
+
+
+class Profiler(object):
+    """
+    Profiles commands from Python, without starting another interpreter or
+    parsing the output of syrupy:
+
+        result = Profiler(["python", "sieve_run.py"]).run()
+        print(result.usage["max_rss"], result.summary["cpu"]["mean"])
+
+    Samples are adaptive by default, starting every `min_poll_interval`
+    seconds and backing off to `poll_interval`; pass `min_poll_interval=None`
+    to sample at a fixed interval. The output streams of the command are
+    inherited unless `stdout` or `stderr` are given, as for `subprocess.Popen`.
+    A profiler can be run any number of times.
+    """
+
+    def __init__(
+        self,
+        command,
+        stdout=None,
+        stderr=None,
+        poll_interval=POLL_INTERVAL,
+        min_poll_interval=MIN_POLL_INTERVAL,
+        poll_backoff=POLL_BACKOFF,
+        backend="auto",
+        tree=False,
+    ):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.poll_interval = poll_interval
+        self.min_poll_interval = min_poll_interval
+        self.poll_backoff = poll_backoff
+        self.backend = backend
+        self.tree = tree
+
+    def run(self):
+        """
+        Runs the command to completion while sampling it, and returns its
+        `ProfileResult`.
+        """
+        result = ProfileResult(self.command)
+        result.start_time, result.end_time, result.usage = profile_command(
+            command=self.command,
+            command_stdout=self.stdout,
+            command_stderr=self.stderr,
+            syrupy_output=None,
+            poll_interval=self.poll_interval,
+            headers=False,
+            backend=self.backend,
+            min_poll_interval=self.min_poll_interval,
+            poll_backoff=self.poll_backoff,
+            tree=self.tree,
+            sample_func=result.append,
+        )
+        result.summarize()
+        return result
+
+
+class Monitor(object):
+    """
+    Profiles many commands and running processes at once from a single asyncio
+    event loop, instead of running one syrupy process for each of them:
+
+        monitor = Monitor()
+        monitor.add_command(["python", "sieve_run.py"])
+        monitor.add_pid(1234)
+        sieve, service = monitor.run()
+
+    Every target has its own adaptive sampling schedule, as in `Profiler`, and
+    the loop sleeps until the next deadline of any of them, so that a sample
+    costs the same however many processes are monitored. Exits are noticed
+    through pidfds registered with the loop; without them, commands are
+    checked for on every sample. Targets are sampled through /proc, or with a
+    blocking call to ps where it is not available.
+    """
+
+    def __init__(
+        self,
+        poll_interval=POLL_INTERVAL,
+        min_poll_interval=MIN_POLL_INTERVAL,
+        poll_backoff=POLL_BACKOFF,
+        tree=False,
+    ):
+        self.poll_interval = poll_interval
+        self.min_poll_interval = min_poll_interval
+        self.poll_backoff = poll_backoff
+        self.tree = tree
+        self.targets = []
+
+    def add_command(self, command, stdout=None, stderr=None):
+        """
+        Adds a command to launch when the monitor runs, whose output streams
+        are redirected as for `subprocess.Popen`.
+        """
+        self.targets.append((command, stdout, stderr))
+
+    def add_pid(self, pid):
+        """
+        Adds a running process, which is sampled until it exits. Its result
+        has no exact resource usage, as it cannot be reaped by the monitor.
+        """
+        self.targets.append((int(pid), None, None))
+
+    def run(self):
+        """
+        Launches the commands, samples every target until it exits, and
+        returns a `ProfileResult` for each of them, in the order they were
+        added.
+        """
+        return asyncio.run(self.monitor())
+
+    async def monitor(self):
+        """
+        The coroutine of `run`, for callers with a running event loop.
+        """
+        return list(await asyncio.gather(*[self.watch(*t) for t in self.targets]))
+
+    async def watch(self, target, stdout=None, stderr=None):
+        """
+        Samples a single command or PID until it exits, and returns its
+        `ProfileResult`.
+        """
+        loop = asyncio.get_running_loop()
+        result = ProfileResult(target)
+        process = None
+        if isinstance(target, int):
+            pid = target
+        else:
+            result.start_time = datetime.datetime.now()
+            start_counter = time.perf_counter_ns()
+            # Popen blocks until the command has been executed, so it is
+            # called in a thread to keep sampling the other targets meanwhile.
+            process = await loop.run_in_executor(
+                None,
+                lambda: subprocess.Popen(target, stdout=stdout, stderr=stderr),
+            )
+            pid = process.pid
+        sampler = open_sampler(pid, tree=self.tree)
+        pidfd, exited = watch_exit(loop, pid)
+
+        if self.min_poll_interval is None:
+            interval = self.poll_interval
+        else:
+            interval = min(self.min_poll_interval, self.poll_interval)
+        deadline = loop.time()
+        try:
+            while True:
+                if process is not None and (exited is None or exited.done()):
+                    reaped_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+                    if reaped_pid != 0:
+                        elapsed = time.perf_counter_ns() - start_counter
+                        process.returncode = os.waitstatus_to_exitcode(status)
+                        result.usage = command_usage(
+                            elapsed, rusage, process.returncode
+                        )
+                        result.end_time = result.start_time + datetime.timedelta(
+                            microseconds=elapsed // 1000
+                        )
+                        break
+
+                if sampler is not None:
+                    records = sampler.poll()
+                elif self.tree:
+                    records = aggregate_tree(poll_process(), pid)
+                else:
+                    records = poll_process(pid=pid)
+                for record in records:
+                    result.append(sample_record(record))
+                if process is None and not records:
+                    break
+
+                deadline += interval
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # Behind schedule: skip the missed samples, but let the
+                    # other targets be sampled first.
+                    deadline = loop.time()
+                    await asyncio.sleep(0)
+                elif exited is not None and not exited.done():
+                    await asyncio.wait({exited}, timeout=timeout)
+                else:
+                    await asyncio.sleep(timeout)
+                interval = min(interval * self.poll_backoff, self.poll_interval)
+        finally:
+            if sampler is not None:
+                sampler.close()
+            if pidfd is not None:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+
+        result.summarize(None if result.usage or not result.times else result.times[-1])
+        return result
+
+
+def watch_exit(loop, pid):
+    """
+    Registers a pidfd of process `pid` with the event `loop`, and returns it
+    with a future that is done when the process exits, or (None, None) if
+    pidfds are not available.
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (OSError, AttributeError):
+        return None, None
+    exited = loop.create_future()
+
+    def on_exit():
+        loop.remove_reader(pidfd)
+        if not exited.done():
+            exited.set_result(True)
+
+    loop.add_reader(pidfd, on_exit)
+    return pidfd, exited
+
+
 def open_file(fpath, mode="r", replace=False, exit_on_fail=True):
     """
     Does idiot-checked file opening.
@@ -582,6 +2335,28 @@ being tracked by itself.
         help="ignore COMMAND if given and poll top MEM processes by memory usage",
     )
 
+    process_opts.add_option(
+        "--rank",
+        action="store",
+        dest="top_rank",
+        default="vsz",
+        choices=TOP_RANKS,
+        metavar="FIELD",
+        help="rank the top MEM processes by 'vsz' or 'rss' (default=%default)",
+    )
+
+    process_opts.add_option(
+        "--scan-interval",
+        action="store",
+        dest="top_scan_interval",
+        default=None,
+        metavar="SECONDS",
+        type=float,
+        help="scan all the processes in /proc for the top MEM processes at most "
+        + "every SECONDS, sampling only the current top MEM processes in "
+        + "between (default=%d times the polling interval)" % TOP_SCAN_INTERVALS,
+    )
+
     process_opts.add_option(
         "-c",
         "--poll-command",
@@ -593,6 +2368,17 @@ being tracked by itself.
         + "command matching specified regular expression pattern",
     )
 
+    process_opts.add_option(
+        "-T",
+        "--tree",
+        action="store_true",
+        dest="tree",
+        default=False,
+        help="sample COMMAND, or the process given by --poll-pid, together "
+        + "with all of its descendants, reporting their summed RSS, VSIZE, "
+        + "CPU and MEM",
+    )
+
     polling_opts = OptionGroup(parser, "Polling Regime")
     parser.add_option_group(polling_opts)
 
@@ -607,6 +2393,61 @@ being tracked by itself.
         help="polling interval in seconds (default=%default)",
     )
 
+    polling_opts.add_option(
+        "-a",
+        "--adaptive",
+        action="store_true",
+        dest="adaptive",
+        default=False,
+        help="start polling every --min-interval seconds and back off "
+        + "geometrically to the polling interval, so that short processes are "
+        + "sampled densely and long processes are not oversampled",
+    )
+
+    polling_opts.add_option(
+        "--min-interval",
+        action="store",
+        dest="min_poll_interval",
+        default=MIN_POLL_INTERVAL,
+        metavar="#.####",
+        type=float,
+        help="initial polling interval in seconds when adaptive (default=%default)",
+    )
+
+    polling_opts.add_option(
+        "--backoff",
+        action="store",
+        dest="poll_backoff",
+        default=POLL_BACKOFF,
+        metavar="#.##",
+        type=float,
+        help="factor the polling interval grows by after each sample when "
+        + "adaptive (default=%default)",
+    )
+
+    polling_opts.add_option(
+        "--observer-cpus",
+        action="store",
+        dest="observer_cpus",
+        default=None,
+        metavar="CPUS",
+        help="comma separated CPUs to run Syrupy on, e.g. '0'; COMMAND runs on "
+        + "the other CPUs, so that sampling does not compete with it",
+    )
+
+    polling_opts.add_option(
+        "-b",
+        "--backend",
+        action="store",
+        dest="backend",
+        default="auto",
+        choices=BACKENDS,
+        metavar="BACKEND",
+        help="how to sample a single process: 'proc' reads /proc/<PID> directly, "
+        + "'ps' calls ps, and 'auto' uses /proc when available and falls back "
+        + "to ps (default=%default)",
+    )
+
     run_output_opts = OptionGroup(
         parser,
         "Output Modes",
@@ -664,6 +2505,56 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
         help="suppress writing of raw results from process sampling",
     )
 
+    run_output_opts.add_option(
+        "--history",
+        action="store",
+        dest="history",
+        default=None,
+        metavar="FILE",
+        help="keep a history of the samples in a fixed amount of memory, "
+        + "downsampling them to 1 second and then 1 minute min/max/avg buckets "
+        + "as they age, and write it to FILE as JSON Lines, followed by a "
+        + "summary record, when sampling ends or is interrupted",
+    )
+
+    run_output_opts.add_option(
+        "--sqlite",
+        action="store",
+        dest="sqlite",
+        default=None,
+        metavar="FILE",
+        help="record the run, its samples, their summary and the host in the "
+        + "SQLite database FILE, which is created if it does not exist",
+    )
+
+    run_output_opts.add_option(
+        "--label",
+        action="store",
+        dest="label",
+        default=None,
+        metavar="NAME",
+        help="label of the run in the SQLite database, e.g. the benchmark it "
+        + "belongs to",
+    )
+
+    run_output_opts.add_option(
+        "--language",
+        action="store",
+        dest="language",
+        default=None,
+        metavar="NAME",
+        help="language of the run in the SQLite database",
+    )
+
+    run_output_opts.add_option(
+        "--algorithm",
+        action="store",
+        dest="algorithm",
+        default=None,
+        metavar="NAME",
+        help="algorithm of the run in the SQLite database",
+    )
+
     formatting_opts = OptionGroup(parser, "Output Formatting")
     parser.add_option_group(formatting_opts)
 
@@ -675,6 +2566,40 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
         help="show command column in output",
     )
 
+    formatting_opts.add_option(
+        "-f",
+        "--format",
+        action="store",
+        dest="output_format",
+        default="text",
+        choices=OUTPUT_FORMATS,
+        metavar="FORMAT",
+        help="'text' for aligned columns, or 'jsonl' for a JSON object per "
+        + "sample followed by a summary record with the count, mean, min, max, "
+        + "p50, p95 and p99 of CPU, RSS and VSIZE and the elapsed time "
+        + "(default=%default)",
+    )
+
+    formatting_opts.add_option(
+        "-x",
+        "--extended",
+        action="store_true",
+        dest="extended",
+        default=False,
+        help="add the thread count, and the rates of page faults, context "
+        + "switches, bytes read and written and read and write system calls "
+        + "per second, read from /proc (see --explain)",
+    )
+
+    formatting_opts.add_option(
+        "--show-children",
+        action="store_true",
+        dest="show_children",
+        default=False,
+        help="with --tree, follow each aggregated row with a row for every "
+        + "descendant process",
+    )
+
     formatting_opts.add_option(
         "--separator",
         action="store",
@@ -719,6 +2644,31 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
         parser.print_usage()
         sys.exit(1)
 
+    if opts.backend == "proc" and (
+        opts.ssh is not None or (opts.poll_pid is None and opts.poll_command)
+    ):
+        parser.error(
+            "the proc backend can only sample a single local process or memory top"
+        )
+
+    if opts.adaptive and (opts.min_poll_interval <= 0 or opts.poll_backoff < 1):
+        parser.error("the minimum interval must be positive and the backoff at least 1")
+
+    if opts.tree and opts.poll_pid is None and (opts.poll_command or opts.poll_mem):
+        parser.error("a process tree can only be sampled from COMMAND or a PID")
+
+    if opts.observer_cpus is not None:
+        try:
+            opts.observer_cpus = set(int(c) for c in opts.observer_cpus.split(","))
+        except ValueError:
+            parser.error("the observer CPUs must be comma separated numbers")
+        if not hasattr(os, "sched_setaffinity"):
+            parser.error("pinning Syrupy to CPUs is not supported on this system")
+        if not opts.observer_cpus <= os.sched_getaffinity(0):
+            parser.error("the observer CPUs must be available to Syrupy")
+        if args and not os.sched_getaffinity(0) - opts.observer_cpus:
+            parser.error("no CPUs are left for COMMAND besides the observer CPUs")
+
     if opts.title is None and len(args) > 0:
         base_title = os.path.splitext(os.path.basename(args[0]))[0]
     else:
@@ -727,7 +2677,9 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
     if opts.syrupy_in_front:
         syrupy_output = sys.stdout
     else:
-        fname = base_title + ".ps.log"
+        fname = base_title + (
+            ".ps.jsonl" if opts.output_format == "jsonl" else ".ps.log"
+        )
         if not opts.quiet:
             sys.stderr.write(
                 "SYRUPY: Writing process resource usage samples to '%s'\n" % fname
@@ -744,6 +2696,43 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
             )
         raw_ps_log = open_file(base_title + ".ps.raw", "w", replace=opts.replace)
 
+    if opts.history is None:
+        history = None
+    else:
+        if not opts.quiet:
+            sys.stderr.write(
+                "SYRUPY: Writing the history of the samples to '%s'\n" % opts.history
+            )
+        history_file = open_file(opts.history, "w", replace=opts.replace)
+        history = SampleHistory()
+
+    if opts.sqlite is None:
+        database = None
+    else:
+        if not opts.quiet:
+            sys.stderr.write("SYRUPY: Recording the run in '%s'\n" % opts.sqlite)
+        if opts.poll_pid is not None:
+            target = "process %d" % opts.poll_pid
+        elif opts.poll_mem is not None:
+            target = "top %d processes by %s" % (opts.poll_mem, opts.top_rank.upper())
+        elif opts.poll_command is not None:
+            target = "process with command pattern '%s'" % opts.poll_command
+        else:
+            target = " ".join(args)
+        environment = host_environment()
+        environment.update(
+            backend=opts.backend,
+            interval=opts.poll_interval,
+            adaptive=opts.adaptive,
+            tree=opts.tree,
+            observer_cpus=",".join(str(c) for c in sorted(opts.observer_cpus or [])),
+        )
+        database = SampleDatabase(opts.sqlite)
+        database.start_run(
+            target, opts.label, opts.language, opts.algorithm, environment
+        )
+
+    usage = None
     if (
         opts.poll_pid is not None
         or opts.poll_command is not None
@@ -754,33 +2743,51 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
                 sys.stderr.write("SYRUPY: sampling process %d\n" % opts.poll_pid)
             elif opts.poll_mem is not None:
                 sys.stderr.write(
-                    "SYRUPY: sampling top %d processes by memory usage\n"
-                    % opts.poll_mem
+                    "SYRUPY: sampling top %d processes by %s\n"
+                    % (opts.poll_mem, opts.top_rank.upper())
                 )
             else:
                 sys.stderr.write(
                     "SYRUPY: sampling process with command pattern '%s'\n"
                     % opts.poll_command
                 )
-        profile_process(
-            pid=opts.poll_pid,
-            command_pattern=opts.poll_command,
-            top_mem=opts.poll_mem,
-            syrupy_output=syrupy_output,
-            raw_ps_log=raw_ps_log,
-            poll_interval=opts.poll_interval,
-            quit_poll_func=None,
-            ssh_id=opts.ssh,
-            has_ssh=True if opts.ssh else False,
-            quit_if_none=True if opts.poll_pid else False,
-            quit_at_time=None,
-            show_command=opts.show_command,
-            output_separator=opts.separator,
-            align=opts.align,
-            headers=opts.headers,
-            flush_output=opts.flush_output,
-            debug_level=opts.debug,
-        )
+        try:
+            profile_process(
+                pid=opts.poll_pid,
+                command_pattern=opts.poll_command,
+                top_mem=opts.poll_mem,
+                syrupy_output=syrupy_output,
+                raw_ps_log=raw_ps_log,
+                poll_interval=opts.poll_interval,
+                quit_poll_func=None,
+                ssh_id=opts.ssh,
+                has_ssh=True if opts.ssh else False,
+                quit_if_none=True if opts.poll_pid else False,
+                quit_at_time=None,
+                show_command=opts.show_command,
+                output_separator=opts.separator,
+                align=opts.align,
+                headers=opts.headers,
+                flush_output=opts.flush_output,
+                debug_level=opts.debug,
+                backend=opts.backend,
+                top_rank=opts.top_rank,
+                top_scan_interval=opts.top_scan_interval,
+                min_poll_interval=opts.min_poll_interval if opts.adaptive else None,
+                poll_backoff=opts.poll_backoff,
+                tree=opts.tree,
+                show_children=opts.show_children,
+                output_format=opts.output_format,
+                history=history,
+                extended=opts.extended,
+                observer_cpus=opts.observer_cpus,
+                database=database,
+            )
+        except KeyboardInterrupt:
+            # Long sessions are usually ended by the user, so keep the history
+            # and the database.
+            if history is None and database is None:
+                raise
     else:
         command = args
         if not opts.quiet:
@@ -806,7 +2813,7 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
                     "SYRUPY: Redirecting command error stream to '%s'\n" % cerr
                 )
             command_stderr = open_file(cerr, "w", replace=opts.replace)
-        start_time, end_time = profile_command(
+        start_time, end_time, usage = profile_command(
             command=command,
             command_stdout=command_stdout,
             command_stderr=command_stderr,
@@ -819,6 +2826,16 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
             headers=opts.headers,
             flush_output=opts.flush_output,
             debug_level=opts.debug,
+            backend=opts.backend,
+            min_poll_interval=opts.min_poll_interval if opts.adaptive else None,
+            poll_backoff=opts.poll_backoff,
+            tree=opts.tree,
+            show_children=opts.show_children,
+            output_format=opts.output_format,
+            history=history,
+            extended=opts.extended,
+            observer_cpus=opts.observer_cpus,
+            database=database,
         )
 
         if not opts.quiet:
@@ -836,9 +2853,48 @@ standard output and standard error ('-C'), or suppress all COMMAND output altoge
                 % (hours, mins, secs)
             )
             final_run_report.append(run_time)
+            final_run_report.append(
+                "SYRUPY: Elapsed time: %.9f second(s)" % usage["elapsed"]
+            )
+            final_run_report.append(
+                "SYRUPY: CPU time: %.6f second(s) user, %.6f second(s) system"
+                % (usage["user_time"], usage["system_time"])
+            )
+            final_run_report.append("SYRUPY: Peak RSS: %d kB" % usage["max_rss"])
+            final_run_report.append(
+                "SYRUPY: Context switches: %d voluntary, %d involuntary"
+                % (usage["voluntary_switches"], usage["involuntary_switches"])
+            )
+            final_run_report.append(
+                "SYRUPY: Page faults: %d minor, %d major"
+                % (usage["minor_faults"], usage["major_faults"])
+            )
+            final_run_report.append("SYRUPY: Exit code: %d" % usage["exit_code"])
+            observer = usage["observer"]
+            final_run_report.append(
+                "SYRUPY: Observer overhead: %.6f second(s) CPU (%.2f%% of the run), "
+                "%d sample(s), %.1f us mean sampling latency"
+                % (
+                    observer["cpu_time"],
+                    observer["overhead"] or 0,
+                    observer["samples"],
+                    (observer["latency"]["mean"] or 0) * 1e6,
+                )
+            )
             report = "\n".join(final_run_report) + "\n"
             sys.stderr.write(report)
 
+    if database is not None:
+        database.finish(usage)
+        database.close()
+
+    if history is not None:
+        for record in history.export():
+            history_file.write(json.dumps(record) + "\n")
+        summary = history.summary(usage and usage["elapsed"], usage)
+        history_file.write(json.dumps(summary) + "\n")
+        history_file.close()
+
 
 if __name__ == "__main__":
     main()
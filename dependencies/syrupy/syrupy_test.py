@@ -0,0 +1,508 @@
+import array
+import asyncio
+import datetime
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+import syrupy
+
+requires_proc = pytest.mark.skipif(
+    not os.path.exists(os.path.join(syrupy.PROC_DIR, "self", "stat")),
+    reason="needs /proc",
+)
+
+
+@pytest.fixture
+def sleeper():
+    process = subprocess.Popen(["sleep", "30"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def record(pid, ppid, cpu="1.0", mem="0.5", rss="100", vsz="1000"):
+    return {
+        "pid": str(pid),
+        "ppid": str(ppid),
+        "%cpu": cpu,
+        "%mem": mem,
+        "rss": rss,
+        "vsz": vsz,
+        "etime": "00:01",
+        "command": "command",
+        "poll_datetime": "2026-10-19 12:00:00.000000",
+    }
+
+
+def sample(cpu=1.0, mem=0.5, rss=100, vsz=1000):
+    return {
+        "datetime": "2026-10-19 12:00:00.000000",
+        "elapsed": 1.0,
+        "pid": 1,
+        "cpu": cpu,
+        "mem": mem,
+        "rss": rss,
+        "vsz": vsz,
+    }
+
+
+@pytest.mark.parametrize(
+    "seconds, etime",
+    [(5, "00:05"), (3723, "01:02:03"), (172801, "2-00:00:01")],
+)
+def test_that_etime_is_formatted_like_ps(seconds, etime):
+    assert syrupy.format_etime(seconds) == etime
+    assert syrupy.parse_etime(etime) == seconds
+
+
+def test_that_summarize_returns_nearest_rank_percentiles():
+    summary = syrupy.summarize(range(100, 0, -1))
+    assert summary["mean"] == 50.5
+    assert (summary["min"], summary["max"]) == (1, 100)
+    assert (summary["p50"], summary["p95"], summary["p99"]) == (50, 95, 99)
+    assert set(syrupy.summarize([]).values()) == {None}
+
+
+def test_that_samples_are_weighted_by_the_time_until_the_next_one():
+    # Two processes sampled at each poll share the weight of the poll.
+    times = [0.0, 0.0, 0.1, 0.1, 1.0]
+    assert syrupy.sample_weights(times, 3.0) == pytest.approx([0.1, 0.1, 0.9, 0.9, 2.0])
+    assert syrupy.sample_weights(times) == pytest.approx([0.1, 0.1, 0.9, 0.9, 0])
+    assert syrupy.sample_weights([]) == []
+
+
+def test_that_a_burst_of_early_samples_does_not_skew_the_summary():
+    # Adaptive sampling: 7 samples of a small process in its first 20 ms,
+    # then a sample every second once it has grown.
+    times = [0, 0.001, 0.002, 0.004, 0.008, 0.012, 0.016] + list(range(1, 8))
+    rss = [8000] * 7 + [50000] * 7
+    summary = syrupy.summarize(rss, syrupy.sample_weights(times, 8))
+    assert syrupy.summarize(rss)["mean"] == 29000
+    # The small process ran for 1 of the 8 seconds.
+    assert summary["mean"] == pytest.approx((8000 * 1 + 50000 * 7) / 8)
+    assert (summary["min"], summary["p50"], summary["max"]) == (8000, 50000, 50000)
+    # Without weights, like a single sample, the samples count the same.
+    assert syrupy.summarize(rss, [0] * 14)["mean"] == 29000
+
+
+def test_that_a_sample_record_converts_the_fields_to_numbers():
+    converted = syrupy.sample_record(record(10, 1, cpu="2.5", rss="300"))
+    assert converted["type"] == "sample"
+    assert converted["pid"] == 10
+    assert converted["cpu"] == 2.5
+    assert converted["rss"] == 300
+    assert converted["elapsed"] == 1
+
+
+def test_that_jsonl_output_ends_with_a_summary_of_the_samples(sleeper):
+    output = io.StringIO()
+    stop = time.monotonic() + 0.3
+    summary = syrupy.profile_process(
+        pid=sleeper.pid,
+        syrupy_output=output,
+        poll_interval=0.05,
+        min_poll_interval=0.001,
+        quit_poll_func=lambda: time.monotonic() > stop,
+        headers=False,
+        output_format="jsonl",
+    )
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert records[-1] == json.loads(json.dumps(summary))
+    samples = records[:-1]
+    assert {r["type"] for r in samples} == {"sample"}
+    assert summary["count"] == len(samples)
+    rss = summary["rss"]
+    assert rss["min"] == min(r["rss"] for r in samples)
+    assert rss["min"] <= rss["mean"] <= rss["max"]
+
+
+@requires_proc
+def test_that_the_proc_sampler_samples_a_running_process(sleeper):
+    sampler = syrupy.ProcSampler(sleeper.pid)
+    try:
+        (pinfo,) = sampler.poll()
+        assert pinfo["pid"] == str(sleeper.pid)
+        assert pinfo["ppid"] == str(os.getpid())
+        assert pinfo["command"] == "sleep 30"
+        assert int(pinfo["rss"]) > 0 and int(pinfo["vsz"]) >= int(pinfo["rss"])
+        assert syrupy.ProcSampler(sleeper.pid, "python").poll() == []
+
+        sleeper.kill()
+        sleeper.wait()
+        assert sampler.poll() == []
+    finally:
+        sampler.close()
+
+
+def test_that_the_ps_backend_is_used_without_a_local_pid():
+    assert syrupy.open_sampler(None, "sleep") is None
+    assert syrupy.open_sampler(os.getpid(), backend="ps") is None
+    with pytest.raises(ValueError):
+        syrupy.open_sampler(None, "sleep", backend="proc")
+
+
+def test_that_adaptive_sampling_backs_off_to_the_poll_interval(sleeper):
+    times = []
+    syrupy.profile_process(
+        pid=sleeper.pid,
+        poll_interval=0.1,
+        min_poll_interval=0.001,
+        poll_backoff=2.0,
+        quit_poll_func=lambda: len(times) >= 10,
+        headers=False,
+        sample_func=lambda record: times.append(time.monotonic()),
+    )
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    # 1, 2, 4, 8, 16, 32 and 64 ms, then the poll interval.
+    assert sum(gaps[:5]) < 0.1
+    assert gaps[-1] == pytest.approx(0.1, abs=0.05)
+
+
+def test_that_a_profile_result_summary_is_not_skewed_by_adaptive_samples():
+    result = syrupy.ProfileResult(["command"])
+    times = [0, 0.001, 0.002, 0.004, 0.008, 0.012, 0.016] + list(range(1, 8))
+    for elapsed in times:
+        sample = syrupy.sample_record(
+            record(10, 1, rss="8000" if elapsed < 1 else "50000")
+        )
+        sample["elapsed"] = elapsed
+        result.append(sample)
+    summary = result.summarize(8)
+    assert summary["count"] == 14
+    assert summary["rss"]["mean"] == pytest.approx((8000 * 1 + 50000 * 7) / 8)
+
+
+def test_that_a_command_is_reaped_with_its_exact_resource_usage():
+    start_time, end_time, usage = syrupy.profile_command(
+        command=[
+            sys.executable,
+            "-c",
+            "import time; x = bytearray(10 ** 7); time.sleep(0.1); raise SystemExit(2)",
+        ],
+        command_stdout=None,
+        command_stderr=None,
+        syrupy_output=None,
+        poll_interval=0.05,
+        headers=False,
+    )
+    assert usage["exit_code"] == 2
+    # The exact peak from wait4 covers the 10 MB buffer, even between samples.
+    assert usage["max_rss"] >= 10**4
+    assert usage["elapsed"] >= 0.1
+    assert usage["user_time"] + usage["system_time"] > 0
+    assert end_time > start_time
+
+
+def test_that_a_tree_sums_the_usage_of_all_descendants():
+    records = [
+        record(10, 1, cpu="1.5", rss="100"),
+        record(11, 10, cpu="2.0", rss="200"),
+        record(12, 11, cpu="0.5", rss="300"),
+        record(13, 1, cpu="9.0", rss="900"),
+    ]
+    (tree,) = syrupy.aggregate_tree(records, 10)
+    assert tree["pid"] == "10"
+    assert tree["processes"] == 3
+    assert tree["rss"] == "600"
+    assert tree["%cpu"] == "4.0"
+    assert [child["pid"] for child in tree["children"]] == ["11", "12"]
+    converted = syrupy.sample_record(tree)
+    assert (converted["processes"], converted["rss"]) == (3, 600)
+    assert [child["rss"] for child in converted["children"]] == [200, 300]
+    assert syrupy.aggregate_tree(records, 99) == []
+
+
+@requires_proc
+def test_that_the_tree_sampler_includes_children():
+    shell = subprocess.Popen(["sh", "-c", "sleep 30 & sleep 30 & wait"])
+    try:
+        sampler = syrupy.ProcTreeSampler(shell.pid)
+        deadline = time.monotonic() + 5
+        while True:
+            (tree,) = sampler.poll()
+            if tree["processes"] == 3 or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        assert tree["processes"] == 3
+        assert sorted(child["command"] for child in tree["children"]) == [
+            "sleep 30",
+            "sleep 30",
+        ]
+        sampler.close()
+    finally:
+        for pid in syrupy.find_descendants(shell.pid):
+            os.kill(pid, 9)
+        shell.kill()
+        shell.wait()
+
+
+def test_that_the_exit_watcher_notices_the_exit_of_a_process(sleeper):
+    try:
+        watcher = syrupy.ExitWatcher(sleeper.pid)
+    except (AttributeError, OSError):
+        pytest.skip("needs pidfd_open")
+    try:
+        assert not watcher.wait(0.01)
+        sleeper.kill()
+        assert watcher.wait(5)
+    finally:
+        watcher.close()
+
+
+@pytest.fixture
+def zombie():
+    process = subprocess.Popen(["true"])
+    # It stays a zombie, with a readable pidfd, until it is reaped.
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    yield process
+    process.wait()
+
+
+def test_that_sampling_a_zombie_does_not_spin(zombie):
+    samples = []
+    stop = time.monotonic() + 0.5
+    syrupy.profile_process(
+        pid=zombie.pid,
+        poll_interval=0.1,
+        quit_poll_func=lambda: time.monotonic() > stop,
+        headers=False,
+        backend="ps",
+        sample_func=samples.append,
+    )
+    assert 0 < len(samples) <= 8
+
+
+def test_that_monitoring_a_zombie_does_not_spin(zombie, monkeypatch):
+    # Sample with ps, which still lists the zombie.
+    monkeypatch.setattr(syrupy, "open_sampler", lambda pid, tree=False: None)
+
+    async def watch():
+        monitor = syrupy.Monitor(poll_interval=0.1, min_poll_interval=None)
+        task = asyncio.ensure_future(monitor.watch(zombie.pid))
+        await asyncio.sleep(0.5)
+        zombie.wait()
+        return await task
+
+    result = asyncio.run(watch())
+    assert 0 < len(result) <= 8
+
+
+def test_that_the_profiler_reports_the_samples_and_usage_of_a_command():
+    profiler = syrupy.Profiler(
+        [sys.executable, "-c", "import time; x = bytearray(10 ** 7); time.sleep(0.1)"],
+        poll_interval=0.05,
+    )
+    result = profiler.run()
+    assert len(result) > 0
+    assert isinstance(result.rss, array.array)
+    assert result.summary["count"] == len(result)
+    assert result.summary["cpu"]["mean"] is not None
+    assert result.usage["exit_code"] == 0
+    # The exact peak from wait4 covers the 10 MB buffer, even between samples.
+    assert result.usage["max_rss"] >= 10**4
+    assert result.usage["elapsed"] >= 0.1
+    assert result.start_time < result.end_time
+    # A profiler can be run again, with a new result.
+    assert profiler.run() is not result
+
+
+def test_that_the_monitor_samples_every_target():
+    running = subprocess.Popen(["sleep", "0.2"])
+    monitor = syrupy.Monitor(poll_interval=0.05)
+    monitor.add_command(["sleep", "0.1"])
+    monitor.add_command([sys.executable, "-c", "raise SystemExit(3)"])
+    monitor.add_pid(running.pid)
+    try:
+        sleep, failing, attached = monitor.run()
+    finally:
+        running.wait()
+    assert len(sleep) > 0
+    assert sleep.usage["exit_code"] == 0
+    assert failing.usage["exit_code"] == 3
+    assert len(attached) > 0 and attached.usage is None
+    assert attached.summary["count"] == len(attached)
+
+
+def test_that_the_history_downsamples_old_samples_in_bounded_memory():
+    history = syrupy.SampleHistory(detail=10, capacity=20, tiers=[(5, 4)])
+    for t in range(100):
+        history.add(sample(cpu=t), t)
+
+    records = history.export()
+    assert sum(tier.size for tier in history.tiers) <= 20 + 4
+    # Samples of the last 10 seconds are kept as they are, older ones in buckets
+    # of 5 seconds, and the oldest are dropped.
+    assert [r["resolution"] for r in records] == [5] * 4 + [0] * 11
+    assert records[-1]["cpu"] == {"min": 99, "max": 99, "avg": 99}
+    assert records[0]["cpu"] == {"min": 70, "max": 74, "avg": 72}
+
+    summary = history.summary()
+    assert summary["count"] == 100
+    assert (summary["cpu"]["min"], summary["cpu"]["max"]) == (0, 99)
+    assert summary["cpu"]["mean"] == 49.5
+
+
+@requires_proc
+def test_that_the_proc_sampler_samples_the_extended_counters(sleeper):
+    sampler = syrupy.ProcSampler(sleeper.pid, extended=True)
+    try:
+        sampler.poll()
+        (pinfo,) = sampler.poll()
+    finally:
+        sampler.close()
+    converted = syrupy.sample_record(pinfo)
+    assert converted["threads"] == 1
+    for name in ("minflt", "majflt", "vcsw", "nvcsw"):
+        assert converted[name] >= 0
+        assert converted[name + "_rate"] >= 0
+    assert "minflt" not in syrupy.sample_record(record(10, 1))
+
+
+def test_that_the_observer_measures_every_sample():
+    observer = syrupy.ObserverStats()
+    for _ in range(3):
+        observer.begin()
+        observer.end()
+    summary = observer.summary()
+    assert summary["samples"] == 3
+    assert summary["latency"]["min"] <= summary["latency"]["mean"]
+    assert summary["latency"]["mean"] <= summary["latency"]["max"]
+    assert summary["cpu_time"] >= 0 and summary["wall_time"] > 0
+
+
+def test_that_the_summary_reports_the_observer_overhead(sleeper):
+    output = io.StringIO()
+    stop = time.monotonic() + 0.2
+    summary = syrupy.profile_process(
+        pid=sleeper.pid,
+        syrupy_output=output,
+        poll_interval=0.05,
+        quit_poll_func=lambda: time.monotonic() > stop,
+        headers=False,
+        output_format="jsonl",
+    )
+    samples = [json.loads(line) for line in output.getvalue().splitlines()[:-1]]
+    assert summary["observer"]["samples"] >= len(samples)
+    assert all(s["observer_latency"] > 0 for s in samples)
+    result = syrupy.Profiler(["true"]).run()
+    assert result.summary["observer"] == result.usage["observer"]
+
+
+def test_that_the_top_sampler_ranks_processes_by_their_statm(tmp_path, monkeypatch):
+    sizes = {"1": "500 10", "2": "100 40", "3": "300 30", "4": "200 20"}
+    for pid, statm in sizes.items():
+        (tmp_path / pid).mkdir()
+        (tmp_path / pid / "statm").write_text(statm + " 0 0 0 0 0\n")
+    # Not a process, and a process which exited during the scan.
+    (tmp_path / "self").mkdir()
+    (tmp_path / "5").mkdir()
+    monkeypatch.setattr(syrupy, "PROC_DIR", str(tmp_path))
+
+    assert syrupy.ProcTopSampler(2, "vsz").scan() == [1, 3]
+    assert syrupy.ProcTopSampler(2, "rss").scan() == [2, 3]
+    with pytest.raises(ValueError):
+        syrupy.ProcTopSampler(2, "cpu")
+
+
+@requires_proc
+def test_that_the_top_sampler_only_samples_the_top_processes_between_scans(
+    monkeypatch,
+):
+    sampler = syrupy.ProcTopSampler(3, "rss", scan_interval=60)
+    scans = []
+    scan = sampler.scan
+
+    def counted_scan():
+        scans.append(scan())
+        return scans[-1]
+
+    monkeypatch.setattr(sampler, "scan", counted_scan)
+    try:
+        for _ in range(3):
+            records = sampler.poll()
+            assert len(records) <= 3
+            assert str(os.getpid()) not in [r["pid"] for r in records]
+        # The statm of every process is read once, then only the top processes.
+        assert len(scans) == 1
+        assert set(sampler.samplers) <= set(scans[0])
+    finally:
+        sampler.close()
+
+
+def test_that_the_top_processes_are_scanned_every_few_polling_intervals(
+    monkeypatch,
+):
+    intervals = []
+
+    def open_sampler(pid, *args):
+        intervals.append(args[-1])
+
+    monkeypatch.setattr(syrupy, "open_sampler", open_sampler)
+    monkeypatch.setattr(syrupy, "poll_process", lambda **kwargs: [])
+    for scan_interval in (None, 0.5):
+        syrupy.profile_process(
+            top_mem=3,
+            poll_interval=0.2,
+            quit_if_none=True,
+            headers=False,
+            top_scan_interval=scan_interval,
+        )
+    assert intervals == [syrupy.TOP_SCAN_INTERVALS * 0.2, 0.5]
+
+
+def test_that_the_database_records_runs_samples_and_aggregates(tmp_path):
+    path = str(tmp_path / "runs.sqlite")
+    database = syrupy.SampleDatabase(path, batch_size=2)
+    run_id = database.start_run(
+        "sleep 1", "report", "python", "sieve", {"hostname": "host"}
+    )
+    for rss in (100, 300, 200):
+        database.add(sample(rss=rss))
+    database.finish({"elapsed": 1.5, "exit_code": 0, "max_rss": 400})
+    database.close()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert connection.execute(
+        "SELECT label, language, algorithm, elapsed, exit_code, max_rss FROM runs "
+        "WHERE id = ?",
+        (run_id,),
+    ).fetchone() == ("report", "python", "sieve", 1.5, 0, 400)
+    assert connection.execute("SELECT name, value FROM environment").fetchall() == [
+        ("hostname", "host")
+    ]
+    assert connection.execute("SELECT COUNT(*) FROM samples").fetchone() == (3,)
+    assert connection.execute(
+        "SELECT count, mean, min, max, p50 FROM aggregates WHERE metric = 'rss'"
+    ).fetchone() == (3, 200, 100, 300, 200)
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM runs WHERE language = 'python' "
+        "AND algorithm = 'sieve' AND started_at > '2026'"
+    ).fetchall()
+    assert "runs_by_language" in str(plan)
+
+
+def test_that_the_database_aggregates_are_weighted_by_time(tmp_path):
+    database = syrupy.SampleDatabase(str(tmp_path / "runs.sqlite"))
+    database.start_run("sleep 2")
+    # 10 samples in the first 10 ms of a 2 seconds run, then one at 1 second.
+    start = datetime.datetime.now() - datetime.timedelta(seconds=2)
+    offsets = [0.001 * i for i in range(10)] + [1.0]
+    for offset in offsets:
+        record = sample(rss=100 if offset < 1 else 300)
+        record["datetime"] = (start + datetime.timedelta(seconds=offset)).isoformat(" ")
+        database.add(record)
+    database.finish()
+    count, mean = database.connection.execute(
+        "SELECT count, mean FROM aggregates WHERE metric = 'rss'"
+    ).fetchone()
+    database.close()
+    assert count == 11
+    # Unweighted, the mean would be 118.
+    assert mean == pytest.approx(200, abs=20)
@@ -0,0 +1,211 @@
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+from typing import Dict, List, Union
+
+from markdown_corpus import MIXES, PATHOLOGICAL, parse_size, write_document
+
+DEFAULT_SIZES = ["1K", "10K", "100K", "1M"]
+DEFAULT_RUNS = 3
+COLUMNS = ["MIX", "SIZE (B)", "TIME (s)", "THROUGHPUT (MB/s)", "PEAK RSS (KB)"]
+
+
+def measure(filename: str, workers: int = 1) -> Dict[str, Union[int, float]]:
+    """
+    Parse the given file in this process, writing `parsed.html` to the current
+    directory, and measure the time taken and the peak memory used.
+
+    :param filename: The path of the markdown file to parse.
+    :param workers: The number of worker processes used to parse the file.
+    :returns: The time taken in seconds and the peak resident set size in kilobytes,
+        including that of any worker processes.
+    """
+    from markdown_parser import MarkdownParser
+
+    start = time.perf_counter()
+    MarkdownParser(filename, False, False, False, workers)
+    elapsed = time.perf_counter() - start
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return {"seconds": elapsed, "peak_rss": peak_rss}
+
+
+def run_benchmark(
+    sizes: List[int],
+    mixes: List[str],
+    seed: int = 0,
+    workers: int = 1,
+    runs: int = DEFAULT_RUNS,
+) -> List[Dict[str, Union[str, int, float]]]:
+    """
+    Generate a document for every size and feature mix, and measure the throughput and
+    peak memory of parsing it. Each run is measured in a new process, so that the peak
+    memory of one run does not hide that of the next.
+
+    :param sizes: The minimum sizes of the documents in bytes.
+    :param mixes: The names of the feature mixes, or pathological inputs, of the
+        documents.
+    :param seed: The seed used to generate every document.
+    :param workers: The number of worker processes used to parse each document.
+    :param runs: The number of times to parse each document. The fastest run and the
+        highest peak memory are reported.
+    :returns: A result for every feature mix and size.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = path.join(directory, "corpus.md")
+        for mix in mixes:
+            for size in sizes:
+                with open(corpus, "w") as file:
+                    written = write_document(file, mix, size, seed)
+
+                measurements = []
+                for _ in range(runs):
+                    process = subprocess.run(
+                        [
+                            sys.executable,
+                            path.abspath(__file__),
+                            "--measure",
+                            corpus,
+                            str(workers),
+                        ],
+                        cwd=directory,
+                        stdout=subprocess.PIPE,
+                        check=True,
+                        text=True,
+                    )
+                    measurements.append(json.loads(process.stdout))
+
+                seconds = min(m["seconds"] for m in measurements)
+                results.append(
+                    {
+                        "mix": mix,
+                        "size": written,
+                        "seconds": seconds,
+                        "throughput": written / 1_000_000 / seconds,
+                        "peak_rss": max(m["peak_rss"] for m in measurements),
+                    }
+                )
+    return results
+
+
+def format_results(
+    results: List[Dict[str, Union[str, int, float]]], csv: bool = False
+) -> str:
+    """
+    Format the benchmark results as an aligned table or as CSV.
+
+    :param results: The results returned by `run_benchmark`.
+    :param csv: Boolean flag to specify whether to format the results as CSV.
+    :returns: The formatted results, including a header line.
+    """
+    rows = [COLUMNS]
+    for result in results:
+        rows.append(
+            [
+                result["mix"],
+                str(result["size"]),
+                f"{result['seconds']:.4f}",
+                f"{result['throughput']:.3f}",
+                str(result["peak_rss"]),
+            ]
+        )
+    if csv:
+        return "\n".join(",".join(row) for row in rows)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
+
+
+def show_help_message():
+    """Display a help message and exit the program."""
+    print(
+        f"""
+Measures the parse throughput and peak memory of the markdown parser on generated
+documents of different sizes and feature mixes.
+
+usage: python markdown_benchmark.py [--help] [--sizes <sizes>] [--mixes <feature mixes>]
+                                    [--seed <seed>] [--workers <number of processes>]
+                                    [--runs <runs>] [--csv] [--pathological]
+
+--help: Display this help message and exit.
+--sizes: Comma separated sizes of the documents. Defaults to {",".join(DEFAULT_SIZES)}.
+--mixes: Comma separated feature mixes of the documents. Defaults to all of them:
+         {",".join(MIXES)}.
+--seed: The seed used to generate the documents. Defaults to 0.
+--workers: The number of processes used to parse each document. Defaults to 1.
+--runs: The number of times each document is parsed. The fastest run is reported.
+        Defaults to {DEFAULT_RUNS}.
+--csv: Print the results as CSV instead of a table.
+--pathological: Benchmark adversarial single line documents instead of the feature
+                mixes: {",".join(PATHOLOGICAL)}.
+                The parser is linear in the length of a line, so their throughput
+                should not drop as their size grows.
+
+Example usage:
+python markdown_benchmark.py --sizes 1M,100M --mixes plain,inline --workers 8
+python markdown_benchmark.py --sizes 10K,100K,1M --pathological
+
+Exit Codes:
+0 - OK
+1 - Erroneous input
+
+Author: Marios Yiannakou, GitHub: @Mariosyian"""
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    if "--measure" in sys.argv:
+        index = sys.argv.index("--measure")
+        print(json.dumps(measure(sys.argv[index + 1], int(sys.argv[index + 2]))))
+        sys.exit(0)
+
+    flags = {
+        "help": "--help" in sys.argv,
+        "sizes": "--sizes" in sys.argv,
+        "mixes": "--mixes" in sys.argv,
+        "seed": "--seed" in sys.argv,
+        "workers": "--workers" in sys.argv,
+        "runs": "--runs" in sys.argv,
+        "csv": "--csv" in sys.argv,
+        "pathological": "--pathological" in sys.argv,
+    }
+
+    if flags["help"]:
+        show_help_message()
+
+    def argument(flag: str, default: str) -> str:
+        return sys.argv[sys.argv.index(flag) + 1] if flags[flag[2:]] else default
+
+    try:
+        sizes = [
+            parse_size(s)
+            for s in argument("--sizes", ",".join(DEFAULT_SIZES)).split(",")
+        ]
+        default_mixes = PATHOLOGICAL if flags["pathological"] else MIXES
+        mixes = argument("--mixes", ",".join(default_mixes)).split(",")
+        seed = int(argument("--seed", "0"))
+        workers = int(argument("--workers", "1"))
+        runs = int(argument("--runs", str(DEFAULT_RUNS)))
+    except (IndexError, ValueError) as e:
+        print(f"Invalid arguments: {e}")
+        sys.exit(1)
+
+    unknown = [mix for mix in mixes if mix not in MIXES and mix not in PATHOLOGICAL]
+    if unknown:
+        print(f"Unknown feature mixes: {', '.join(unknown)}")
+        sys.exit(1)
+
+    print(
+        format_results(run_benchmark(sizes, mixes, seed, workers, runs), flags["csv"])
+    )
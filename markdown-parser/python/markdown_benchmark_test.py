@@ -0,0 +1,32 @@
+import markdown_benchmark as benchmark
+
+
+def test_run_benchmark():
+    results = benchmark.run_benchmark([1024, 4096], ["plain"], runs=1)
+    assert [(r["mix"], r["size"] >= s) for r, s in zip(results, [1024, 4096])] == [
+        ("plain", True),
+        ("plain", True),
+    ]
+    for result in results:
+        assert result["seconds"] > 0
+        assert result["throughput"] > 0
+        assert result["peak_rss"] > 0
+
+
+def test_format_results():
+    results = [
+        {
+            "mix": "plain",
+            "size": 1024,
+            "seconds": 0.5,
+            "throughput": 0.002,
+            "peak_rss": 10,
+        }
+    ]
+    assert benchmark.format_results(results, csv=True).splitlines() == [
+        ",".join(benchmark.COLUMNS),
+        "plain,1024,0.5000,0.002,10",
+    ]
+    table = benchmark.format_results(results).splitlines()
+    assert table[0].split() == " ".join(benchmark.COLUMNS).split()
+    assert table[1].split() == ["plain", "1024", "0.5000", "0.002", "10"]
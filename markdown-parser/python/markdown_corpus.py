@@ -0,0 +1,322 @@
+import random
+import sys
+from typing import Dict, Iterator, TextIO
+
+# Relative weights of each markdown feature in the predefined feature mixes.
+MIXES = {
+    "plain": {"paragraph": 1},
+    "mixed": {
+        "paragraph": 4,
+        "header": 1,
+        "emphasis": 2,
+        "link": 1,
+        "image": 1,
+        "blockquote": 1,
+        "unordered_list": 1,
+        "ordered_list": 1,
+    },
+    "inline": {"paragraph": 1, "emphasis": 3, "link": 2, "image": 2},
+    "blocks": {"header": 2, "blockquote": 2, "unordered_list": 2, "ordered_list": 2},
+}
+
+# Units repeated on a single line to build adversarial documents, which used to make
+# the parser re-scan the rest of the line for every special character on it.
+PATHOLOGICAL = {
+    "emphasis-bomb": "*a* **b** ***c*** _d_ ",
+    "bracket-bomb": "[a ",
+    "image-bomb": "![a ",
+    "link-bomb": "[a](b) ",
+    "list-bomb": "- a ",
+    "long-line": "plain text ",
+}
+
+# Only contains characters which the markdown parser treats as plain text.
+WORDS = (
+    "the quick brown fox jumps over lazy dog markdown parser benchmark language "
+    "program memory time score python haxe sieve prime number block line list item "
+    "quote header link image text bold italic paragraph document corpus random seed "
+    "size feature mix throughput output input file string stack element"
+).split()
+
+# Multipliers used to parse sizes such as `10K` or `1GB`.
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class CorpusGenerator:
+    """
+    Generates synthetic markdown documents for benchmarking the markdown parser. The
+    same seed and feature mix always produce the same document.
+
+    Every block uses only the markdown understood by the parser, in the way it is used
+    in the demo content, so that documents of any size can be parsed.
+    """
+
+    def __init__(self, mix: Dict[str, int] = None, seed: int = 0):
+        """
+        :param mix: The relative weight of each feature, e.g. `{"header": 1}`. Defaults
+            to the `mixed` feature mix.
+        :param seed: The seed of the random number generator.
+        :raises: A `ValueError` if the mix contains an unknown feature or no weights.
+        """
+        mix = MIXES["mixed"] if mix is None else mix
+        generators = {
+            "paragraph": self.paragraph,
+            "header": self.header,
+            "emphasis": self.emphasis,
+            "link": self.link,
+            "image": self.image,
+            "blockquote": self.blockquote,
+            "unordered_list": self.unordered_list,
+            "ordered_list": self.ordered_list,
+        }
+        unknown = set(mix) - set(generators)
+        if unknown:
+            raise ValueError(f"Unknown markdown features: {', '.join(sorted(unknown))}")
+        if sum(mix.values()) <= 0:
+            raise ValueError("The feature mix must contain at least one weight.")
+
+        self.random = random.Random(seed)
+        self.generators = [generators[feature] for feature in sorted(mix)]
+        self.weights = [mix[feature] for feature in sorted(mix)]
+
+    def blocks(self, size: int) -> Iterator[str]:
+        """
+        Generate blocks of markdown, each one followed by a blank line, until they
+        contain at least `size` characters.
+
+        :param size: The minimum amount of characters to generate. Characters are
+            ASCII, so this is also the size in bytes.
+        :returns: An iterator over the generated blocks.
+        """
+        generated = 0
+        while generated < size:
+            (generator,) = self.random.choices(self.generators, self.weights)
+            block = f"{generator()}\n\n"
+            generated += len(block)
+            yield block
+
+    def write(self, output: TextIO, size: int) -> int:
+        """
+        Write a document of at least `size` characters to the given file.
+
+        :param output: The file to write to.
+        :param size: The minimum amount of characters to write.
+        :returns: The amount of characters written.
+        """
+        written = 0
+        for block in self.blocks(size):
+            written += output.write(block)
+        return written
+
+    def words(self, minimum: int = 3, maximum: int = 12) -> str:
+        """Generate a random amount of plain words."""
+        count = self.random.randint(minimum, maximum)
+        return " ".join(self.random.choice(WORDS) for _ in range(count))
+
+    def sentence(self) -> str:
+        """Generate a line of plain text."""
+        return f"{self.words().capitalize()}."
+
+    def styled(self) -> str:
+        """Generate a line of text with bold, italic, or bold and italic words."""
+        marker = "*" * self.random.randint(1, 3)
+        return (
+            f"{self.words(1, 6)} {marker}{self.words(1, 4)}{marker} {self.words(1, 6)}."
+        )
+
+    def paragraph(self) -> str:
+        """Generate a paragraph spanning one or more lines."""
+        return "\n".join(self.sentence() for _ in range(self.random.randint(1, 4)))
+
+    def header(self) -> str:
+        """Generate a header of level 1 to 7, optionally containing styled text."""
+        level = "#" * self.random.randint(1, 7)
+        if self.random.random() < 0.3:
+            return f"{level} {self.styled()}"
+        return f"{level} {self.words()}"
+
+    def emphasis(self) -> str:
+        """Generate a paragraph of styled or underlined lines."""
+        lines = []
+        for _ in range(self.random.randint(1, 3)):
+            if self.random.random() < 0.2:
+                lines.append(f"_{self.words()}_")
+            else:
+                lines.append(self.styled())
+        return "\n".join(lines)
+
+    def url(self) -> str:
+        """Generate a URL."""
+        path = "/".join(
+            self.random.choice(WORDS) for _ in range(self.random.randint(1, 3))
+        )
+        return f"https://www.example.com/{path}"
+
+    def link(self) -> str:
+        """Generate a line ending with a hyperlink."""
+        return f"{self.words()} [{self.words(1, 4)}]({self.url()})."
+
+    def image(self) -> str:
+        """Generate a line containing an image."""
+        return f"{self.words()} ![{self.words(1, 4)}]({self.url()}.png) {self.words()}."
+
+    def blockquote(self) -> str:
+        """Generate a blockquote spanning one or more lines."""
+        lines = []
+        for _ in range(self.random.randint(1, 5)):
+            if self.random.random() < 0.3:
+                lines.append(f"> {self.styled()}")
+            else:
+                lines.append(f"> {self.sentence()}")
+        return "\n".join(lines)
+
+    def list_items(self, marker: str) -> str:
+        """Generate the items of a list using the given marker."""
+        items = []
+        for _ in range(self.random.randint(1, 6)):
+            choice = self.random.random()
+            if choice < 0.2:
+                items.append(f"{marker} {self.styled()}")
+            elif choice < 0.3:
+                items.append(f"{marker} {self.link()}")
+            else:
+                items.append(f"{marker} {self.sentence()}")
+        return "\n".join(items)
+
+    def unordered_list(self) -> str:
+        """Generate an unordered list."""
+        return self.list_items("-")
+
+    def ordered_list(self) -> str:
+        """Generate an ordered list."""
+        return self.list_items("+")
+
+
+def pathological_line(name: str, size: int) -> str:
+    """
+    Generate a single line of adversarial markdown by repeating one of the
+    `PATHOLOGICAL` units.
+
+    :param name: The name of the pathological unit to repeat.
+    :param size: The minimum amount of characters to generate.
+    :returns: The line, ending with a new line.
+    :raises: A `ValueError` if the name is not one of the `PATHOLOGICAL` units.
+    """
+    if name not in PATHOLOGICAL:
+        raise ValueError(f"Unknown pathological input: {name}")
+    unit = PATHOLOGICAL[name]
+    return f"{unit * -(-size // len(unit))}\n"
+
+
+def write_document(output: TextIO, mix: str, size: int, seed: int = 0) -> int:
+    """
+    Write a document of at least `size` characters to the given file.
+
+    :param output: The file to write to.
+    :param mix: The name or weights of a feature mix, as accepted by `parse_mix`, or
+        the name of a pathological input, for which the seed is ignored.
+    :param size: The minimum amount of characters to write.
+    :param seed: The seed of the random number generator.
+    :returns: The amount of characters written.
+    :raises: A `ValueError` if the mix could not be parsed.
+    """
+    if mix in PATHOLOGICAL:
+        return output.write(pathological_line(mix, size))
+    return CorpusGenerator(parse_mix(mix), seed).write(output, size)
+
+
+def parse_size(size: str) -> int:
+    """
+    Convert a human readable size, such as `512`, `10K`, `1MB` or `1G`, to bytes.
+
+    :param size: The size to convert, using powers of 1024.
+    :returns: The size in bytes.
+    :raises: A `ValueError` if the size could not be parsed.
+    """
+    size = size.strip().upper()
+    if size.endswith("B"):
+        size = size[:-1]
+    unit = size[-1:] if size[-1:] in SIZE_UNITS else ""
+    number = size[: len(size) - len(unit)]
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: {size}")
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """
+    Convert the name of a predefined feature mix, or a list of weights such as
+    `header=1,link=2`, to a feature mix.
+
+    :param mix: The name or weights of the feature mix.
+    :returns: The relative weight of each feature.
+    :raises: A `ValueError` if the mix could not be parsed.
+    """
+    if mix in MIXES:
+        return MIXES[mix]
+    try:
+        return {
+            feature.strip(): int(weight)
+            for feature, weight in (part.split("=") for part in mix.split(","))
+        }
+    except ValueError:
+        raise ValueError(f"Invalid feature mix: {mix}")
+
+
+def show_help_message():
+    """Display a help message and exit the program."""
+    print(
+        f"""
+Generates a synthetic markdown document to benchmark the markdown parser with. The same
+size, feature mix and seed always produce the same document.
+
+usage: python markdown_corpus.py <size> [--help] [--mix <feature mix>] [--seed <seed>]
+                                        [--output <path/to/file>]
+
+<size>: The minimum size of the document, e.g. 1K, 10MB or 1G. Must be the first argument.
+
+--help: Display this help message and exit.
+--mix: The name of a feature mix ({", ".join(MIXES)}), or the relative
+       weight of each feature, e.g. header=1,emphasis=2. Defaults to `mixed`.
+       Features: paragraph, header, emphasis, link, image, blockquote, unordered_list,
+       ordered_list.
+       The name of a pathological input ({", ".join(PATHOLOGICAL)})
+       generates a single adversarial line instead, ignoring the seed.
+--seed: The seed of the random number generator. Defaults to 0.
+--output: The file to write the document to. Defaults to standard out.
+
+Example usage:
+python markdown_corpus.py 10MB --mix inline --seed 42 --output corpus.md
+
+Exit Codes:
+0 - OK
+1 - Erroneous input"""
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    flags = {
+        "help": "--help" in sys.argv,
+        "mix": "--mix" in sys.argv,
+        "seed": "--seed" in sys.argv,
+        "output": "--output" in sys.argv,
+    }
+
+    if flags["help"] or len(sys.argv) < 2:
+        show_help_message()
+
+    try:
+        size = parse_size(sys.argv[1])
+        mix = sys.argv[sys.argv.index("--mix") + 1] if flags["mix"] else "mixed"
+        seed = int(sys.argv[sys.argv.index("--seed") + 1]) if flags["seed"] else 0
+        output = sys.argv[sys.argv.index("--output") + 1] if flags["output"] else None
+        if output:
+            with open(output, "w") as file:
+                write_document(file, mix, size, seed)
+        else:
+            write_document(sys.stdout, mix, size, seed)
+    except (IndexError, ValueError) as e:
+        print(f"Invalid arguments: {e}")
+        sys.exit(1)
@@ -0,0 +1,90 @@
+import io
+
+import markdown_corpus as corpus
+import markdown_parser as md
+import pytest
+
+
+def generate(mix=None, seed=0, size=4096):
+    output = io.StringIO()
+    corpus.CorpusGenerator(mix, seed).write(output, size)
+    return output.getvalue()
+
+
+def test_that_the_same_seed_generates_the_same_document():
+    assert generate(seed=7) == generate(seed=7)
+    assert generate(seed=7) != generate(seed=8)
+
+
+@pytest.mark.parametrize("size", [1, 100, 10_000])
+def test_that_the_document_is_at_least_the_requested_size(size):
+    output = io.StringIO()
+    written = corpus.CorpusGenerator().write(output, size)
+    assert written == len(output.getvalue())
+    assert size <= written < size + 1024
+
+
+def test_that_the_plain_mix_contains_only_paragraphs():
+    document = generate(corpus.MIXES["plain"])
+    assert not set(document) & set("-+#*_![]()>")
+
+
+def test_that_a_custom_mix_only_generates_the_given_features():
+    document = generate({"header": 1})
+    assert all(block.startswith("#") for block in document.split("\n\n") if block)
+
+
+@pytest.mark.parametrize("mix", [{"table": 1}, {"header": 0}])
+def test_that_an_invalid_mix_raises_an_error(mix):
+    with pytest.raises(ValueError):
+        corpus.CorpusGenerator(mix)
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ("512", 512),
+        ("10K", 10240),
+        ("1MB", 1024**2),
+        ("1.5k", 1536),
+        ("2G", 2 * 1024**3),
+    ],
+)
+def test_that_sizes_are_parsed(size, expected):
+    assert corpus.parse_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["", "MB", "ten"])
+def test_that_parsing_an_invalid_size_raises_an_error(size):
+    with pytest.raises(ValueError):
+        corpus.parse_size(size)
+
+
+def test_that_mixes_are_parsed():
+    assert corpus.parse_mix("inline") == corpus.MIXES["inline"]
+    assert corpus.parse_mix("header=1, link=2") == {"header": 1, "link": 2}
+    with pytest.raises(ValueError):
+        corpus.parse_mix("header")
+
+
+@pytest.mark.parametrize("mix", list(corpus.MIXES))
+def test_that_every_mix_can_be_parsed(mix, capsys):
+    parser = md.MarkdownParser(generate(corpus.MIXES[mix]), string=True, stdout=True)
+    assert capsys.readouterr().out.strip() == parser.raw_html.strip()
+    assert parser.raw_html.startswith(md.HTML_HEADER)
+
+
+@pytest.mark.parametrize("name", list(corpus.PATHOLOGICAL))
+def test_that_a_pathological_input_is_a_single_line(name):
+    line = corpus.pathological_line(name, 1000)
+    assert 1000 <= len(line) - 1 < 1000 + len(corpus.PATHOLOGICAL[name])
+    assert line.count("\n") == 1 and line.endswith("\n")
+
+
+def test_that_write_document_accepts_mixes_and_pathological_inputs():
+    output = io.StringIO()
+    assert corpus.write_document(output, "list-bomb", 10) == len(output.getvalue())
+    assert output.getvalue() == "- a - a - a \n"
+    assert corpus.write_document(io.StringIO(), "header=1", 10) >= 10
+    with pytest.raises(ValueError):
+        corpus.pathological_line("unknown", 10)
@@ -1,9 +1,29 @@
+import codecs
+import io
+import os
 import re
 import sys
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
 from os import path, remove
-from typing import Union
-
-from bs4 import BeautifulSoup
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+HTML_HEADER = '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<meta name="author" content="Marios Yiannakou">\n<meta name="description" content="This is a markdown parser to HTML created for my COMP30040 module at the University of Manchester.">\n</head>\n<body>\n'
+HTML_FOOTER = "\n</body>\n</html>\n"
+# Runs of the characters which the parser treats as markdown.
+SPECIAL_CHARACTERS = re.compile(r"[^a-zA-Z0-9 '\"./\\@$%&=;:<,?{}|~]+")
+LINK = re.compile(r"\[.*?\]\(.*?\)")
+IMAGE = re.compile(r"\!\[.*?\]\(.*?\)")
+NON_WHITESPACE = re.compile(r"\S")
+# The maximum amount of bytes read at a time from standard in.
+STREAM_CHUNK_SIZE = 64 * 1024
+# The file extension of the HTML output in each compression format.
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zlib": ".zz", "zstd": ".zst"}
+# The range of zstd levels, where negative levels are faster and compress less.
+ZSTD_LEVELS = range(-(1 << 17), 23)
+# The amount of bytes of HTML gathered before compressing them.
+COMPRESSION_BUFFER_SIZE = 1024 * 1024
 
 
 class MarkdownParser:
@@ -27,6 +47,11 @@ class MarkdownParser:
     unordered_list_item = False
     # Boolean flag to denote if this is the start of an ordered list.
     ordered_list_item = False
+    # Counts and times the work done by the parser, if enabled.
+    stats = None
+    # The format and level to compress the HTML output with, if any.
+    compression = None
+    compression_level = None
 
     def __init__(
         self,
@@ -34,18 +59,40 @@ class MarkdownParser:
         string: bool = False,
         prettify: bool = False,
         stdout: bool = False,
+        workers: int = 1,
+        stats: bool = False,
+        cache: "RenderCache" = None,
+        compression: str = None,
+        compression_level: int = None,
     ):
         """
         Parse a markdown document or string into its HTML equivalent.
 
         :param content: The path of the file, or a string, to be parsed. Works in
-            conjunction with the `string` boolean flag.
+            conjunction with the `string` boolean flag. A filename of `-` reads the
+            file from standard in.
         :param string: Boolean flag to specify whether a user has passed a filename
             or a string.
         :param prettify: Boolean flag to specify whether the HTML output should be
-            formatted using BeautifulSoup.
+            formatted with one element or text per line, indented by nesting level.
         :param stdout: Boolean flag to specify whether the HTML output should be
             displayed to standard out instead of being written to a file.
+        :param workers: The number of worker processes used to parse the content. When
+            greater than 1, the content is split into blocks at blank lines which are
+            parsed in parallel, producing the same HTML as a sequential parse.
+        :param stats: Boolean flag to specify whether to count and time the work done
+            by the parser, per markdown construct, in `self.stats`. Parsers without it
+            are not instrumented at all.
+        :param cache: The render cache to take the HTML from, if the same content has
+            been parsed with the same flags before, instead of parsing it. Content read
+            from standard in is never cached.
+        :param compression: The format to compress the HTML output with while it is
+            written, one of `COMPRESSION_EXTENSIONS`. The output file is named
+            `parsed.html` followed by the extension of the format.
+        :param compression_level: The compression level, where higher levels are
+            smaller but slower. Defaults to the default level of the format.
+        :raises: A `ValueError` if the compression format is unknown or not available,
+            or its level is invalid.
         :raises: A `ValueError` if no filename and no content has been provided to parse.
         :raises: A `FileNotFoundError` if the filename provided does not exist.
         """
@@ -56,7 +103,7 @@ class MarkdownParser:
             print("No markdown string was provided.")
             sys.exit(1)
 
-        if not string:
+        if not string and content != "-":
             if not path.exists(content):
                 print("The file provided was not found.")
                 sys.exit(1)
@@ -65,11 +112,170 @@ class MarkdownParser:
         self.unordered_list_item = False
         self.ordered_list_item = False
         self.html_elements = []
-        self.raw_html = f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<meta name="author" content="Marios Yiannakou">\n<meta name="description" content="This is a markdown parser to HTML created for my COMP30040 module at the University of Manchester.">\n</head>\n<body>\n'
-        self._read_file(content, string, prettify, stdout)
+        self.raw_html = HTML_HEADER
+        if compression is not None:
+            # Fail before parsing if the format, or its level, cannot be used.
+            make_compressor(compression, compression_level)
+        self.compression = compression
+        self.compression_level = compression_level
+        if stats:
+            self.stats = ParserStats()
+            self.stats.instrument(self)
+        self._read_file(content, string, prettify, stdout, workers, cache)
+
+    @classmethod
+    def _block_parser(cls, html_elements: List[str] = None) -> "MarkdownParser":
+        """
+        Create a parser with no HTML boilerplate, used to parse a single block of a
+        larger document.
+
+        :param html_elements: The HTML elements left open by the blocks preceding this
+            one, if any.
+        :returns: A parser whose `raw_html` will only contain the parsed block.
+        """
+        parser = cls.__new__(cls)
+        parser.html_elements = list(html_elements or [])
+        parser.raw_html = ""
+        # The block always starts after a blank line, which closes the latest element.
+        if parser.html_elements:
+            parser.previous_line = ""
+        return parser
+
+    @classmethod
+    def stream(
+        cls, encoding: str = "utf-8", prettify: bool = False
+    ) -> "MarkdownParser":
+        """
+        Create a parser which is given its content a chunk at a time through `feed`,
+        followed by a call to `close`. The content is parsed like a file.
+
+        :param encoding: The encoding used to decode chunks given as bytes.
+        :param prettify: Boolean flag to specify whether the HTML output should be
+            formatted while it is being parsed.
+        :returns: A parser ready to be fed.
+        """
+        parser = cls._block_parser()
+        parser.raw_html = HTML_HEADER
+        parser._start_stream(encoding, prettify)
+        return parser
+
+    def _start_stream(self, encoding: str = "utf-8", prettify: bool = False) -> None:
+        """
+        Prepare the parser to be given its content through `feed`.
+
+        :param encoding: The encoding used to decode chunks given as bytes.
+        :param prettify: Boolean flag to specify whether the HTML output should be
+            formatted while it is being parsed.
+        """
+        self._prettifier = HtmlPrettifier() if prettify else None
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        # Translate line endings the same way as a file opened in read mode.
+        self._newline_decoder = io.IncrementalNewlineDecoder(None, translate=True)
+        self._partial_line = []
+
+    def feed(self, chunk: Union[bytes, str]) -> str:
+        """
+        Parse the next chunk of the content. A chunk may end anywhere, including in the
+        middle of a line or of a multibyte character, in which case the rest of it is
+        parsed once it has been fed.
+
+        :param chunk: The next part of the content, as bytes or a string.
+        :returns: The HTML completed by this chunk, which may be empty. The HTML
+            returned by every call to `feed` and `close` forms the whole document.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        self._parse_stream(self._newline_decoder.decode(chunk))
+        return self._take_html()
+
+    def close(self) -> str:
+        """
+        Parse the remainder of the content given to `feed` and finish the document.
+
+        :returns: The rest of the HTML document.
+        """
+        chunk = self._decoder.decode(b"", final=True)
+        self._parse_stream(self._newline_decoder.decode(chunk, final=True), True)
+        self.raw_html += HTML_FOOTER
+        html = self._take_html()
+        if self._prettifier:
+            html += self._prettifier.close()
+        return html
+
+    def _parse_stream(self, text: str, final: bool = False) -> None:
+        """
+        Parse every complete line of the streamed content.
+
+        :param text: The decoded text following the content already streamed.
+        :param final: Boolean flag to specify whether this is the end of the content,
+            in which case the last line is parsed even without a line ending.
+        """
+        lines = text.split("\n")
+        if len(lines) > 1:
+            lines[0] = "".join(self._partial_line) + lines[0]
+            self._partial_line = []
+            for line in lines[:-1]:
+                self.parse_content(f"{line}\n")
+        if lines[-1]:
+            self._partial_line.append(lines[-1])
+        if final and self._partial_line:
+            self.parse_content("".join(self._partial_line))
+            self._partial_line = []
+
+    def _take_html(self) -> str:
+        """
+        Take the HTML parsed so far out of the parser.
+
+        :returns: The HTML parsed since the last call.
+        """
+        html = self.raw_html
+        self.raw_html = ""
+        if self._prettifier:
+            return self._prettifier.feed(html)
+        return html
+
+    def _write_stream(
+        self, stream: IO[bytes], stdout: bool, encoding: str, prettify: bool = False
+    ) -> None:
+        """
+        Parse the given binary stream a chunk at a time, writing out the HTML as soon
+        as each line has been parsed.
+
+        :param stream: The stream to read the markdown content from.
+        :param stdout: Boolean flag to specify whether the HTML output should be
+            displayed to standard out instead of being written to a file.
+        :param encoding: The encoding of the stream.
+        :param prettify: Boolean flag to specify whether the HTML output should be
+            formatted while it is being parsed.
+        """
+        self._start_stream(encoding, prettify)
+        if stdout and not self.compression:
+            output = sys.stdout
+        else:
+            output = open_output(
+                "-" if stdout else self._output_filename(),
+                self.compression,
+                self.compression_level,
+            )
+        try:
+            for chunk in iter(lambda: stream.read1(STREAM_CHUNK_SIZE), b""):
+                output.write(self.feed(chunk))
+            output.write(self.close())
+            if stdout:
+                # Match the output of `print` when not streaming.
+                output.write("\n")
+        finally:
+            if output is not sys.stdout:
+                output.close()
 
     def _read_file(
-        self, filename: str, string: bool, prettify: bool = False, stdout: bool = False
+        self,
+        filename: str,
+        string: bool,
+        prettify: bool = False,
+        stdout: bool = False,
+        workers: int = 1,
+        cache: "RenderCache" = None,
     ) -> None:
         """
         Open the given file in read mode and parse each line.
@@ -79,27 +285,83 @@ class MarkdownParser:
         :param string: Boolean flag to specify whether a user has passed a string to be
             parsed, or a filename.
         :param prettify: Boolean flag to specify whether the HTML output should be
-            formatted using BeautifulSoup.
+            formatted with one element or text per line, indented by nesting level.
         :param stdout: Boolean flag to specify whether the HTML output should be
             displayed to standard out instead of being written to a file.
+        :param workers: The number of worker processes used to parse the content.
+        :param cache: The render cache to take the HTML from, or store it in.
         """
-        if not string:
-            with open(filename, "r") as file:
-                for line in file.readlines():
-                    self.parse_content(line)
+        if not string and filename == "-":
+            cache = None
+            if workers == 1:
+                self._write_stream(
+                    sys.stdin.buffer, stdout, sys.stdin.encoding, prettify
+                )
+                return
+
+        if cache is not None:
+            key = cache.key(filename, string, prettify)
+            html = cache.get(key)
+            if html is not None:
+                self.raw_html = html
+                if stdout or self.compression or not cache.link(key, "parsed.html"):
+                    self._write_output(False, stdout)
+                return
+
+        if workers > 1:
+            if not string and can_map(filename):
+                # Workers read their own blocks from the file.
+                blocks = map_blocks(filename, BLOCK_SIZE)
+            elif not string:
+                with open_input(filename) as file:
+                    blocks = list(split_blocks(file, BLOCK_SIZE, string))
+            else:
+                lines = io.StringIO(filename, newline="\n")
+                blocks = list(split_blocks(lines, BLOCK_SIZE, string))
+            self._parse_blocks(blocks, string, workers)
+        elif not string:
+            for line in read_lines(filename):
+                self.parse_content(line)
         else:
             self.parse_content(filename)
 
-        self.raw_html += f"\n</body>\n</html>\n"
-        parsed_content_filename = "parsed.html"
+        self.raw_html += HTML_FOOTER
+        self._write_output(prettify, stdout)
+        if cache is not None:
+            cache.put(key, self.raw_html)
+
+    def _output_filename(self) -> str:
+        """
+        :returns: The name of the file to write the HTML output to.
+        """
+        return f"parsed.html{COMPRESSION_EXTENSIONS.get(self.compression, '')}"
+
+    def _write_output(self, prettify: bool = False, stdout: bool = False) -> None:
+        """
+        Write the parsed HTML to `parsed.html`, or to standard out, compressing it if
+        a compression format was given.
+
+        :param prettify: Boolean flag to specify whether the HTML output should be
+            formatted with one element or text per line, indented by nesting level.
+        :param stdout: Boolean flag to specify whether the HTML output should be
+            displayed to standard out instead of being written to a file.
+        """
+        parsed_content_filename = self._output_filename()
         try:
             if prettify:
-                self.raw_html = BeautifulSoup(self.raw_html, "html.parser").prettify()
+                prettifier = HtmlPrettifier()
+                self.raw_html = prettifier.feed(self.raw_html) + prettifier.close()
 
-            if stdout:
+            if stdout and not self.compression:
                 print(self.raw_html)
+            elif stdout:
+                with open_output("-", self.compression, self.compression_level) as file:
+                    # Match the output of `print` when not compressing.
+                    file.write(f"{self.raw_html}\n")
             else:
-                with open(parsed_content_filename, "w") as file:
+                with open_output(
+                    parsed_content_filename, self.compression, self.compression_level
+                ) as file:
                     file.write(self.raw_html)
         except Exception as e:
             print(
@@ -109,11 +371,56 @@ class MarkdownParser:
             if path.exists(parsed_content_filename):
                 remove(parsed_content_filename)
 
-    def parse_content(self, content: str) -> None:
+    def _parse_blocks(
+        self,
+        blocks: List[Union[List[str], Tuple[str, int, int]]],
+        string: bool,
+        workers: int,
+    ) -> None:
+        """
+        Parse the given blocks in `workers` processes.
+
+        Blocks are parsed as if nothing preceded them. A blank line resets every flag
+        but only closes the latest open HTML element, so the result of a block is kept
+        only if at most one element was left open before it. Otherwise the block is
+        parsed again here, starting from the elements left open.
+
+        :param blocks: The blocks of the content to be parsed, as returned by
+            `split_blocks` or `map_blocks`.
+        :param string: Boolean flag to specify whether the blocks come from a string,
+            which is parsed as a whole, or a file, which is parsed line by line.
+        :param workers: The number of worker processes to use.
+        """
+        # Imported here as starting up the parser for a single process should not pay
+        # for the cost of importing multiprocessing.
+        from multiprocessing import Pool
+
+        html = []
+        with Pool(workers) as pool:
+            parsed_blocks = pool.imap(_parse_block, ((b, string) for b in blocks))
+            for block, parsed_block in zip(blocks, parsed_blocks):
+                block_html, html_elements, has_content = parsed_block
+                if has_content and len(self.html_elements) > 1:
+                    block_html, html_elements, _ = _parse_block(
+                        (block, string), self.html_elements
+                    )
+                    self.html_elements = []
+                elif has_content and self.html_elements:
+                    html.append(f"\n</{self.html_elements.pop()}>\n")
+                html.append(block_html)
+                self.html_elements.extend(html_elements)
+
+        self.raw_html += "".join(html)
+        while self.html_elements:
+            self.raw_html += f"\n</{self.html_elements.pop()}>"
+
+    def parse_content(self, content: str, close_elements: bool = True) -> None:
         """
         Reads and parses the provided content into HTML.
 
         :param content: A string to be parsed with markdown rules.
+        :param close_elements: Boolean flag to specify whether the HTML elements still
+            open at the end of the content should be closed.
         :returns: The parsed content as HTML.
         """
         # TODO: regex *[a-zA-Z0-9]*\n, remove only last \n
@@ -154,37 +461,91 @@ class MarkdownParser:
 
             self.previous_line = line
 
-        while self.html_elements:
+        while close_elements and self.html_elements:
             self.raw_html += f"\n</{self.html_elements.pop()}>"
 
-    def parse_special_characters(self, line: str, matched_regex: re.Match) -> None:
+    def parse_special_characters(
+        self, line: str, matched_regex: List[re.Match]
+    ) -> None:
         """
         Parse the given line with special characters into HTML.
 
+        The constructs of the line are parsed from left to right using offsets into
+        `line`, instead of parsing the rest of the line again after each one, so that
+        the time taken is linear in the length of the line.
+
         :param line: The line to be parsed.
-        :param matched_regex: The regex that was matched.
+        :param matched_regex: The special characters found in `line`, in order.
         """
-        if len(matched_regex) == 0:
-            return
+        html = []
+        closing_tags = []
+        matches = iter(matched_regex)
+        regex = next(matches, None)
+        # The offset of `line` from which the current construct is parsed.
+        start = 0
+        while regex:
+            parsed_construct = self.parse_construct(line, start, regex, matches, html)
+            if not parsed_construct:
+                self.raw_html += "".join(html)
+                html = []
+                self.append_invalid_regex(line[start:])
+                break
+
+            regex, matches, closing_tag = parsed_construct
+            # Some constructs finish before the actual line does thus, `closing_tag`
+            # might be `None` e.g. # This line is an h1 header with ***bold and italic
+            # text*** and more normal text. </i></b> closes before the end of the line.
+            if closing_tag:
+                closing_tags.append(closing_tag)
+            if regex:
+                start = regex.span()[0]
 
+        # The constructs are nested in the ones before them, so close the latest first.
+        closing_tags.reverse()
+        self.raw_html += "".join(html) + "".join(closing_tags)
+
+    def parse_construct(
+        self,
+        line: str,
+        start: int,
+        regex: re.Match,
+        matches: Iterator[re.Match],
+        html: List[str],
+    ) -> Union[
+        Tuple[Union[re.Match, None], Iterator[re.Match], Union[str, None]], None
+    ]:
+        """
+        Parse the construct of the given line starting at `start` into HTML, along with
+        the text up to the next construct.
+
+        :param line: The line being parsed.
+        :param start: The offset of `line` from which the construct is parsed.
+        :param regex: The special characters of the construct.
+        :param matches: The special characters following those of the construct.
+        :param html: The list to append the parsed HTML to.
+        :returns: The special characters of the next construct, or `None` if there
+            are no more, the special characters following them, and the tag closing
+            the construct once the ones nested in it have been parsed. `None` if the
+            construct is invalid, in which case the rest of the line is plain text.
+        """
         closing_tag = None
-        regex = matched_regex.pop(0)
         # Starting and ending (non-inclusive) index of special characters in `line`
         span_start, span_end = regex.span()
-        special_chars = regex.string[span_start:span_end]
+        special_chars = regex.group()
         special_chars_length = len(special_chars)
+        next_regex = next(matches, None)
 
-        if line[:span_start].strip() != "":
-            self.raw_html += f"<p>\n{line[:span_start]}"
+        if line[start:span_start].strip() != "":
+            html.append(f"<p>\n{line[start:span_start]}")
             self.html_elements.append("p")
 
         if (
             special_chars[0] == "#"
-            and line[0] == "#"
-            and line[special_chars_length:][0] == " "
+            and line[start] == "#"
+            and line[span_end : span_end + 1] == " "
         ):
             tag = "<h6>" if special_chars_length >= 6 else f"<h{special_chars_length}>"
-            self.raw_html += tag
+            html.append(tag)
             closing_tag = (
                 "</h6>\n"
                 if special_chars_length >= 6
@@ -192,142 +553,93 @@ class MarkdownParser:
             )
 
         elif special_chars[0] == "*":
-            # Pop the matched regex again as patterns that require opening and closing
+            # Take the next matched regex as patterns that require opening and closing
             # patterns produce two matching elements, and are displayed twice
             # e.g. Bold --> **text to make bold** (requires '**' at the start and ending)
             # If there is no matching regex at the end, treat as normal text and print it.
-            if len(matched_regex):
-                regex = self.validate_regex(regex, matched_regex.pop(0))
-                if not regex:
-                    self.append_invalid_regex(line)
-                    return
-            else:
-                self.append_invalid_regex(line)
-                return
+            if not next_regex:
+                return None
+            regex = self.validate_regex(regex, next_regex)
+            if not regex:
+                return None
+            next_regex = next(matches, None)
 
             # Don't add a new line at the end as these could be inline.
             content = line[span_end : regex.span()[0]].strip()
             if special_chars_length == 1:
-                self.raw_html += f"<i>{content}</i>"
+                html.append(f"<i>{content}</i>")
             elif special_chars_length == 2:
-                self.raw_html += f"<b>{content}</b>"
+                html.append(f"<b>{content}</b>")
             elif special_chars_length == 3:
-                self.raw_html += f"<b><i>{content}</i></b>"
+                html.append(f"<b><i>{content}</i></b>")
             else:
-                self.append_invalid_regex(line)
-                return
+                return None
         elif special_chars[0] == "_":
-            if special_chars_length > 1 or len(matched_regex) == 0:
-                self.append_invalid_regex(line)
-                return
-            else:
-                regex = self.validate_regex(regex, matched_regex.pop(0))
-                if not regex:
-                    self.append_invalid_regex(line)
-                    return
+            if special_chars_length > 1 or not next_regex:
+                return None
+            regex = self.validate_regex(regex, next_regex)
+            if not regex:
+                return None
+            next_regex = next(matches, None)
 
             content = line[span_end : regex.span()[0]].strip()
-            self.raw_html += f'<p style="text-decoration: underline;">{content}</p>'
-
-        elif special_chars[0] == "!":
-            regex = [
-                match
-                for match in re.finditer(r"\!\[.*?\]\(.*?\)", line)
-                if match.group()
-            ]
-            if regex:
-                alt_text, src = regex[0].group().split("](")
-                alt_text = alt_text[2:]
-                src = src[:-1]
-                self.raw_html += f'<img src="{src}" alt="{alt_text}"/>'
-
-                line = line[regex[0].span()[1] :]
-                # Since URLs have some of the special characters that the markdown
-                # parser understands, it's required that after parsing the URL, the
-                # link is removed from the line and the `matched_regex` list is
-                # redefined here.
-                matched_regex = self.get_special_characters(line)
-                regex = None
+            html.append(f'<p style="text-decoration: underline;">{content}</p>')
+
+        elif special_chars[0] in "![":
+            image = special_chars[0] == "!"
+            link = self.find_link(line, start, image)
+            if not link:
+                return None
+
+            text, src = link.group().split("](", 1)
+            text = text[2:] if image else text[1:]
+            src = src[:-1]
+            if image:
+                html.append(f'<img src="{src}" alt="{text}"/>')
             else:
-                self.append_invalid_regex(line)
-                return
-
-        elif special_chars[0] == "[":
-            regex = [
-                match for match in re.finditer(r"\[.*?\]\(.*?\)", line) if match.group()
-            ]
-            if regex:
-                text, src = regex[0].group().split("](")
-                text = text[1:]
-                src = src[:-1]
-                self.raw_html += f'<a href="{src}">{text}</a>'
-
-                line = line[regex[0].span()[1] :]
-                # Since URLs have some of the special characters that the markdown
-                # parser understands, it's required that after parsing the URL, the
-                # link is removed from the line and the `matched_regex` list is
-                # redefined here.
-                matched_regex = self.get_special_characters(line)
-                regex = None
+                html.append(f'<a href="{src}">{text}</a>')
+
+            # Since URLs have some of the special characters that the markdown parser
+            # understands, the special characters are found again after the link.
+            start = link.span()[1]
+            matches = SPECIAL_CHARACTERS.finditer(line, start)
+            next_regex = next(matches, None)
+            regex = None
+
+        elif special_chars[0] in ">-+" and NON_WHITESPACE.search(line, start + 1):
+            if special_chars[0] == ">":
+                if not self.blockquote_item:
+                    self.blockquote_item = True
+                    html.append(f"<blockquote>\n")
+                    self.html_elements.append("blockquote")
+
+                html.append(f"<p>")
+                closing_tag = "</p>\n"
             else:
-                self.append_invalid_regex(line)
-                return
-
-        elif special_chars[0] == ">" and len(line) > 1 and line[1:].strip() != "":
-            if not self.blockquote_item:
-                self.blockquote_item = True
-                self.raw_html += f"<blockquote>\n"
-                self.html_elements.append("blockquote")
-
-            self.raw_html += f"<p>"
-            closing_tag = "</p>\n"
-
-        elif special_chars[0] == "-" and len(line) > 1 and line[1:].strip() != "":
-            if not self.unordered_list_item:
-                self.unordered_list_item = True
-                self.raw_html += f"<ul>\n"
-                self.html_elements.append("ul")
-
-            self.raw_html += f"<li>"
-            closing_tag = "</li>\n"
-
-        elif special_chars[0] == "+" and len(line) > 1 and line[1:].strip() != "":
-            if not self.ordered_list_item:
-                self.ordered_list_item = True
-                self.raw_html += f"<ol>\n"
-                self.html_elements.append("ol")
-
-            self.raw_html += f"<li>"
-            closing_tag = "</li>\n"
+                element = "ul" if special_chars[0] == "-" else "ol"
+                if element == "ul" and not self.unordered_list_item:
+                    self.unordered_list_item = True
+                    html.append(f"<ul>\n")
+                    self.html_elements.append("ul")
+                elif element == "ol" and not self.ordered_list_item:
+                    self.ordered_list_item = True
+                    html.append(f"<ol>\n")
+                    self.html_elements.append("ol")
+
+                html.append(f"<li>")
+                closing_tag = "</li>\n"
 
         else:
-            self.append_invalid_regex(line)
-            return
+            return None
 
-        # Send the substring that contains more markdown content to be parsed again
-        # e.g. # An h1 header with **bold text**
-        if len(matched_regex):
-            next_regex_start, _ = matched_regex[0].span()
-            # Use `regex.span()[1]` instead of `span_end` as `regex` could have been
-            # updated in the case of an emphasis styling pattern. This does not update
-            # `span_start` or `span_end`.
-            self.raw_html += line[regex.span()[1] : next_regex_start]
-            self.parse_special_characters(
-                line[next_regex_start:],
-                self.get_special_characters(line[next_regex_start:]),
-            )
-            matched_regex = []
-        elif regex:
-            self.raw_html += line[regex.span()[1] :]
+        # Use `regex.span()[1]` instead of `span_end` as `regex` could have been updated
+        # in the case of an emphasis styling pattern, or be `None` after a link.
+        text_start = regex.span()[1] if regex else start
+        if next_regex:
+            html.append(line[text_start : next_regex.span()[0]])
         else:
-            self.raw_html += line
-
-        # Some regexes might finish before the actual line does thus,
-        # `closing_tag` might be `None`
-        # e.g. # This line is an h1 header with ***bold and italic text*** and more normal text
-        #      </i></b> closes before the end of the line so `closing_tag` is `None`.
-        if closing_tag:
-            self.raw_html += f"{closing_tag}"
+            html.append(line[text_start:])
+        return next_regex, matches, closing_tag
 
     def validate_regex(
         self, current_regex: re.Match, popped_regex: re.Match
@@ -372,6 +684,33 @@ class MarkdownParser:
         else:
             self.raw_html += f"\n{line}"
 
+    def find_link(
+        self, line: str, start: int = 0, image: bool = False
+    ) -> Union[re.Match, None]:
+        """
+        Find the first hyperlink, or image, in the provided line.
+
+        e.g. [link text](https://www.example.com)
+             ![alt text](https://www.example.com/image.png)
+
+        The link is only matched with a regex once it is known to exist, as searching
+        a line full of `[` without one would try every `[` up to the end of the line.
+
+        :param line: The line to search.
+        :param start: The offset of `line` to start searching from.
+        :param image: Boolean flag to specify whether to search for an image instead of
+            a hyperlink.
+        :returns: The first match in `line`, or `None` if there is none.
+        """
+        opening = "![" if image else "["
+        link_start = line.find(opening, start)
+        if link_start == -1:
+            return None
+        text_end = line.find("](", link_start + len(opening))
+        if text_end == -1 or line.find(")", text_end + 2) == -1:
+            return None
+        return (IMAGE if image else LINK).match(line, link_start)
+
     def get_special_characters(self, string: str):
         """
         Uses a predefined regular expression to capture any special characters from the
@@ -381,8 +720,851 @@ class MarkdownParser:
         :returns: A list of `re.Match` elements representing all the matched special
             charaters found in `string`.
         """
-        pattern = r"[^a-zA-Z0-9 '\"./\\@$%&=;:<,?{}|~]*"
-        return [match for match in re.finditer(pattern, string) if match.group()]
+        return list(SPECIAL_CHARACTERS.finditer(string))
+
+
+class ParserStats:
+    """
+    Counts and times the work done by a `MarkdownParser`, per markdown construct, regex
+    scan and output phase. The time of each entry excludes that of the entries nested
+    in it, so that the times add up to the total time spent in the parser.
+
+    The parser is instrumented by wrapping its methods on the instance, which leaves
+    the methods of parsers without statistics untouched.
+    """
+
+    # The construct handled by `parse_special_characters`, by its first character.
+    CONSTRUCTS = {
+        "#": "header",
+        "*": "emphasis",
+        "_": "underline",
+        "!": "image",
+        "[": "link",
+        ">": "blockquote",
+        "-": "unordered list",
+        "+": "ordered list",
+    }
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.times: Dict[str, float] = {}
+        # The time spent in the entries nested in the one currently timed.
+        self._nested_time = 0.0
+
+    def instrument(self, parser: MarkdownParser) -> None:
+        """
+        Wrap the methods of the given parser to count and time every call.
+
+        :param parser: The parser to instrument.
+        """
+
+        def construct(line: str, start: int, regex: re.Match, *args) -> str:
+            return f"construct: {self.CONSTRUCTS.get(regex.group()[0], 'other')}"
+
+        entries = {
+            "parse_content": "parse: lines",
+            "_parse_blocks": "parse: parallel blocks",
+            "parse_special_characters": "parse: special characters",
+            "parse_construct": construct,
+            "validate_regex": "regex: emphasis pairing",
+            "find_link": "regex: links and images",
+            "get_special_characters": "regex: special characters",
+            "append_invalid_regex": "fallback: invalid markdown",
+            "_write_output": "output: write",
+            "_take_html": "output: stream",
+        }
+        for method, entry in entries.items():
+            setattr(parser, method, self._wrap(getattr(parser, method), entry))
+
+    def _wrap(
+        self, method: Callable, entry: Union[str, Callable[..., str]]
+    ) -> Callable:
+        """
+        Wrap the given method to count and time its calls under the given entry.
+
+        :param method: The bound method to wrap.
+        :param entry: The name of the entry, or a function returning it given the
+            arguments of the call.
+        :returns: The wrapped method.
+        """
+
+        def timed(*args, **kwargs):
+            name = entry(*args, **kwargs) if callable(entry) else entry
+            outer_nested_time = self._nested_time
+            self._nested_time = 0.0
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.times[name] = (
+                    self.times.get(name, 0.0) + elapsed - self._nested_time
+                )
+                self._nested_time = outer_nested_time + elapsed
+
+        return timed
+
+    def to_dict(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        :returns: The calls and the time in seconds of every entry, by name.
+        """
+        return {
+            name: {"calls": self.calls[name], "seconds": self.times[name]}
+            for name in sorted(self.calls)
+        }
+
+    def format_table(self) -> str:
+        """
+        :returns: A table of the calls, the time and the share of the total time of
+            every entry, slowest first.
+        """
+        total = sum(self.times.values())
+        rows = [f"{'entry':<32} {'calls':>10} {'time (ms)':>12} {'%':>7}"]
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            share = self.times[name] / total * 100 if total else 0.0
+            rows.append(
+                f"{name:<32} {self.calls[name]:>10} "
+                f"{self.times[name] * 1000:>12.3f} {share:>7.2f}"
+            )
+        rows.append(
+            f"{'total':<32} {sum(self.calls.values()):>10} {total * 1000:>12.3f}"
+        )
+        return "\n".join(rows)
+
+
+class HtmlPrettifier:
+    """
+    Formats HTML while it is being written, placing every tag and text on its own line
+    indented by one space per open element. Only the stack of open elements is kept in
+    memory.
+
+    For the tags `MarkdownParser` generates, the output is the same as that of
+    BeautifulSoup's `prettify` using the `html.parser` parser. Raw HTML copied from the
+    Markdown is formatted with the same rules, unlike BeautifulSoup, which keeps the
+    contents of `<pre>`, `<textarea>`, `<script>` and `<style>` elements as they are.
+    """
+
+    # Elements which have no closing tag.
+    VOID_ELEMENTS = {
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    }
+    # Captures a start tag, an end tag or a declaration such as `<!DOCTYPE html>`.
+    TAG_PATTERN = re.compile(
+        r"<(/?)([a-zA-Z][^\s/>]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>|<!([^>]*)>"
+    )
+    ATTRIBUTE_PATTERN = re.compile(
+        r"([^\s=/>\"']+)(?:\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+)))?"
+    )
+
+    def __init__(self):
+        # Stack to keep track of the HTML elements opened.
+        self.html_elements = []
+        # HTML which could be continued by the next call to `feed`.
+        self.pending = ""
+
+    def feed(self, raw_html: str) -> str:
+        """
+        Format the next part of an HTML document. Text or a tag at the end of the given
+        HTML is held back until it is known to be complete.
+
+        :param raw_html: The HTML following that of the previous calls.
+        :returns: The formatted HTML of every complete tag and text.
+        """
+        raw_html = self.pending + raw_html
+        output = []
+        position = 0
+        for match in self.TAG_PATTERN.finditer(raw_html):
+            self._write_text(raw_html[position : match.start()], output)
+            closing, tag, attributes, declaration = match.groups()
+            if declaration is not None:
+                self._write_text(f"<!{declaration}>", output, escape=False)
+            elif closing:
+                self._close_tag(tag.lower(), output)
+            else:
+                self._open_tag(tag.lower(), attributes, output)
+            position = match.end()
+        self.pending = raw_html[position:]
+        return "".join(output)
+
+    def close(self) -> str:
+        """
+        Format the rest of the HTML document, closing any elements left open.
+
+        :returns: The formatted HTML.
+        """
+        output = []
+        self._write_text(self.pending, output)
+        self.pending = ""
+        while self.html_elements:
+            tag = self.html_elements.pop()
+            output.append(f"{' ' * len(self.html_elements)}</{tag}>\n")
+        return "".join(output)
+
+    def _write_text(self, text: str, output: List[str], escape: bool = True) -> None:
+        """
+        Write the given text on its own line, unless it only contains whitespace.
+
+        :param text: The text found between two tags.
+        :param output: The list of formatted lines to append to.
+        :param escape: Boolean flag to specify whether special characters should be
+            replaced with HTML entities.
+        """
+        if escape:
+            text = escape_text(text)
+        text = text.strip()
+        if text:
+            output.append(f"{' ' * len(self.html_elements)}{text}\n")
+
+    def _open_tag(self, tag: str, attributes: str, output: List[str]) -> None:
+        """
+        Write the given start tag on its own line, with its attributes sorted by name.
+
+        :param tag: The name of the element.
+        :param attributes: The attributes of the start tag, as written in the HTML.
+        :param output: The list of formatted lines to append to.
+        """
+        values = {}
+        for match in self.ATTRIBUTE_PATTERN.finditer(attributes):
+            name, *value = match.groups()
+            value = next((v for v in value if v is not None), "")
+            values[name.lower()] = escape_text(value)
+
+        start_tag = tag
+        for name, value in sorted(values.items()):
+            if '"' not in value:
+                start_tag += f' {name}="{value}"'
+            elif "'" not in value:
+                start_tag += f" {name}='{value}'"
+            else:
+                start_tag += f' {name}="{value.replace(chr(34), "&quot;")}"'
+
+        indent = " " * len(self.html_elements)
+        if tag in self.VOID_ELEMENTS:
+            output.append(f"{indent}<{start_tag}/>\n")
+        else:
+            output.append(f"{indent}<{start_tag}>\n")
+            self.html_elements.append(tag)
+
+    def _close_tag(self, tag: str, output: List[str]) -> None:
+        """
+        Write the end tag of the given element, and of any element opened after it.
+        End tags of elements which are not open are ignored.
+
+        :param tag: The name of the element.
+        :param output: The list of formatted lines to append to.
+        """
+        if tag not in self.html_elements:
+            return
+        while True:
+            open_tag = self.html_elements.pop()
+            output.append(f"{' ' * len(self.html_elements)}</{open_tag}>\n")
+            if open_tag == tag:
+                return
+
+
+def escape_text(text: str) -> str:
+    """
+    Replace the characters of the given text which are special in HTML with entities,
+    keeping any entities already in the text.
+
+    :param text: The text to escape.
+    :returns: The escaped text.
+    """
+    if "&" in text:
+        # Only imported when needed, as it loads a large table of HTML entities.
+        from html import unescape
+
+        text = unescape(text).replace("&", "&amp;")
+    return text.replace("<", "&lt;").replace(">", "&gt;")
+
+
+def open_input(filename: str) -> IO[str]:
+    """
+    Open the given file in read mode, where `-` stands for standard in.
+
+    :param filename: The path of the file to open.
+    :returns: A context manager for the opened file. Standard in is left open on exit.
+    """
+    if filename == "-":
+        return nullcontext(sys.stdin)
+    return open(filename, "r")
+
+
+def open_output(filename: str, compression: str = None, level: int = None) -> IO[str]:
+    """
+    Open the given file in write mode. A file hard linked to the render cache is
+    removed first, as writing to it would also change the cached HTML.
+
+    When compressing, the text written is gathered into chunks of
+    `COMPRESSION_BUFFER_SIZE` bytes, which are compressed as they are written, so
+    that the uncompressed output is never written anywhere.
+
+    :param filename: The path of the file to open. When compressing, `-` stands for
+        standard out, which is left open when the returned file is closed.
+    :param compression: The format to compress the text with, one of
+        `COMPRESSION_EXTENSIONS`.
+    :param level: The compression level. Defaults to the default level of the format.
+    :returns: The opened file.
+    :raises: A `ValueError` if the compression format is unknown or not available.
+    """
+    if filename != "-" and path.exists(filename) and os.stat(filename).st_nlink > 1:
+        remove(filename)
+    if compression is None:
+        return open(filename, "w")
+
+    compressor = make_compressor(compression, level)
+    if filename == "-":
+        sys.stdout.flush()
+        writer = CompressedWriter(sys.stdout.buffer, compressor, close_file=False)
+    else:
+        writer = CompressedWriter(open(filename, "wb"), compressor)
+    return io.TextIOWrapper(io.BufferedWriter(writer, COMPRESSION_BUFFER_SIZE))
+
+
+def make_compressor(compression: str, level: int = None):
+    """
+    Create a compressor object for the given format.
+
+    :param compression: The compression format, one of `COMPRESSION_EXTENSIONS`.
+    :param level: The compression level. Defaults to the default level of the format.
+    :returns: An object with a `compress` method, returning the compressed data of
+        the bytes given so far, and a `flush` method, returning the rest of it.
+    :raises: A `ValueError` if the format is unknown, its level is invalid, or it is
+        `zstd` and the `zstandard` module is not installed.
+    """
+    # Imported here as they are only needed when compressing.
+    if compression in ("gzip", "zlib"):
+        import zlib
+
+        # A window size over 16 writes a gzip header and trailer.
+        window = 16 + zlib.MAX_WBITS if compression == "gzip" else zlib.MAX_WBITS
+        try:
+            return zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                zlib.DEFLATED,
+                window,
+            )
+        except ValueError:
+            raise ValueError(f"The {compression} level must be between 0 and 9.")
+    if compression == "zstd":
+        # Checked before importing zstandard, so an invalid level is reported the
+        # same way as for the other formats.
+        if level is not None and level not in ZSTD_LEVELS:
+            raise ValueError(
+                f"The zstd level must be between {ZSTD_LEVELS[0]} and {ZSTD_LEVELS[-1]}."
+            )
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("The zstd format requires the zstandard module.")
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compressobj()
+    raise ValueError(f"Unknown compression format: {compression}")
+
+
+class CompressedWriter(io.RawIOBase):
+    """
+    A binary file which compresses the bytes written to it into another binary file.
+    """
+
+    def __init__(self, file: IO[bytes], compressor, close_file: bool = True):
+        """
+        :param file: The file to write the compressed bytes to.
+        :param compressor: The compressor object, as returned by `make_compressor`.
+        :param close_file: Boolean flag to specify whether to close `file` when this
+            file is closed, instead of only flushing it.
+        """
+        super().__init__()
+        self.file = file
+        self.compressor = compressor
+        self.close_file = close_file
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self.file.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.file.write(self.compressor.flush())
+            if self.close_file:
+                self.file.close()
+            else:
+                self.file.flush()
+        super().close()
+
+
+def can_map(filename: str) -> bool:
+    """
+    Check whether the given file can be read through a memory map, which requires a
+    regular, non-empty file in an encoding where every new line is a `\\n` byte.
+
+    :param filename: The path of the file.
+    :returns: `True` if the file can be read with `map_lines`, `False` otherwise.
+    """
+    if filename == "-" or not path.isfile(filename) or path.getsize(filename) == 0:
+        return False
+    # The encoding of a file opened in read mode without an explicit encoding.
+    with open(filename, "r") as file:
+        return "\n".encode(file.encoding) == b"\n"
+
+
+def map_lines(filename: str, start: int = 0, end: int = None) -> Iterator[str]:
+    """
+    Read the lines of the given file through a memory map, as a file opened in read
+    mode would. Only one chunk of the file, ending with a new line, is decoded at a
+    time, so that neither the file nor a list of its lines is ever kept in memory.
+
+    :param filename: The path of a file for which `can_map` is `True`.
+    :param start: The offset, in bytes, of the first line to read.
+    :param end: The offset, in bytes, after the last line to read. Defaults to the end
+        of the file.
+    :returns: An iterator over the lines, including line endings.
+    """
+    import mmap
+
+    with open(filename, "r") as file:
+        decoder = codecs.getincrementaldecoder(file.encoding)(file.errors)
+        # Translate line endings the same way as a file opened in read mode.
+        newline_decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            end = len(mapped) if end is None else end
+            partial_line = ""
+            with memoryview(mapped) as view:
+                for chunk_start, chunk_end in line_spans(
+                    mapped, STREAM_CHUNK_SIZE, start, end
+                ):
+                    with view[chunk_start:chunk_end] as chunk:
+                        text = newline_decoder.decode(chunk, final=chunk_end == end)
+                    text = io.StringIO(f"{partial_line}{text}", newline="\n")
+                    lines = text.readlines()
+                    partial_line = ""
+                    if lines and not lines[-1].endswith("\n"):
+                        partial_line = lines.pop()
+                    yield from lines
+            if partial_line:
+                yield partial_line
+
+
+def line_spans(
+    mapped: "mmap.mmap", size: int, start: int = 0, end: int = None
+) -> Iterator[Tuple[int, int]]:
+    """
+    Split a range of the given memory mapped file into spans of at least `size` bytes,
+    each one ending with a new line, apart from the last one.
+
+    :param mapped: The memory mapped file.
+    :param size: The minimum size of a span in bytes.
+    :param start: The offset of the range to split.
+    :param end: The offset after the range to split. Defaults to the end of the file.
+    :returns: An iterator over the start and end offsets of each span.
+    """
+    end = len(mapped) if end is None else end
+    while start < end:
+        span_end = mapped.find(b"\n", min(start + size, end) - 1, end)
+        span_end = end if span_end == -1 else span_end + 1
+        yield start, span_end
+        start = span_end
+
+
+def map_blocks(filename: str, block_size: int) -> List[Tuple[str, int, int]]:
+    """
+    Split the given file into blocks of at least `block_size` bytes which can be parsed
+    independently of each other, without reading their lines.
+
+    :param filename: The path of a file for which `can_map` is `True`.
+    :param block_size: The minimum size of a block in bytes.
+    :returns: The file name and byte range of each block, to read with `map_lines`.
+    """
+    import mmap
+
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return [
+                (filename, start, end) for start, end in line_spans(mapped, block_size)
+            ]
+
+
+def read_lines(filename: str) -> Iterator[str]:
+    """
+    Read the lines of the given file, through a memory map if possible.
+
+    :param filename: The path of the file, where `-` stands for standard in.
+    :returns: An iterator over the lines, including line endings.
+    """
+    if can_map(filename):
+        yield from map_lines(filename)
+    else:
+        with open_input(filename) as file:
+            yield from file
+
+
+# The minimum size, in characters, of the blocks parsed in parallel. Small blocks also
+# keep the HTML string built for each one short.
+BLOCK_SIZE = 64 * 1024
+
+
+def split_blocks(
+    lines: Iterable[str], block_size: int, string: bool
+) -> Iterator[List[str]]:
+    """
+    Group the given lines into blocks of at least `block_size` characters, which can be
+    parsed independently of each other.
+
+    A string is only split after a blank line, where the parser resets its flags. A file
+    is parsed one line at a time, closing every element, so it can be split anywhere.
+
+    :param lines: The lines to be grouped, including line endings.
+    :param block_size: The minimum amount of characters in a block.
+    :param string: Boolean flag to specify whether the lines come from a string or a
+        file.
+    :returns: An iterator over the blocks, each one being a list of lines.
+    """
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_size and (not string or line.strip() == ""):
+            yield block
+            block = []
+            size = 0
+    if block:
+        yield block
+
+
+def _parse_block(
+    block: Tuple[List[str], bool], html_elements: List[str] = None
+) -> Tuple[str, List[str], bool]:
+    """
+    Parse a single block of a larger document. Runs in a worker process.
+
+    :param block: The lines of the block, or the file name and byte range of the block
+        to read them from, and whether they come from a string.
+    :param html_elements: The HTML elements left open by the preceding blocks.
+    :returns: The parsed HTML, the elements left open, and whether the block contains
+        anything other than blank lines.
+    """
+    lines, string = block
+    if isinstance(lines, tuple):
+        lines = list(map_lines(*lines))
+    parser = MarkdownParser._block_parser(html_elements)
+    if string:
+        parser.parse_content("".join(lines), close_elements=False)
+    else:
+        for line in lines:
+            parser.parse_content(line)
+    return parser.raw_html, parser.html_elements, any(line.strip() for line in lines)
+
+
+class IncrementalMarkdownParser:
+    """
+    Renders the same markdown document repeatedly, only parsing the blocks that changed
+    since a previous render.
+
+    The document is split into blocks at blank lines. The HTML of each block is kept in
+    an LRU cache keyed by a hash of the block and the HTML elements left open before it,
+    so the output is the same as that of `MarkdownParser`.
+    """
+
+    def __init__(self, cache_size: int = 4096, cache_bytes: int = None):
+        """
+        :param cache_size: The maximum number of parsed blocks to keep in the cache.
+        :param cache_bytes: The maximum total length of the HTML kept in the cache, in
+            characters, or `None` for no limit. Blocks whose HTML is longer are parsed
+            again on every render.
+        """
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.renders = 0
+        # Time spent parsing blocks that were not in the cache, and rendering overall.
+        self.parse_time = 0.0
+        self.render_time = 0.0
+        self.last_render_time = 0.0
+
+    def render(self, content: str, string: bool = False) -> str:
+        """
+        Parse a markdown document or string into its HTML equivalent.
+
+        :param content: The path of the file, or a string, to be parsed. Works in
+            conjunction with the `string` boolean flag.
+        :param string: Boolean flag to specify whether a user has passed a filename
+            or a string.
+        :returns: The parsed content as HTML.
+        """
+        start = time.perf_counter()
+        if string:
+            html = self._render_lines(io.StringIO(content, newline="\n"), string)
+        else:
+            with open(content, "r") as file:
+                html = self._render_lines(file, string)
+
+        self.renders += 1
+        self.last_render_time = time.perf_counter() - start
+        self.render_time += self.last_render_time
+        return html
+
+    def _render_lines(self, lines: Iterable[str], string: bool) -> str:
+        """
+        Render the given lines, parsing only the blocks missing from the cache.
+
+        :param lines: The lines of the content to be parsed, including line endings.
+        :param string: Boolean flag to specify whether the lines come from a string.
+        :returns: The parsed content as HTML.
+        """
+        html = [HTML_HEADER]
+        # Imported here as it is only needed when rendering incrementally.
+        import hashlib
+
+        html_elements = ()
+        # Files could be split after any line, but blank lines give larger blocks.
+        for block in split_blocks(lines, 1, True):
+            key = hashlib.blake2b(
+                repr((string, html_elements)).encode(), digest_size=16
+            )
+            key.update("".join(block).encode())
+            key = key.digest()
+            parsed_block = self.cache.get(key)
+            if parsed_block is None:
+                self.misses += 1
+                start = time.perf_counter()
+                block_html, block_elements, _ = _parse_block(
+                    (block, string), html_elements
+                )
+                self.parse_time += time.perf_counter() - start
+                parsed_block = (block_html, tuple(block_elements))
+                if self.cache_bytes is None or len(block_html) <= self.cache_bytes:
+                    self.cache[key] = parsed_block
+                    self.cached_bytes += len(block_html)
+                while len(self.cache) > self.cache_size or (
+                    self.cache_bytes is not None
+                    and self.cached_bytes > self.cache_bytes
+                ):
+                    self.cached_bytes -= len(self.cache.popitem(last=False)[1][0])
+                    self.evictions += 1
+            else:
+                self.hits += 1
+                self.cache.move_to_end(key)
+
+            block_html, html_elements = parsed_block
+            html.append(block_html)
+
+        for element in reversed(html_elements):
+            html.append(f"\n</{element}>")
+        html.append(HTML_FOOTER)
+        return "".join(html)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Report the cache usage and timings of all renders so far.
+
+        :returns: A dictionary of the cache hits, misses, hit rate, evictions, size and
+            length of the cached HTML, and the time spent parsing and rendering in
+            seconds.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "renders": self.renders,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "cached_blocks": len(self.cache),
+            "cached_bytes": self.cached_bytes,
+            "parse_time": self.parse_time,
+            "render_time": self.render_time,
+            "last_render_time": self.last_render_time,
+        }
+
+
+# The default maximum size of the render cache, in bytes.
+RENDER_CACHE_SIZE = 256 * 1024 * 1024
+# The share of its maximum size the render cache is trimmed to once it grows larger, so
+# that the directory is not scanned again on every following write.
+RENDER_CACHE_TRIM = 0.9
+
+
+class RenderCache:
+    """
+    Keeps the HTML of parsed documents in a directory, so that documents which have not
+    changed are not parsed again. Each document is keyed by a hash of its content, of
+    the parser and of the flags changing its HTML.
+
+    Entries are written to a temporary file first and renamed into place, so that
+    concurrent builds never read a partial entry. The total size of the entries is kept
+    up to date as they are written, and once it grows larger than the maximum size, the
+    least recently used entries are removed until the cache is back to
+    `RENDER_CACHE_TRIM` of it. Only then is the directory scanned, which also accounts
+    for the entries written by other builds meanwhile.
+    """
+
+    def __init__(self, directory: str, max_size: int = RENDER_CACHE_SIZE):
+        """
+        :param directory: The directory to keep the cached HTML in. It is created if
+            it does not exist.
+        :param max_size: The maximum total size of the cached HTML in bytes.
+        """
+        # Imported here as it is only needed when caching.
+        import hashlib
+        import locale
+
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+        # Any change to the parser, or to the encoding files are read with, changes
+        # every key.
+        with open(__file__, "rb") as file:
+            version = hashlib.blake2b(file.read(), digest_size=16)
+        version.update(locale.getpreferredencoding(False).encode())
+        self.version = version.hexdigest()
+
+    def key(self, content: str, string: bool, prettify: bool = False) -> str:
+        """
+        Hash the given content, and the flags that change its HTML.
+
+        :param content: The path of the file, or a string, to be parsed. Works in
+            conjunction with the `string` boolean flag.
+        :param string: Boolean flag to specify whether a user has passed a filename
+            or a string.
+        :param prettify: Boolean flag to specify whether the HTML output is prettified.
+        :returns: The key of the content in the cache.
+        """
+        import hashlib
+
+        key = hashlib.blake2b(f"{self.version} {string} {prettify} ".encode())
+        if string:
+            key.update(content.encode("utf-8", "surrogatepass"))
+        else:
+            with open(content, "rb") as file:
+                for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b""):
+                    key.update(chunk)
+        return key.hexdigest()[:40]
+
+    def path(self, key: str) -> str:
+        """
+        :param key: The key of an entry.
+        :returns: The path of the file containing the entry.
+        """
+        return path.join(self.directory, f"{key}.html")
+
+    def get(self, key: str) -> Union[str, None]:
+        """
+        Read the HTML of the given entry, marking it as recently used.
+
+        :param key: The key of the entry.
+        :returns: The cached HTML, or `None` if the entry is not in the cache.
+        """
+        filename = self.path(key)
+        try:
+            with open(filename, "r", newline="") as file:
+                html = file.read()
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        return html
+
+    def put(self, key: str, html: str) -> None:
+        """
+        Add the given HTML to the cache, then remove the least recently used entries if
+        the cache has grown too large.
+
+        :param key: The key of the entry.
+        :param html: The HTML to cache.
+        """
+        temporary = path.join(self.directory, f".{key}.{os.getpid()}.tmp")
+        filename = self.path(key)
+        try:
+            with open(temporary, "w") as file:
+                file.write(html)
+            self.size += os.stat(temporary).st_size
+            if path.exists(filename):
+                self.size -= os.stat(filename).st_size
+            os.replace(temporary, filename)
+        finally:
+            if path.exists(temporary):
+                remove(temporary)
+        if self.size > self.max_size:
+            self.evict()
+
+    def link(self, key: str, destination: str) -> bool:
+        """
+        Hard link the file of the given entry to `destination`, replacing it.
+
+        :param key: The key of the entry.
+        :param destination: The path to link the entry to.
+        :returns: `True` if the entry was linked, `False` if it could not be, e.g. as
+            the cache is on another file system or the entry has just been removed.
+        """
+        temporary = f"{destination}.{os.getpid()}.tmp"
+        try:
+            os.link(self.path(key), temporary)
+        except OSError:
+            return False
+        os.replace(temporary, destination)
+        return True
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Scan the directory of the cache.
+
+        :returns: The modification time, size and path of every entry.
+        """
+        entries = []
+        with os.scandir(self.directory) as directory:
+            for entry in directory:
+                if entry.name.endswith(".html"):
+                    try:
+                        entry_stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append(
+                        (entry_stat.st_mtime, entry_stat.st_size, entry.path)
+                    )
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache is back to
+        `RENDER_CACHE_TRIM` of its maximum size.
+
+        :returns: The number of entries removed.
+        """
+        entries = self.entries()
+        self.size = sum(entry_size for _, entry_size, _ in entries)
+        evicted = 0
+        for _, entry_size, filename in sorted(entries):
+            if self.size <= self.max_size * RENDER_CACHE_TRIM:
+                break
+            try:
+                remove(filename)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            self.size -= entry_size
+        return evicted
 
 
 content = """This is a multiline input
@@ -437,6 +1619,57 @@ This line should contain a hyperlink to [Google.com](https://www.google.com).
 This line should have an **image** of a muffin ![muffin time](https://static.wikia.nocookie.net/asdfmovie/images/1/1d/Muffin.png/revision/latest/scale-to-width-down/148?cb=20180617145555) with alternate text 'muffin time'."""
 
 
+# The number of slowest imports shown by `--startup-profile`.
+STARTUP_PROFILE_LENGTH = 20
+
+
+def profile_startup(arguments: List[str]) -> int:
+    """
+    Run the markdown parser with the given arguments under `python -X importtime`, and
+    report the time spent importing modules to standard error, slowest first.
+
+    :param arguments: The command line arguments to run the markdown parser with.
+    :returns: The exit code of the markdown parser.
+    """
+    import subprocess
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", path.abspath(__file__), *arguments],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    # e.g. import time:       257 |      10091 |   multiprocessing
+    pattern = re.compile(r"import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)")
+    imports = []
+    for line in process.stderr.splitlines():
+        match = pattern.match(line)
+        if match:
+            self_time, cumulative, indent, module = match.groups()
+            imports.append((int(cumulative), int(self_time), len(indent) // 2, module))
+        elif not line.startswith("import time:"):
+            sys.stderr.write(f"{line}\n")
+
+    # Only top level imports, as the cumulative time includes that of nested imports.
+    import_time = sum(cumulative for cumulative, _, depth, _ in imports if depth == 0)
+    report = [
+        "",
+        "Startup profile (python -X importtime)",
+        f"{'cumulative (us)':>16} {'self (us)':>10}  module",
+    ]
+    for cumulative, self_time, depth, module in sorted(imports, reverse=True)[
+        :STARTUP_PROFILE_LENGTH
+    ]:
+        report.append(f"{cumulative:>16} {self_time:>10}  {'  ' * depth}{module}")
+    report.append(f"Modules imported: {len(imports)}")
+    report.append(f"Import time:      {import_time / 1000:.3f} ms")
+    report.append(f"Total run time:   {elapsed * 1000:.3f} ms")
+    sys.stderr.write("\n".join(report) + "\n")
+    return process.returncode
+
+
 def show_help_message():
     """Display a help message and exit the program."""
     print(
@@ -446,22 +1679,59 @@ This version was written for Python3.
 
 usage: python markdown_parser.py <path/to/file> [--help] [--raw <markdown string>]
                                                 [--prettify] [--stdout] [--demo]
+                                                [--workers <number of processes>]
+                                                [--startup-profile]
+                                                [--stats [table|json]]
+                                                [--cache <directory>]
+                                                [--cache-size <megabytes>]
+                                                [--compress <gzip|zlib|zstd>]
+                                                [--compress-level <level>]
 
 <path/to/file>: The file that contains markdown code. Ignored if the `--raw` flag is
-                used. Must be the first argument.
+                used. Must be the first argument. Use `-` to read from standard in,
+                writing out the HTML while the input is still being read.
 
 --help: Display this help message and exit.
 --raw: Provide a raw string of markdown content to be parsed into HTML.
---prettify: Prettify the output using BeautifulSoup4.
+--prettify: Prettify the output, with one element or text per line.
 --stdout: Print the resulting HTML code to standard out instead of a file.
 --demo: Uses a predefined raw string (implies the `--raw` flag) that uses all features
         of the markdown parser.
+--workers: Split the content into blocks at blank lines and parse them using the given
+           number of processes. The output is the same as parsing sequentially.
+--startup-profile: Run with the given flags and report the time spent importing each
+                   module to standard error, as `python -X importtime` does.
+--stats: Count and time the work done for each markdown construct, regex scan and
+         output phase, and report it to standard error as a table (default) or JSON.
+         With `--workers`, the blocks parsed by the workers are not counted.
+--cache: Keep the HTML of every parsed file or string in the given directory, keyed by
+         a hash of the content, the parser and `--prettify`. Unchanged content is not
+         parsed again: its cached HTML is hard linked to `parsed.html`, or copied if
+         that is not possible. Standard in is never cached.
+--cache-size: The maximum size of the cache directory. The least recently used HTML
+              is removed once it grows larger. Defaults to 256 megabytes.
+--compress: Compress the HTML output while it is written, to `parsed.html.gz`,
+            `parsed.html.zz` or `parsed.html.zst`, or to standard out with `--stdout`.
+            The zstd format requires the `zstandard` module.
+--compress-level: The compression level, higher is smaller but slower. Defaults to
+                  6 for gzip and zlib, and 3 for zstd. It must be between 0 and 9
+                  for gzip and zlib, and between -131072 and 22 for zstd.
 
 Example usage:
 - Raw string
 python markdown_parser.py --raw "# An h1 header with *bold text*." --stdout
 - File
 python markdown_parser.py ./markdown.md --prettify
+- Standard in
+cat ./markdown.md | python markdown_parser.py - --stdout
+- Large file on 8 cores
+python markdown_parser.py ./markdown.md --workers 8
+- Profile a slow file
+python markdown_parser.py ./markdown.md --stats json
+- Archive a large file
+python markdown_parser.py ./markdown.md --compress gzip --compress-level 9
+- Documentation build, only parsing the files that changed
+python markdown_parser.py ./markdown.md --cache ~/.cache/markdown-parser
 
 Exit Codes:
 0 - OK
@@ -479,11 +1749,23 @@ if __name__ == "__main__":
         "prettify": "--prettify" in sys.argv,
         "stdout": "--stdout" in sys.argv,
         "demo": "--demo" in sys.argv,
+        "workers": "--workers" in sys.argv,
+        "startup_profile": "--startup-profile" in sys.argv,
+        "stats": "--stats" in sys.argv,
+        "cache": "--cache" in sys.argv,
+        "cache_size": "--cache-size" in sys.argv,
+        "compress": "--compress" in sys.argv,
+        "compress_level": "--compress-level" in sys.argv,
     }
 
     if flags["help"]:
         show_help_message()
 
+    if flags["startup_profile"]:
+        sys.exit(
+            profile_startup([arg for arg in sys.argv[1:] if arg != "--startup-profile"])
+        )
+
     if flags["raw"]:
         try:
             content = sys.argv[sys.argv.index("--raw") + 1]
@@ -496,9 +1778,71 @@ if __name__ == "__main__":
         except IndexError:
             content = None
 
+    workers = 1
+    if flags["workers"]:
+        try:
+            workers = int(sys.argv[sys.argv.index("--workers") + 1])
+        except (IndexError, ValueError):
+            print("The number of workers must be an integer.")
+            sys.exit(1)
+
+    cache = None
+    if flags["cache"]:
+        try:
+            cache_directory = sys.argv[sys.argv.index("--cache") + 1]
+            cache_size = RENDER_CACHE_SIZE
+            if flags["cache_size"]:
+                cache_size = int(sys.argv[sys.argv.index("--cache-size") + 1]) << 20
+        except (IndexError, ValueError):
+            print("The cache needs a directory, and its size must be an integer.")
+            sys.exit(1)
+        cache = RenderCache(cache_directory, cache_size)
+
+    compression = None
+    compression_level = None
+    if flags["compress"]:
+        try:
+            compression = sys.argv[sys.argv.index("--compress") + 1]
+            if flags["compress_level"]:
+                compression_level = int(
+                    sys.argv[sys.argv.index("--compress-level") + 1]
+                )
+        except (IndexError, ValueError):
+            print("The compression needs a format, and its level must be an integer.")
+            sys.exit(1)
+        if compression not in COMPRESSION_EXTENSIONS:
+            print(
+                f"The compression format must be one of {', '.join(COMPRESSION_EXTENSIONS)}."
+            )
+            sys.exit(1)
+        try:
+            make_compressor(compression, compression_level)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    stats_format = "table"
+    if flags["stats"]:
+        index = sys.argv.index("--stats") + 1
+        if index < len(sys.argv) and sys.argv[index] in ("table", "json"):
+            stats_format = sys.argv[index]
+
     parser = MarkdownParser(
         content,
         flags["demo"] or flags["raw"],
         flags["prettify"],
         flags["stdout"],
+        workers,
+        flags["stats"],
+        cache,
+        compression,
+        compression_level,
     )
+
+    if flags["stats"]:
+        if stats_format == "json":
+            import json
+
+            sys.stderr.write(f"{json.dumps(parser.stats.to_dict(), indent=2)}\n")
+        else:
+            sys.stderr.write(f"{parser.stats.format_table()}\n")
@@ -1,5 +1,11 @@
 # Mock sys.argv -- https://stackoverflow.com/questions/18668947/how-do-i-set-sys-argv-so-i-can-unit-test-it
+import gzip
+import json
+import os
+import subprocess
 import sys
+import zlib
+from os import path
 from unittest.mock import patch
 
 import markdown_parser as md
@@ -14,6 +20,8 @@ import pytest
         ["--prettify"],
         ["--stdout"],
         ["--demo"],
+        ["--workers"],
+        ["--startup-profile"],
     ],
 )
 def test_parse_args(flags):
@@ -245,3 +253,425 @@ def test_that_the_parser_treats_unknown_special_characters_as_invalid_markdown(c
     html = f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<meta name="author" content="Marios Yiannakou">\n<meta name="description" content="This is a markdown parser to HTML created for my COMP30040 module at the University of Manchester.">\n</head>\n<body>\n{parsed_html}\n</body>\n</html>'
     md.MarkdownParser(markdown, True, False, True)
     assert capsys.readouterr().out.strip() == html.strip()
+
+
+@pytest.mark.parametrize(
+    "lines_blocks",
+    [
+        [
+            ["a\n", "b\n", "\n", "c\n", "  \n", "d"],
+            [["a\n", "b\n", "\n"], ["c\n", "  \n"], ["d"]],
+        ],
+        [
+            ["a\n", "b\n", "c"],
+            [["a\n", "b\n", "c"]],
+        ],
+    ],
+)
+def test_that_strings_are_only_split_into_blocks_after_blank_lines(lines_blocks):
+    lines, blocks = lines_blocks
+    assert list(md.split_blocks(lines, 1, True)) == blocks
+
+
+def test_that_files_are_split_into_blocks_after_any_line():
+    lines = ["a\n", "b\n", "c"]
+    assert list(md.split_blocks(lines, 1, False)) == [["a\n"], ["b\n"], ["c"]]
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    [
+        md.content,
+        # Leaves more than one element open at a blank line.
+        "hello *there*\nmore **text**\n\n> *unmatched\n\nlast line\n\n\n",
+    ],
+)
+@pytest.mark.parametrize("string", [True, False])
+def test_that_parsing_blocks_in_parallel_produces_the_same_html(
+    markdown, string, tmp_path, capsys
+):
+    content = markdown
+    if not string:
+        content = tmp_path / "markdown.md"
+        content.write_text(markdown)
+        content = str(content)
+
+    md.MarkdownParser(content, string, False, True)
+    sequential_html = capsys.readouterr().out
+    with patch.object(md, "BLOCK_SIZE", 1):
+        md.MarkdownParser(content, string, False, True, 2)
+    assert capsys.readouterr().out == sequential_html
+
+
+@pytest.mark.parametrize("string", [True, False])
+def test_that_the_incremental_parser_produces_the_same_html(string, tmp_path, capsys):
+    content = md.content
+    if not string:
+        content = tmp_path / "markdown.md"
+        content.write_text(md.content)
+        content = str(content)
+
+    parser = md.MarkdownParser(content, string, False, True)
+    capsys.readouterr()
+    assert md.IncrementalMarkdownParser().render(content, string) == parser.raw_html
+
+
+def test_that_the_incremental_parser_only_parses_changed_blocks():
+    parser = md.IncrementalMarkdownParser()
+    parser.render(md.content, True)
+    blocks = parser.misses
+
+    parser.render(md.content.replace("> This is a blockquote", "> A quote"), True)
+    assert parser.stats()["misses"] == blocks + 1
+    assert parser.stats()["hits"] == blocks - 1
+
+
+def test_that_the_incremental_parser_evicts_the_least_recently_used_blocks():
+    parser = md.IncrementalMarkdownParser(cache_size=2)
+    parser.render("first\n\nsecond\n\nthird", True)
+    assert parser.stats()["cached_blocks"] == 2
+    assert parser.stats()["evictions"] == 1
+
+    # The last block of the first render follows a paragraph in both renders.
+    parser.render("another\n\nthird", True)
+    assert parser.hits == 1
+
+
+def test_that_the_incremental_parser_bounds_the_length_of_the_cached_html(capsys):
+    parser = md.IncrementalMarkdownParser(cache_bytes=40)
+    markdown = f"first\n\n{'x' * 100}"
+    html = parser.render(markdown, True)
+    assert html == md.MarkdownParser(markdown, True, False, True).raw_html
+    # The long block is not cached.
+    assert parser.stats()["cached_blocks"] == 1
+    assert parser.stats()["cached_bytes"] <= 40
+
+    parser.render("second\n\nthird\n\nfourth", True)
+    assert parser.stats()["cached_bytes"] <= 40
+    assert parser.stats()["evictions"] > 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 4096])
+@pytest.mark.parametrize("binary", [True, False])
+def test_that_feeding_chunks_produces_the_same_html_as_a_file(
+    chunk_size, binary, tmp_path, capsys
+):
+    markdown = f"£ {md.content}\r\n> A line ending in a carriage return\r\nlast line"
+    filename = tmp_path / "markdown.md"
+    filename.write_bytes(markdown.encode())
+    parser = md.MarkdownParser(str(filename), False, False, True)
+    capsys.readouterr()
+
+    if binary:
+        markdown = markdown.encode()
+    streamed = md.MarkdownParser.stream()
+    html = [
+        streamed.feed(markdown[i : i + chunk_size])
+        for i in range(0, len(markdown), chunk_size)
+    ]
+    html.append(streamed.close())
+    assert "".join(html) == parser.raw_html
+
+
+def test_that_feeding_a_line_returns_its_html():
+    parser = md.MarkdownParser.stream()
+    assert parser.feed("**bold") == md.HTML_HEADER
+    assert parser.feed("**\nnext") == "<b>bold</b>"
+    assert parser.close() == f"<p>\nnext\n</p>{md.HTML_FOOTER}"
+
+
+def test_that_prettify_matches_beautiful_soup(capsys):
+    bs4 = pytest.importorskip("bs4")
+    markdown = f"{md.content}\n\nAT&amp;T &copy; a < b > c ![it's](x&y)"
+    parser = md.MarkdownParser(markdown, True, False, True)
+    capsys.readouterr()
+    prettifier = md.HtmlPrettifier()
+
+    html = prettifier.feed(parser.raw_html) + prettifier.close()
+    assert html == bs4.BeautifulSoup(parser.raw_html, "html.parser").prettify()
+
+
+def test_that_prettify_closes_unmatched_elements_and_ignores_stray_end_tags():
+    prettifier = md.HtmlPrettifier()
+    html = prettifier.feed("<p>\n<b>bold</i>\n<img src='x'></p><i>text")
+    assert html == '<p>\n <b>\n  bold\n  <img src="x"/>\n </b>\n</p>\n<i>\n'
+    # The text could have continued, so it is only written once the HTML ends.
+    assert prettifier.close() == " text\n</i>\n"
+
+
+def test_that_feeding_chunks_with_prettify_produces_the_same_html_as_a_file(
+    tmp_path, capsys
+):
+    filename = tmp_path / "markdown.md"
+    filename.write_text(md.content)
+    md.MarkdownParser(str(filename), False, True, True)
+    html = capsys.readouterr().out
+
+    parser = md.MarkdownParser.stream(prettify=True)
+    streamed = [
+        parser.feed(md.content[i : i + 3]) for i in range(0, len(md.content), 3)
+    ]
+    streamed.append(parser.close())
+    assert f"{''.join(streamed)}\n" == html
+
+
+@pytest.mark.parametrize("module", ["multiprocessing", "hashlib", "html", "bs4"])
+def test_that_importing_the_parser_does_not_import_optional_modules(module):
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import markdown_parser, sys; print('{module}' in sys.modules)",
+        ],
+        cwd=path.dirname(md.__file__),
+        capture_output=True,
+        text=True,
+    )
+    assert imported.stdout == "False\n"
+
+
+def test_that_the_startup_profile_reports_import_times(capfd):
+    assert md.profile_startup(["--raw", "*italic*", "--stdout"]) == 0
+    captured = capfd.readouterr()
+    assert "<i>italic</i>" in captured.out
+    assert "Startup profile (python -X importtime)" in captured.err
+    assert "Import time:" in captured.err
+
+
+def test_that_parsers_without_stats_are_not_instrumented(capsys):
+    parser = md.MarkdownParser("# header", True, False, True)
+    assert parser.stats is None
+    assert "parse_special_characters" not in vars(parser)
+
+
+def test_that_stats_count_each_construct(capsys):
+    parser = md.MarkdownParser(md.content, True, False, True, stats=True)
+    html = capsys.readouterr().out
+    assert html == f"{md.MarkdownParser(md.content, True, False, True).raw_html}\n"
+
+    stats = parser.stats.to_dict()
+    assert stats["construct: header"]["calls"] == 4
+    assert stats["construct: image"]["calls"] == 1
+    assert stats["output: write"]["calls"] == 1
+    assert all(entry["seconds"] >= 0 for entry in stats.values())
+    table = parser.stats.format_table().splitlines()
+    assert table[0].split() == ["entry", "calls", "time", "(ms)", "%"]
+    assert table[-1].split()[:2] == ["total", str(sum(parser.stats.calls.values()))]
+
+
+def test_that_the_stats_flag_reports_json_to_standard_error():
+    process = subprocess.run(
+        [
+            sys.executable,
+            md.__file__,
+            "--raw",
+            "*italic*",
+            "--stdout",
+            "--stats",
+            "json",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert "<i>italic</i>" in process.stdout
+    assert json.loads(process.stderr)["construct: emphasis"]["calls"] == 1
+
+
+@pytest.mark.parametrize(
+    "markdown, element",
+    [("*a* " * 5000, "<i>a</i>"), ("- a " * 5000, "<li>"), ("[a](b) " * 5000, "<a ")],
+)
+def test_that_long_lines_of_markdown_do_not_exhaust_the_stack(markdown, element):
+    parser = md.MarkdownParser.__new__(md.MarkdownParser)
+    parser.html_elements = []
+    parser.raw_html = ""
+    parser.parse_content(markdown)
+    assert parser.raw_html.count(element) == 5000
+
+
+@pytest.mark.parametrize("markdown", ["[a " * 20000, "![a " * 20000])
+def test_that_lines_of_unmatched_links_are_plain_text(markdown):
+    parser = md.MarkdownParser.__new__(md.MarkdownParser)
+    parser.html_elements = []
+    parser.raw_html = ""
+    parser.parse_content(markdown)
+    assert parser.raw_html == f"<p>\n{markdown.strip()}\n</p>"
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("[a](b) and **c**", '<a href="b">a</a> and <b>c</b>'),
+        ("##", "<p>\n##\n</p>"),
+        ("![a](b](c)", '<img src="b](c" alt="a"/>'),
+    ],
+)
+def test_that_lines_which_used_to_raise_an_exception_are_parsed(markdown, expected):
+    parser = md.MarkdownParser.__new__(md.MarkdownParser)
+    parser.html_elements = []
+    parser.raw_html = ""
+    parser.parse_content(markdown)
+    assert parser.raw_html == expected
+
+
+def test_that_the_render_cache_links_unchanged_files_without_parsing(
+    tmp_path, monkeypatch, capsys
+):
+    monkeypatch.chdir(tmp_path)
+    filename = tmp_path / "markdown.md"
+    filename.write_text(md.content)
+    cache = md.RenderCache(str(tmp_path / "cache"))
+    md.MarkdownParser(str(filename), cache=cache)
+    html = (tmp_path / "parsed.html").read_text()
+
+    with patch.object(md.MarkdownParser, "parse_content", side_effect=AssertionError):
+        parser = md.MarkdownParser(str(filename), cache=cache)
+    assert parser.raw_html == html
+    assert (tmp_path / "parsed.html").stat().st_nlink == 2
+
+    # Writing the output again must not change the cached HTML through the link.
+    md.MarkdownParser("# changed", True)
+    assert (tmp_path / "parsed.html").stat().st_nlink == 1
+    with patch.object(md.MarkdownParser, "parse_content", side_effect=AssertionError):
+        md.MarkdownParser(str(filename), cache=cache)
+    assert (tmp_path / "parsed.html").read_text() == html
+
+
+def test_that_the_render_cache_key_depends_on_content_and_flags(tmp_path):
+    cache = md.RenderCache(str(tmp_path))
+    keys = {
+        cache.key("# header", True),
+        cache.key("# header", True, prettify=True),
+        cache.key("# other", True),
+    }
+    assert len(keys) == 3
+    assert cache.key("# header", True) == cache.key("# header", True)
+
+
+def test_that_the_render_cache_evicts_the_least_recently_used_html(tmp_path):
+    cache = md.RenderCache(str(tmp_path), max_size=25)
+    cache.put("first", "x" * 10)
+    cache.put("second", "x" * 10)
+    os.utime(cache.path("first"), (0, 0))
+    os.utime(cache.path("second"), (1, 1))
+    assert cache.get("first") == "x" * 10
+    cache.put("third", "x" * 10)
+    assert cache.get("second") is None
+    assert cache.get("first") == cache.get("third") == "x" * 10
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_that_the_render_cache_only_scans_its_directory_when_it_is_too_large(tmp_path):
+    (tmp_path / "old.html").write_text("x" * 40)
+    cache = md.RenderCache(str(tmp_path), max_size=100)
+    assert cache.size == 40
+    with patch.object(md.os, "scandir", side_effect=os.scandir) as scandir:
+        for name in ("a", "b", "c", "a"):
+            cache.put(name, "x" * 15)
+        assert cache.size == 85
+        assert not scandir.called
+        cache.put("d", "x" * 30)
+        assert scandir.call_count == 1
+    # The oldest entry is removed to get back to 90% of the maximum size.
+    assert cache.size == 75 == sum(f.stat().st_size for f in tmp_path.iterdir())
+    assert not (tmp_path / "old.html").exists()
+
+
+def test_that_mapped_lines_match_the_lines_of_a_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(md, "STREAM_CHUNK_SIZE", 3)
+    filename = tmp_path / "markdown.md"
+    filename.write_bytes("# é\r\n\r\n- a\rb €\n\n*c*".encode())
+    with open(filename) as file:
+        lines = file.readlines()
+    assert md.can_map(str(filename))
+    assert list(md.read_lines(str(filename))) == lines
+    blocks = md.map_blocks(str(filename), 4)
+    assert len(blocks) > 1
+    assert [line for block in blocks for line in md.map_lines(*block)] == lines
+
+
+def test_that_empty_files_and_standard_in_are_not_mapped(tmp_path):
+    filename = tmp_path / "empty.md"
+    filename.write_text("")
+    assert not md.can_map(str(filename))
+    assert not md.can_map("-")
+    assert list(md.read_lines(str(filename))) == []
+
+
+@pytest.mark.parametrize(
+    "compression, decompress",
+    [("gzip", gzip.decompress), ("zlib", zlib.decompress)],
+)
+def test_that_compressed_output_decompresses_to_the_html(
+    compression, decompress, tmp_path, monkeypatch, capsys
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(md, "COMPRESSION_BUFFER_SIZE", 16)
+    filename = tmp_path / "markdown.md"
+    filename.write_text(md.content)
+    md.MarkdownParser(str(filename), False, False, False)
+    md.MarkdownParser(
+        str(filename), False, False, False, compression=compression, compression_level=1
+    )
+    extension = md.COMPRESSION_EXTENSIONS[compression]
+    with open("parsed.html", "rb") as html, open(
+        f"parsed.html{extension}", "rb"
+    ) as file:
+        assert decompress(file.read()) == html.read()
+
+
+def test_that_compressed_output_can_be_written_to_stdout():
+    process = subprocess.run(
+        [
+            sys.executable,
+            md.__file__,
+            "--raw",
+            "*italic*",
+            "--stdout",
+            "--compress",
+            "gzip",
+        ],
+        capture_output=True,
+    )
+    assert process.returncode == 0
+    assert b"<i>italic</i>" in gzip.decompress(process.stdout)
+
+
+def test_that_an_invalid_zstd_level_exits_with_code_1():
+    process = subprocess.run(
+        [
+            sys.executable,
+            md.__file__,
+            "--raw",
+            "*italic*",
+            "--compress",
+            "zstd",
+            "--compress-level",
+            "23",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert process.returncode == 1
+    assert process.stdout == "The zstd level must be between -131072 and 22.\n"
+
+
+@pytest.mark.parametrize(
+    "compression, level",
+    [("lz4", None), ("gzip", 20), ("zlib", -5), ("zstd", 23), ("zstd", -(1 << 17) - 1)],
+)
+def test_that_unusable_compression_raises_before_parsing(compression, level):
+    with pytest.raises(ValueError):
+        md.MarkdownParser(
+            "# a", True, False, True, compression=compression, compression_level=level
+        )
+
+
+def test_that_zstd_output_decompresses_to_the_html(tmp_path, monkeypatch, capsys):
+    zstandard = pytest.importorskip("zstandard")
+    monkeypatch.chdir(tmp_path)
+    md.MarkdownParser("# a", True, False, False)
+    md.MarkdownParser("# a", True, False, False, compression="zstd")
+    with open("parsed.html", "rb") as html, open("parsed.html.zst", "rb") as file:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        assert decompressor.decompress(file.read()) == html.read()
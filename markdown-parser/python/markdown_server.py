@@ -0,0 +1,508 @@
+import asyncio
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+from markdown_parser import HtmlPrettifier, IncrementalMarkdownParser
+
+# The number of requests which may wait for a worker before new ones are rejected.
+DEFAULT_QUEUE_SIZE = 64
+# The maximum size of a markdown document sent to the server, in bytes.
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+# Seconds allowed for a client to send the request line and headers, and the body.
+HEADER_TIMEOUT = 10
+BODY_TIMEOUT = 30
+# The maximum length of the request line or a header, and the number of headers.
+MAX_HEADER_LENGTH = 8 * 1024
+MAX_HEADERS = 100
+# The maximum length of the HTML each worker keeps in its cache of parsed blocks, as a
+# single block may be as large as a whole document.
+WORKER_CACHE_BYTES = 64 * 1024 * 1024
+
+# The parser of each worker process, which keeps the blocks of recent documents.
+_worker_parser = None
+
+
+def _start_worker() -> None:
+    """Create the parser of a worker process once, when the process starts."""
+    global _worker_parser
+    _worker_parser = IncrementalMarkdownParser(cache_bytes=WORKER_CACHE_BYTES)
+
+
+def _warm_up() -> None:
+    """Parse a short document so the first request to a worker is not slower."""
+    _render("# Warm up *markdown* [parser](https://www.example.com)", False)
+
+
+def _render(markdown: str, prettify: bool) -> str:
+    """
+    Parse the given markdown string into HTML. Runs in a worker process.
+
+    :param markdown: The markdown string to be parsed.
+    :param prettify: Boolean flag to specify whether the HTML should be prettified.
+    :returns: The HTML document, the same as that of `MarkdownParser`.
+    """
+    html = _worker_parser.render(markdown, string=True)
+    if prettify:
+        prettifier = HtmlPrettifier()
+        html = prettifier.feed(html) + prettifier.close()
+    return html
+
+
+class LatencyHistogram:
+    """
+    Counts durations into fixed buckets, reported in the Prometheus text format.
+    """
+
+    # The upper bounds of the buckets, in seconds.
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        # The last bucket counts the durations longer than every bound.
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        :param seconds: The duration to count.
+        """
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def format(self, name: str, description: str) -> List[str]:
+        """
+        :param name: The name of the metric.
+        :param description: The help text of the metric.
+        :returns: The lines describing the histogram, with cumulative buckets.
+        """
+        lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip((*self.BUCKETS, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class MarkdownServer:
+    """
+    Renders markdown over HTTP/1.1, using a pool of worker processes which stay warm
+    between requests.
+
+    POST /render: Parse the request body into HTML, prettified with `?prettify=1`.
+    GET /metrics: Request counts, queue length and latency histograms.
+    GET /health: Check that the server is running.
+
+    At most `workers + max_queue` documents are rendered or waiting at a time, further
+    requests are rejected with `503 Service Unavailable` until the queue drains, without
+    reading their body. Documents which can not be rendered, e.g. as a worker process
+    crashed, are answered with `500 Internal Server Error`, and a crashed pool of
+    workers is replaced.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+    ):
+        """
+        :param workers: The number of worker processes rendering markdown.
+        :param max_queue: The number of requests which may wait for a worker.
+        :param max_body_size: The maximum size of a request body in bytes. Larger
+            requests are rejected with `413 Content Too Large`.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_body_size = max_body_size
+        self.pool = None
+        self.server = None
+        # Documents being rendered or waiting for a worker.
+        self.pending = 0
+        self.responses: Dict[int, int] = {}
+        self.request_latency = LatencyHistogram()
+        self.render_latency = LatencyHistogram()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 8000, unix_path: str = None
+    ) -> asyncio.AbstractServer:
+        """
+        Start the worker processes, then listen for connections.
+
+        :param host: The address to listen on over TCP.
+        :param port: The port to listen on over TCP, or 0 for any free port.
+        :param unix_path: The path of a Unix socket to listen on instead of TCP.
+        :returns: The listening server.
+        """
+        loop = asyncio.get_running_loop()
+        self.pool = self.start_pool()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers))
+        )
+        if unix_path:
+            self.server = await asyncio.start_unix_server(
+                self.handle_connection, unix_path, limit=MAX_HEADER_LENGTH
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle_connection, host, port, limit=MAX_HEADER_LENGTH
+            )
+        return self.server
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        """
+        :returns: A new pool of worker processes.
+        """
+        return ProcessPoolExecutor(self.workers, initializer=_start_worker)
+
+    async def close(self) -> None:
+        """Stop listening for connections, then stop the worker processes."""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool:
+            self.pool.shutdown()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Answer the requests sent over a connection, until the client closes it or a
+        request asks for it to be closed.
+
+        :param reader: The stream to read requests from.
+        :param writer: The stream to write responses to.
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(
+                        self.read_head(reader), HEADER_TIMEOUT
+                    )
+                except (asyncio.TimeoutError, ConnectionError):
+                    break
+                except ValueError:
+                    await self.respond(writer, 431, b"Request header too large\n")
+                    break
+                if request is None:
+                    break
+
+                start = time.perf_counter()
+                method, target, version, headers = request
+                if not method:
+                    await self.respond(writer, 400, b"Malformed request line\n")
+                    break
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                if version != "HTTP/1.1":
+                    # HTTP/1.0 clients do not understand interim responses.
+                    headers.pop("expect", None)
+                status, content_type, body, keep_alive = await self.handle_request(
+                    method, target, headers, reader, writer, keep_alive
+                )
+                await self.respond(writer, status, body, content_type, keep_alive)
+                self.request_latency.observe(time.perf_counter() - start)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_head(
+        self, reader: asyncio.StreamReader
+    ) -> Union[Tuple[str, str, str, Dict[str, str]], None]:
+        """
+        Read the request line and headers of the next request.
+
+        :param reader: The stream to read the request from.
+        :returns: The method, target, HTTP version and headers, with lower case names,
+            or `None` if the client closed the connection. The method is empty if the
+            request line is malformed.
+        :raises: A `ValueError` if a line is longer than `MAX_HEADER_LENGTH`, or there
+            are more than `MAX_HEADERS` headers.
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        request_line = request_line.decode("latin-1").split()
+        if len(request_line) != 3:
+            return "", "", "", {}
+        method, target, version = request_line
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) == MAX_HEADERS:
+                raise ValueError("Too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def handle_request(
+        self,
+        method: str,
+        target: str,
+        headers: Dict[str, str],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        keep_alive: bool,
+    ) -> Tuple[int, str, bytes, bool]:
+        """
+        Read the body of a request, if any, and produce its response. A client sending
+        `Expect: 100-continue` is only told to send the body once the request is known
+        to be accepted.
+
+        :param method: The method of the request.
+        :param target: The path and query of the request.
+        :param headers: The headers of the request, with lower case names.
+        :param reader: The stream to read the body from.
+        :param writer: The stream to write a `100 Continue` interim response to.
+        :param keep_alive: Boolean flag to specify whether the client wants to send
+            more requests over the connection.
+        :returns: The status, content type and body of the response, and whether the
+            connection can be kept open.
+        """
+        url = urlsplit(target)
+        if url.path == "/health" and method == "GET":
+            return 200, "text/plain", b"ok\n", keep_alive
+        if url.path == "/metrics" and method == "GET":
+            metrics = self.format_metrics().encode()
+            return 200, "text/plain; version=0.0.4", metrics, keep_alive
+        if url.path != "/render":
+            return 404, "text/plain", b"Not found\n", keep_alive
+        if method != "POST":
+            return 405, "text/plain", b"Use POST to render markdown\n", keep_alive
+
+        # Without a length, the end of the body could not be found.
+        if "transfer-encoding" in headers or "content-length" not in headers:
+            return 411, "text/plain", b"Content-Length is required\n", False
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            return 400, "text/plain", b"Invalid Content-Length\n", False
+        if length < 0:
+            return 400, "text/plain", b"Invalid Content-Length\n", False
+        # The body is not read, so the connection can not be used again.
+        if length > self.max_body_size:
+            return 413, "text/plain", b"Markdown document too large\n", False
+        if self.pending >= self.workers + self.max_queue:
+            return 503, "text/plain", b"Too many requests, try again\n", False
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), BODY_TIMEOUT)
+        except asyncio.TimeoutError:
+            return 408, "text/plain", b"Request body timed out\n", False
+        try:
+            markdown = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return 400, "text/plain", b"The body must be UTF-8\n", keep_alive
+
+        prettify = parse_qs(url.query).get("prettify", ["0"])[0] not in ("", "0")
+        try:
+            html = await self.render(markdown, prettify)
+        except Exception as e:
+            print(f"Failed to render a document: {e!r}", file=sys.stderr)
+            return (
+                500,
+                "text/plain",
+                b"The document could not be rendered\n",
+                keep_alive,
+            )
+        return 200, "text/html; charset=utf-8", html.encode(), keep_alive
+
+    async def render(self, markdown: str, prettify: bool = False) -> str:
+        """
+        Render the given markdown in a worker process.
+
+        :param markdown: The markdown string to be parsed.
+        :param prettify: Boolean flag to specify whether the HTML should be prettified.
+        :returns: The HTML document.
+        """
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.pool, _render, markdown, prettify)
+        except BrokenProcessPool:
+            # A worker exited, and the pool can not run anything else.
+            pool, self.pool = self.pool, self.start_pool()
+            pool.shutdown(wait=False)
+            raise
+        finally:
+            self.pending -= 1
+            self.render_latency.observe(time.perf_counter() - start)
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: bytes,
+        content_type: str = "text/plain",
+        keep_alive: bool = False,
+    ) -> None:
+        """
+        Write a response, waiting while the client is slower to read it.
+
+        :param writer: The stream to write the response to.
+        :param status: The status code of the response.
+        :param body: The body of the response.
+        :param content_type: The content type of the body.
+        :param keep_alive: Boolean flag to specify whether the connection is kept open.
+        """
+        self.responses[status] = self.responses.get(status, 0) + 1
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        )
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(f"{head}\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    def format_metrics(self) -> str:
+        """
+        :returns: The metrics of the server in the Prometheus text format.
+        """
+        lines = [
+            "# HELP markdown_server_responses_total Responses sent, by status code.",
+            "# TYPE markdown_server_responses_total counter",
+        ]
+        for status in sorted(self.responses):
+            lines.append(
+                f'markdown_server_responses_total{{status="{status}"}} '
+                f"{self.responses[status]}"
+            )
+        lines += [
+            "# HELP markdown_server_pending_renders Documents being rendered or queued.",
+            "# TYPE markdown_server_pending_renders gauge",
+            f"markdown_server_pending_renders {self.pending}",
+            "# HELP markdown_server_render_capacity Documents rendered or queued at most.",
+            "# TYPE markdown_server_render_capacity gauge",
+            f"markdown_server_render_capacity {self.workers + self.max_queue}",
+        ]
+        lines += self.request_latency.format(
+            "markdown_server_request_seconds",
+            "Time from reading a request to writing its response.",
+        )
+        lines += self.render_latency.format(
+            "markdown_server_render_seconds",
+            "Time rendering a document, including waiting for a worker.",
+        )
+        return "\n".join(lines) + "\n"
+
+
+async def serve(
+    server: MarkdownServer, host: str, port: int, unix_path: str = None
+) -> None:
+    """
+    Run the server until the process is interrupted.
+
+    :param server: The server to run.
+    :param host: The address to listen on over TCP.
+    :param port: The port to listen on over TCP.
+    :param unix_path: The path of a Unix socket to listen on instead of TCP.
+    """
+    listening = await server.start(host, port, unix_path)
+    print(f"Listening on {unix_path or f'http://{host}:{port}'}", file=sys.stderr)
+    try:
+        await listening.serve_forever()
+    finally:
+        await server.close()
+
+
+def show_help_message():
+    """Display a help message and exit the program."""
+    print(
+        f"""
+Serves the markdown parser over HTTP/1.1, rendering documents in a pool of worker
+processes.
+
+usage: python markdown_server.py [--help] [--host <address>] [--port <port>]
+                                 [--unix <path/to/socket>]
+                                 [--workers <number of processes>]
+                                 [--queue <requests>] [--max-size <bytes>]
+
+--help: Display this help message and exit.
+--host: The address to listen on. Defaults to 127.0.0.1.
+--port: The port to listen on. Defaults to 8000.
+--unix: Listen on the given Unix socket instead of TCP.
+--workers: The number of worker processes. Defaults to 1.
+--queue: The number of requests which may wait for a worker, further ones are
+         rejected with 503 until the queue drains. Defaults to {DEFAULT_QUEUE_SIZE}.
+--max-size: The maximum size of a markdown document in bytes, larger ones are
+            rejected with 413. Defaults to {DEFAULT_MAX_BODY_SIZE}.
+
+Endpoints:
+POST /render[?prettify=1]: Render the markdown in the request body to HTML.
+GET /metrics: Response counts, queue length and latency histograms, in the
+              Prometheus text format.
+GET /health: Responds with `ok`.
+
+Example usage:
+python markdown_server.py --port 8000 --workers 4 &
+curl --data-binary @markdown.md http://127.0.0.1:8000/render
+
+Exit Codes:
+0 - OK
+1 - Erroneous input
+
+Author: Marios Yiannakou, GitHub: @Mariosyian"""
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    flags = {
+        "help": "--help" in sys.argv,
+        "host": "--host" in sys.argv,
+        "port": "--port" in sys.argv,
+        "unix": "--unix" in sys.argv,
+        "workers": "--workers" in sys.argv,
+        "queue": "--queue" in sys.argv,
+        "max_size": "--max-size" in sys.argv,
+    }
+
+    if flags["help"]:
+        show_help_message()
+
+    def argument(flag: str, default: str) -> str:
+        return (
+            sys.argv[sys.argv.index(flag) + 1]
+            if flags[flag[2:].replace("-", "_")]
+            else default
+        )
+
+    try:
+        host = argument("--host", "127.0.0.1")
+        port = int(argument("--port", "8000"))
+        unix_path = argument("--unix", None)
+        server = MarkdownServer(
+            int(argument("--workers", "1")),
+            int(argument("--queue", str(DEFAULT_QUEUE_SIZE))),
+            int(argument("--max-size", str(DEFAULT_MAX_BODY_SIZE))),
+        )
+    except (IndexError, ValueError) as e:
+        print(f"Invalid arguments: {e}")
+        sys.exit(1)
+
+    try:
+        asyncio.run(serve(server, host, port, unix_path))
+    except KeyboardInterrupt:
+        pass
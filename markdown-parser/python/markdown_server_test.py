@@ -0,0 +1,182 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import markdown_parser as md
+import markdown_server as server
+import pytest
+
+
+async def request(reader, writer, method, target, body=b""):
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.lower()] = value.strip()
+    response_body = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), headers, response_body
+
+
+def run_with_server(test, unix_path=None, **options):
+    async def run():
+        markdown_server = server.MarkdownServer(**options)
+        listening = await markdown_server.start("127.0.0.1", 0, unix_path)
+        try:
+            if unix_path:
+                reader, writer = await asyncio.open_unix_connection(unix_path)
+            else:
+                port = listening.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            try:
+                await test(markdown_server, reader, writer)
+            finally:
+                writer.close()
+        finally:
+            await markdown_server.close()
+
+    asyncio.run(run())
+
+
+def test_that_the_server_renders_markdown_like_the_parser(capsys):
+    parser = md.MarkdownParser(md.content, True, False, True)
+    capsys.readouterr()
+
+    async def test(markdown_server, reader, writer):
+        # Several requests over the same connection.
+        for _ in range(2):
+            status, headers, body = await request(
+                reader, writer, "POST", "/render", md.content.encode()
+            )
+            assert status == 200
+            assert headers["connection"] == "keep-alive"
+            assert body.decode() == parser.raw_html
+
+    run_with_server(test)
+
+
+def test_that_the_server_listens_on_a_unix_socket(tmp_path):
+    async def test(markdown_server, reader, writer):
+        status, _, body = await request(reader, writer, "GET", "/health")
+        assert (status, body) == (200, b"ok\n")
+
+    run_with_server(test, str(tmp_path / "server.sock"))
+
+
+@pytest.mark.parametrize(
+    "method, target, body, status",
+    [
+        ("GET", "/render", b"", 405),
+        ("GET", "/missing", b"", 404),
+        ("POST", "/render", b"x" * 101, 413),
+        ("POST", "/render", b"\xff", 400),
+    ],
+)
+def test_that_the_server_rejects_invalid_requests(method, target, body, status):
+    async def test(markdown_server, reader, writer):
+        assert (await request(reader, writer, method, target, body))[0] == status
+
+    run_with_server(test, max_body_size=100)
+
+
+def test_that_the_server_rejects_requests_when_the_queue_is_full():
+    async def test(markdown_server, reader, writer):
+        markdown_server.pending = markdown_server.workers
+        status, headers, _ = await request(reader, writer, "POST", "/render", b"# a")
+        assert status == 503
+        assert headers["retry-after"] == "1"
+        # The body was not read.
+        assert headers["connection"] == "close"
+
+        markdown_server.pending = 0
+        port = markdown_server.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        assert (await request(reader, writer, "POST", "/render", b"# a"))[0] == 200
+        writer.close()
+
+    run_with_server(test, max_queue=0)
+
+
+def test_that_the_server_asks_for_the_body_only_when_it_accepts_the_request():
+    head = b"POST /render %s\r\nExpect: 100-continue\r\nContent-Length: 3\r\n\r\n"
+
+    async def test(markdown_server, reader, writer):
+        writer.write(head % b"HTTP/1.1")
+        assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 100 Continue\r\n\r\n"
+        writer.write(b"# a")
+        assert (await reader.readline()).split()[1] == b"200"
+
+        # A full queue rejects the request before the body is sent.
+        markdown_server.pending = markdown_server.workers
+        port = markdown_server.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head % b"HTTP/1.1")
+        assert (await reader.readline()).split()[1] == b"503"
+        writer.close()
+
+        # HTTP/1.0 clients send the body without waiting.
+        markdown_server.pending = 0
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head % b"HTTP/1.0" + b"# a")
+        assert (await reader.readline()).split()[1] == b"200"
+        writer.close()
+
+    run_with_server(test, max_queue=0)
+
+
+def test_that_the_server_times_out_slow_request_bodies(monkeypatch):
+    monkeypatch.setattr(server, "BODY_TIMEOUT", 0.1)
+
+    async def test(markdown_server, reader, writer):
+        writer.write(b"POST /render HTTP/1.1\r\nContent-Length: 10\r\n\r\n# a")
+        status_line = await reader.readline()
+        assert status_line.split()[1] == b"408"
+
+    run_with_server(test)
+
+
+def test_that_the_server_replaces_crashed_workers(capsys):
+    async def test(markdown_server, reader, writer):
+        loop = asyncio.get_running_loop()
+        with pytest.raises(BrokenProcessPool):
+            await loop.run_in_executor(markdown_server.pool, os._exit, 1)
+
+        status, _, _ = await request(reader, writer, "POST", "/render", b"# a")
+        assert status == 500
+        assert "BrokenProcessPool" in capsys.readouterr().err
+        assert (await request(reader, writer, "POST", "/render", b"# a"))[0] == 200
+
+    run_with_server(test)
+
+
+def test_that_the_server_reports_metrics():
+    async def test(markdown_server, reader, writer):
+        await request(reader, writer, "POST", "/render", b"*a*")
+        status, _, body = await request(reader, writer, "GET", "/metrics")
+        metrics = body.decode().splitlines()
+        assert status == 200
+        assert 'markdown_server_responses_total{status="200"} 1' in metrics
+        assert 'markdown_server_render_seconds_bucket{le="+Inf"} 1' in metrics
+        assert "markdown_server_render_seconds_count 1" in metrics
+        assert "markdown_server_pending_renders 0" in metrics
+
+    run_with_server(test)
+
+
+def test_latency_histogram_buckets_are_cumulative():
+    histogram = server.LatencyHistogram()
+    for seconds in (0.0005, 0.002, 0.002, 100):
+        histogram.observe(seconds)
+    lines = histogram.format("latency", "Latency.")
+    assert 'latency_bucket{le="0.001"} 1' in lines
+    assert 'latency_bucket{le="0.0025"} 3' in lines
+    assert 'latency_bucket{le="10"} 3' in lines
+    assert 'latency_bucket{le="+Inf"} 4' in lines
+    assert "latency_count 4" in lines